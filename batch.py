@@ -0,0 +1,391 @@
+# batch.py
+# Transcribes a whole back catalogue from the command line: a directory of audio files, a
+# manifest of paths and URLs, or a podcast feed. For example:
+#   python batch.py --dir archive/ --output transcriptions/archive
+#   python batch.py --feed https://example.com/feed.xml --limit 100 --transcriptions 16 --llm 24
+# Each episode's Deepgram response, then its transcript, is saved under --output as soon as
+# it is ready, so running the same command again after an interruption only does the work
+# that is left. Ctrl+C stops new episodes from starting and waits for those in progress;
+# press it again to quit straight away.
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from werkzeug.utils import secure_filename
+
+from checkpoint_utils import ChunkCheckpoint
+from feed_utils import iter_episodes
+from transcription_utils import (
+    limit_llm_concurrency,
+    stream_post_process,
+    transcribe_audio_file_requests,
+    transcribe_audio_url_requests,
+)
+from upload_utils import UPLOAD_CHUNK_SIZE
+
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".m4a", ".aac", ".flac", ".ogg", ".opus", ".mp4", ".webm"}
+# Episode states, in the order an episode moves through them
+STATES = (
+    "queued",
+    "uploading",
+    "transcribing",
+    "transcribed",
+    "post_processing",
+    "done",
+    "skipped",
+    "failed",
+)
+FINISHED_STATES = ("done", "skipped", "failed")
+
+
+def is_url(source):
+    return urlsplit(source).scheme in ("http", "https")
+
+
+def find_episodes(directory=None, manifest=None, feed=None, limit=None):
+    """
+    List the episodes to transcribe.
+
+    Args:
+        directory (str, optional): A directory searched, with its subdirectories, for audio files.
+        manifest (str, optional): A text file listing one audio file path (relative to the
+            manifest) or URL per line. Blank lines and lines starting with # are skipped.
+        feed (str, optional): A podcast feed URL; its episodes are taken newest first.
+        limit (int, optional): The most episodes to take from the feed.
+
+    Returns:
+        list: Each episode as a dict of its "source" (a file path or URL), "title", and
+            "name", which its saved files are named after. Names are derived from the
+            source, so they stay the same from one run to the next.
+    """
+    sources = []
+    if directory:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                if os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS:
+                    path = os.path.join(root, filename)
+                    sources.append((path, os.path.relpath(path, directory)))
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if is_url(line):
+                    sources.append((line, unquote(os.path.basename(urlsplit(line).path)) or line))
+                else:
+                    sources.append((os.path.join(base, line), line))
+    if feed:
+        for index, item in enumerate(iter_episodes(feed)):
+            if limit and index >= limit:
+                break
+            sources.append((item["url"], item["title"] or item["url"]))
+
+    episodes = {}
+    for source, title in sources:
+        stem, extension = os.path.splitext(title)
+        if extension.lower() in AUDIO_EXTENSIONS:
+            title = stem
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:8]
+        name = f"{(secure_filename(title) or 'episode')[:80]}-{digest}"
+        episodes.setdefault(name, {"source": source, "title": title, "name": name})
+    return list(episodes.values())
+
+
+class UploadSlot:
+    """One of a limited number of uploads in flight, released once its body has been sent."""
+
+    def __init__(self, slots):
+        self._slots = slots
+        self._released = False
+        self._lock = threading.Lock()
+        slots.acquire()
+
+    def release(self):
+        with self._lock:
+            if not self._released:
+                self._released = True
+                self._slots.release()
+
+
+class BatchRun:
+    """
+    Transcribes a list of episodes, with separate limits for each kind of outside work.
+
+    Episodes move through two pools. The transcription pool holds one Deepgram request
+    per thread, from upload until the transcript comes back, so its size limits the
+    transcriptions pending at Deepgram. Within it, only a limited number of requests may
+    be sending audio at once, so uploads don't compete for bandwidth. Transcribed episodes
+    then move to the post-processing pool, and the chunks being sent to the LLM are
+    capped across all of them (see limit_llm_concurrency).
+
+    Each episode's Deepgram response is saved as <name>.deepgram.json, and then its
+    transcript as <name>.md, each written under a temporary name and renamed when
+    complete. An episode whose transcript exists is skipped, and one whose response
+    exists goes straight to post-processing.
+    """
+
+    def __init__(
+        self,
+        episodes,
+        output_dir,
+        deepgram_api_key,
+        custom_vocab=None,
+        uploads=4,
+        transcriptions=8,
+        post_process=4,
+        llm=8,
+        attempts=3,
+        keep_responses=False,
+    ):
+        self.episodes = episodes
+        self.output_dir = output_dir
+        self.deepgram_api_key = deepgram_api_key
+        self.custom_vocab = custom_vocab or []
+        self.llm = llm
+        self.attempts = attempts
+        self.keep_responses = keep_responses
+        self.states = {episode["name"]: "queued" for episode in episodes}
+        self.errors = {}
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._upload_slots = threading.BoundedSemaphore(uploads)
+        self._transcribe_pool = ThreadPoolExecutor(transcriptions, thread_name_prefix="transcribe")
+        self._post_process_pool = ThreadPoolExecutor(post_process, thread_name_prefix="post-process")
+        limit_llm_concurrency(llm)
+        os.makedirs(output_dir, exist_ok=True)
+
+    def response_path(self, episode):
+        return os.path.join(self.output_dir, f"{episode['name']}.deepgram.json")
+
+    def transcript_path(self, episode):
+        return os.path.join(self.output_dir, f"{episode['name']}.md")
+
+    def run(self, progress_interval=30):
+        """
+        Transcribe every episode, printing a progress summary every progress_interval
+        seconds, and return once all have finished or failed.
+        """
+        self.start_time = time.perf_counter()
+        for episode in self.episodes:
+            if os.path.exists(self.transcript_path(episode)):
+                self._set_state(episode, "skipped")
+            elif os.path.exists(self.response_path(episode)):
+                self._set_state(episode, "transcribed")
+                self._post_process_pool.submit(self._post_process, episode)
+            else:
+                self._transcribe_pool.submit(self._transcribe, episode)
+        self._check_finished()
+        try:
+            while not self._finished.wait(progress_interval):
+                print(self.progress())
+        finally:
+            self._transcribe_pool.shutdown(wait=False, cancel_futures=True)
+            self._post_process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self):
+        """Stop starting new episodes. Episodes already in progress are finished."""
+        self.stopping.set()
+        self._transcribe_pool.shutdown(wait=False, cancel_futures=True)
+        self._post_process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def progress(self):
+        """Summarise how many episodes are in each state, and estimate the time left."""
+        with self._lock:
+            counts = {state: 0 for state in STATES}
+            for state in self.states.values():
+                counts[state] += 1
+        elapsed = time.perf_counter() - self.start_time
+        finished = counts["done"] + counts["failed"]
+        remaining = len(self.episodes) - finished - counts["skipped"]
+        summary = ", ".join(f"{count} {state}" for state, count in counts.items() if count)
+        if counts["done"] and remaining:
+            seconds_left = remaining * elapsed / finished
+            summary += f"; about {seconds_left / 60:.0f} minutes left"
+        return f"[{elapsed / 60:.1f} min] {summary}"
+
+    def _set_state(self, episode, state, error=None):
+        with self._lock:
+            self.states[episode["name"]] = state
+            if error:
+                self.errors[episode["name"]] = error
+        if state in FINISHED_STATES:
+            self._check_finished()
+
+    def _check_finished(self):
+        with self._lock:
+            if all(state in FINISHED_STATES for state in self.states.values()):
+                self._finished.set()
+
+    def _transcribe(self, episode):
+        if self.stopping.is_set():
+            return
+        for attempt in range(1, self.attempts + 1):
+            try:
+                self._request_transcript(episode)
+                break
+            except Exception as e:
+                if attempt >= self.attempts or self.stopping.is_set():
+                    print(f"Couldn't transcribe {episode['title']}: {str(e)}")
+                    self._set_state(episode, "failed", error=str(e))
+                    return
+                print(f"Transcribing {episode['title']} failed on attempt {attempt}: {str(e)}")
+                time.sleep(10 * 2 ** (attempt - 1))
+        self._set_state(episode, "transcribed")
+        try:
+            self._post_process_pool.submit(self._post_process, episode)
+        except RuntimeError:
+            # The run is stopping; the saved response is post-processed next time
+            self._set_state(episode, "failed", error="Stopped before post-processing.")
+
+    def _request_transcript(self, episode):
+        """Send an episode to Deepgram, and save the transcript it returns."""
+        source = episode["source"]
+        if is_url(source):
+            self._set_state(episode, "transcribing")
+            response = transcribe_audio_url_requests(
+                source, None, self.deepgram_api_key, self.custom_vocab, stream=True
+            )
+        else:
+            self._set_state(episode, "uploading")
+            slot = UploadSlot(self._upload_slots)
+            try:
+                with open(source, "rb") as audio_file:
+                    response = transcribe_audio_file_requests(
+                        self._read_audio(episode, audio_file, slot),
+                        None,
+                        self.deepgram_api_key,
+                        self.custom_vocab,
+                        stream=True,
+                    )
+            finally:
+                slot.release()
+
+        with response:
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"Deepgram returned status code {response.status_code}: {response.text[:200]}"
+                )
+            partial_path = self.response_path(episode) + ".partial"
+            with open(partial_path, "wb") as f:
+                for piece in response.iter_content(UPLOAD_CHUNK_SIZE):
+                    f.write(piece)
+        os.replace(partial_path, self.response_path(episode))
+
+    def _read_audio(self, episode, audio_file, slot):
+        """Yield an audio file in pieces, then free its upload slot while Deepgram transcribes."""
+        for piece in iter(lambda: audio_file.read(UPLOAD_CHUNK_SIZE), b""):
+            yield piece
+        slot.release()
+        self._set_state(episode, "transcribing")
+
+    def _post_process(self, episode):
+        if self.stopping.is_set():
+            self._set_state(episode, "failed", error="Stopped before post-processing.")
+            return
+        self._set_state(episode, "post_processing")
+        partial_path = self.transcript_path(episode) + ".partial"
+        checkpoint = ChunkCheckpoint(
+            os.path.join(self.output_dir, f"{episode['name']}.chunks.jsonl")
+        )
+        try:
+            with open(self.response_path(episode), "rb") as callback_file, open(
+                partial_path, "w"
+            ) as f:
+                stream_post_process(
+                    callback_file, f, max_workers=self.llm, checkpoint=checkpoint
+                )
+        except Exception as e:
+            print(f"Couldn't post-process {episode['title']}: {str(e)}")
+            self._set_state(episode, "failed", error=str(e))
+            return
+        os.replace(partial_path, self.transcript_path(episode))
+        checkpoint.remove()
+        if not self.keep_responses:
+            os.remove(self.response_path(episode))
+        print(f"Finished {episode['title']}: {self.transcript_path(episode)}")
+        self._set_state(episode, "done")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe many episodes at once.")
+    parser.add_argument("--dir", help="A directory of audio files (searched recursively).")
+    parser.add_argument("--manifest", help="A file listing one audio path or URL per line.")
+    parser.add_argument("--feed", help="A podcast feed URL.")
+    parser.add_argument("--limit", type=int, help="The most episodes to take from the feed.")
+    parser.add_argument("--output", default="transcriptions", help="Where transcripts are saved.")
+    parser.add_argument("--vocab", default="", help="Custom vocabulary, separated by commas.")
+    parser.add_argument(
+        "--uploads", type=int, default=4, help="Audio files being sent to Deepgram at once."
+    )
+    parser.add_argument(
+        "--transcriptions",
+        type=int,
+        default=8,
+        help="Episodes sent to Deepgram and waiting for their transcripts at once.",
+    )
+    parser.add_argument(
+        "--post-process", type=int, default=4, help="Transcripts being post-processed at once."
+    )
+    parser.add_argument(
+        "--llm",
+        type=int,
+        default=8,
+        help="Chunks being sent to the LLM at once, across all transcripts.",
+    )
+    parser.add_argument("--attempts", type=int, default=3, help="Tries for each Deepgram request.")
+    parser.add_argument(
+        "--progress-interval", type=float, default=30, help="Seconds between progress summaries."
+    )
+    parser.add_argument(
+        "--keep-responses",
+        action="store_true",
+        help="Keep each Deepgram response once its transcript has been written.",
+    )
+    args = parser.parse_args()
+    if not (args.dir or args.manifest or args.feed):
+        parser.error("Give at least one of --dir, --manifest and --feed.")
+
+    episodes = find_episodes(args.dir, args.manifest, args.feed, args.limit)
+    print(f"Found {len(episodes)} episodes.")
+    run = BatchRun(
+        episodes,
+        args.output,
+        os.getenv("DEEPGRAM_API_KEY"),
+        custom_vocab=[word.strip() for word in args.vocab.split(",") if word.strip()],
+        uploads=args.uploads,
+        transcriptions=args.transcriptions,
+        post_process=args.post_process,
+        llm=args.llm,
+        attempts=args.attempts,
+        keep_responses=args.keep_responses,
+    )
+    try:
+        run.run(args.progress_interval)
+    except KeyboardInterrupt:
+        print("Stopping: finishing the episodes in progress. Press Ctrl+C again to quit now.")
+        run.stop()
+        sys.exit(130)
+    finally:
+        print(run.progress())
+        for name, error in run.errors.items():
+            print(f"Failed: {name}: {error}")
+    if run.errors:
+        print("Run the same command again to retry the episodes that failed.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# Shows how many chunks (and so LLM requests) a transcript is split into at different
+# token budgets. Run from the repository root:
+#   python -m benchmarks.chunk_plan --budgets 1500 3000 4500
+#   python -m benchmarks.chunk_plan --transcript transcriptions/some-transcript.md
+import argparse
+
+from benchmarks.payloads import make_callback_payload
+from transcription_utils import GPT_MAX_OUTPUT_TOKENS, parse_response, plan_chunks, split_into_sentences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunk plans across token budgets.")
+    parser.add_argument("--transcript", help="A markdown transcript to plan. Defaults to a synthetic episode.")
+    parser.add_argument("--minutes", type=float, default=120, help="Length of the synthetic episode.")
+    parser.add_argument(
+        "--budgets", type=int, nargs="+", default=[600, 1500, 3000, 4500], help="Token budgets to compare."
+    )
+    args = parser.parse_args()
+
+    if args.transcript:
+        with open(args.transcript, "r") as f:
+            transcript = f.read()
+    else:
+        transcript = parse_response(make_callback_payload(minutes=args.minutes))
+    sentences = split_into_sentences(transcript)
+
+    print(f"{'budget':>7} {'chunks':>7} {'requests':>9} {'fill':>6} {'largest':>8}")
+    for budget in args.budgets:
+        plan = plan_chunks(sentences, budget)
+        note = "  (may exceed the output limit)" if budget > GPT_MAX_OUTPUT_TOKENS else ""
+        print(
+            f"{budget:>7} {len(plan['chunks']):>7} {plan['requests']:>9} {plan['fill']:>6.0%} "
+            f"{max(plan['token_counts'], default=0):>8}{note}"
+        )
+
+
+if __name__ == "__main__":
+    main()
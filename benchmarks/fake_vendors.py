@@ -0,0 +1,330 @@
+# Stand-in servers for Deepgram, OpenAI and Mailgun, so the app can be load-tested without
+# paying for (or being rate-limited by) the real services. Run from the repository root:
+#   python -m benchmarks.fake_vendors --port 8900 --openai-latency 2 --openai-429-rate 0.1
+# or, to enforce per-minute limits the way OpenAI does, --openai-rpm 500 --openai-tpm 300000
+# (without them, limits too high to reach are still reported in x-ratelimit-* headers)
+# and start the app and worker with these set:
+#   DEEPGRAM_API_URL=http://127.0.0.1:8900
+#   OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+#   MAILGUN_API_URL=http://127.0.0.1:8900
+#   CALLBACK_URL=http://127.0.0.1:5000/webhook
+#   TRANSCODE_UPLOADS=never
+# GET /_stats reports how many requests each service has answered with each status.
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from benchmarks.payloads import make_callback_payload
+
+SERVICES = ("deepgram", "openai", "mailgun")
+
+
+class VendorBehaviour:
+    """How one fake service responds: its latency, and how often it fails or rate-limits."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+    def wait(self, rng):
+        delay = self.latency + rng.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def failure(self, rng):
+        """Return the status code of a simulated failure, or None to answer normally."""
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+
+class FakeRateLimit:
+    """OpenAI's requests and tokens per minute limits, with the x-ratelimit-* headers it sends."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.levels = dict(self.limits)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, tokens):
+        """Spend a request and its tokens, if there are enough left. Returns (allowed, headers)."""
+        costs = {"requests": 1, "tokens": tokens}
+        with self.lock:
+            now = time.monotonic()
+            for kind, limit in self.limits.items():
+                self.levels[kind] = min(limit, self.levels[kind] + (now - self.updated) * limit / 60)
+            self.updated = now
+            allowed = all(self.levels[kind] >= cost for kind, cost in costs.items())
+            if allowed:
+                for kind, cost in costs.items():
+                    self.levels[kind] -= cost
+            headers = {}
+            for kind, limit in self.limits.items():
+                headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                headers[f"x-ratelimit-remaining-{kind}"] = str(int(self.levels[kind]))
+                headers[f"x-ratelimit-reset-{kind}"] = f"{(limit - self.levels[kind]) * 60 / limit:.3f}s"
+            if not allowed:
+                wait = max(
+                    (cost - self.levels[kind]) * 60 / self.limits[kind]
+                    for kind, cost in costs.items()
+                    if self.levels[kind] < cost
+                )
+                headers["retry-after-ms"] = str(int(wait * 1000) + 1)
+        return allowed, headers
+
+
+class FakeVendorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, address, behaviours, callback_delay, callback_minutes, callback_retries, openai_limit=None
+    ):
+        super().__init__(address, FakeVendorHandler)
+        self.behaviours = behaviours
+        self.openai_limit = openai_limit
+        self.callback_delay = callback_delay
+        self.callback_minutes = callback_minutes
+        self.callback_retries = callback_retries
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.rng = random.Random()
+        self.session = requests.Session()
+
+    def count(self, service, status):
+        with self.lock:
+            self.counts[f"{service} {status}"] += 1
+
+    def send_callback(self, callback_url, request_id):
+        """Deliver a transcript to the app's webhook, retrying when asked to, as Deepgram does."""
+        time.sleep(self.callback_delay)
+        seed = uuid.UUID(request_id).int % 10000
+        payload = make_callback_payload(minutes=self.callback_minutes, seed=seed)
+        payload["metadata"]["request_id"] = request_id
+        body = json.dumps(payload).encode("utf-8")
+        for _ in range(self.callback_retries + 1):
+            try:
+                response = self.session.post(
+                    callback_url, data=body, headers={"Content-Type": "application/json"}, timeout=60
+                )
+                status = response.status_code
+            except requests.RequestException:
+                response, status = None, "error"
+            self.count("callback", status)
+            if status == 200:
+                return
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            time.sleep(float(retry_after or 5))
+
+
+class FakeVendorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            with self.server.lock:
+                self.respond(200, dict(self.server.counts))
+        else:
+            self.respond(404, {"error": "Not found"})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/v1/listen":
+            service = "deepgram"
+        elif path.endswith("/chat/completions"):
+            service = "openai"
+        elif path.startswith("/v3/") and path.endswith("/messages"):
+            service = "mailgun"
+        else:
+            self.read_body()
+            self.respond(404, {"error": "Not found"})
+            return
+
+        # Only chat completions need their request body; uploads are read and dropped
+        body = self.read_body(keep=service == "openai")
+        headers = {}
+        if service == "openai" and self.server.openai_limit is not None:
+            request = json.loads(body)
+            # Counted as OpenAI does: the prompt, plus all of max_tokens
+            tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+            allowed, headers = self.server.openai_limit.take(tokens + request.get("max_tokens", 0))
+            if not allowed:
+                self.server.count(service, 429)
+                self.respond(429, {"error": {"message": "Rate limit reached"}}, headers)
+                return
+        behaviour = self.server.behaviours[service]
+        behaviour.wait(self.server.rng)
+        failure = behaviour.failure(self.server.rng)
+        if failure is not None:
+            self.server.count(service, failure)
+            if failure == 429:
+                headers = {**headers, "Retry-After": str(behaviour.retry_after)}
+            self.respond(failure, {"error": "Simulated failure"}, headers)
+            return
+        self.server.count(service, 200)
+        getattr(self, f"answer_{service}")(body, headers)
+
+    def answer_deepgram(self, body, headers):
+        query = parse_qs(urlsplit(self.path).query)
+        request_id = str(uuid.uuid4())
+        callback_url = query.get("callback", [None])[0]
+        if callback_url is None:
+            # Without a callback, Deepgram answers with the transcript itself
+            payload = make_callback_payload(minutes=self.server.callback_minutes)
+            payload["metadata"]["request_id"] = request_id
+            self.respond(200, payload, headers)
+            return
+        threading.Thread(
+            target=self.server.send_callback, args=(callback_url, request_id), daemon=True
+        ).start()
+        self.respond(200, {"request_id": request_id}, headers)
+
+    def answer_openai(self, body, headers):
+        request = json.loads(body)
+        content = request["messages"][-1]["content"]
+        # Roughly four characters to a token
+        prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+        completion_tokens = len(content) // 4
+        self.respond(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+            headers,
+        )
+
+    def answer_mailgun(self, body, headers):
+        self.respond(200, {"id": f"<{uuid.uuid4().hex}@fake>", "message": "Queued. Thank you."}, headers)
+
+    def read_body(self, keep=True):
+        pieces = []
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                piece = self.rfile.read(size)
+                if keep:
+                    pieces.append(piece)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining > 0:
+                piece = self.rfile.read(min(remaining, 1024 * 1024))
+                if not piece:
+                    break
+                remaining -= len(piece)
+                if keep:
+                    pieces.append(piece)
+        return b"".join(pieces)
+
+    def respond(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run stand-in Deepgram, OpenAI and Mailgun servers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    for service in SERVICES:
+        parser.add_argument(
+            f"--{service}-latency", type=float, default=0.0, help=f"Seconds {service} takes to answer."
+        )
+        parser.add_argument(
+            f"--{service}-jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds."
+        )
+        parser.add_argument(
+            f"--{service}-error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500."
+        )
+        parser.add_argument(
+            f"--{service}-429-rate", type=float, default=0.0, help="Fraction of requests answered with a 429."
+        )
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s.")
+    parser.add_argument(
+        "--openai-rpm", type=int, default=0, help="OpenAI requests allowed per minute (0 for a limit too high to reach)."
+    )
+    parser.add_argument(
+        "--openai-tpm", type=int, default=0, help="OpenAI tokens allowed per minute (0 for a limit too high to reach)."
+    )
+    parser.add_argument(
+        "--callback-delay", type=float, default=5.0, help="Seconds before Deepgram calls the webhook back."
+    )
+    parser.add_argument(
+        "--callback-minutes", type=float, default=30, help="Length of the transcripts sent back."
+    )
+    parser.add_argument(
+        "--callback-retries", type=int, default=5, help="Times a refused callback is sent again."
+    )
+    args = parser.parse_args()
+
+    behaviours = {
+        service: VendorBehaviour(
+            latency=getattr(args, f"{service}_latency"),
+            jitter=getattr(args, f"{service}_jitter"),
+            error_rate=getattr(args, f"{service}_error_rate"),
+            rate_limit_rate=getattr(args, f"{service}_429_rate"),
+            retry_after=args.retry_after,
+        )
+        for service in SERVICES
+    }
+    server = FakeVendorServer(
+        (args.host, args.port),
+        behaviours,
+        callback_delay=args.callback_delay,
+        callback_minutes=args.callback_minutes,
+        callback_retries=args.callback_retries,
+        # Limits are always reported, as OpenAI does; without them, workers would hold
+        # chunks to their assumed OPENAI_TOKENS_PER_MINUTE throughout the test
+        openai_limit=FakeRateLimit(args.openai_rpm or 10**9, args.openai_tpm or 10**12),
+    )
+    print(f"Fake vendors listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# Times the transcript hot paths on synthetic Deepgram callbacks, and saves the results so
+# they can be compared across commits. Run from the repository root:
+#   python -m benchmarks.hot_paths
+#   python -m benchmarks.hot_paths --minutes 30 240 --word-detail none
+#   python -m benchmarks.hot_paths --compare benchmarks/results/<commit>.json
+# The LLM is replaced by a stub that echoes each chunk back (after --llm-latency seconds),
+# and the chunk cache is turned off, so only this repository's code is measured.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from types import SimpleNamespace
+
+import rate_limit_utils
+import transcription_utils
+from benchmarks.payloads import WORD_FIELDS, make_callback_payload
+from transcription_utils import create_chunks, parse_response, split_into_sentences
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+
+class StubCompletions:
+    """Stands in for client.chat.completions, returning each chunk unchanged."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.with_raw_response = SimpleNamespace(create=self.create_raw)
+
+    def create(self, messages, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        message = SimpleNamespace(content=messages[-1]["content"])
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def create_raw(self, messages, **kwargs):
+        """Like with_raw_response.create: the response, with no rate limit headers."""
+        response = self.create(messages, **kwargs)
+        return SimpleNamespace(headers={}, parse=lambda: response)
+
+
+class StubClient:
+    """Stands in for the OpenAI client."""
+
+    def __init__(self, latency):
+        self.chat = SimpleNamespace(completions=StubCompletions(latency))
+
+    def with_options(self, **kwargs):
+        return self
+
+
+def stub_llm(latency):
+    """
+    Replace the OpenAI client and chunk cache used by transcription_utils, and lift the
+    rate limits, which the stub doesn't report.
+    """
+    transcription_utils._client = StubClient(latency)
+    rate_limit_utils._openai_rate_limiter = rate_limit_utils.RateLimiter(1e12, 1e12)
+    transcription_utils.get_chunk_cache = lambda: None
+
+
+def measure(run, repeats, setup=None):
+    """
+    Time run() repeats times.
+
+    Returns:
+        tuple: The last result, and a dict of the best and median times in seconds.
+    """
+    times = []
+    result = None
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        result = run()
+        times.append(time.perf_counter() - start_time)
+    return result, {"best": min(times), "median": statistics.median(times)}
+
+
+def benchmark_episode(minutes, args, work_dir):
+    """Time each hot path on one synthetic episode and return the measurements."""
+    from pipeline import process_transcript
+
+    payload = make_callback_payload(
+        minutes=minutes,
+        speakers=args.speakers,
+        sentences_per_paragraph=args.sentences_per_paragraph,
+        word_detail=args.word_detail,
+    )
+    payload_bytes = json.dumps(payload).encode("utf-8")
+    callback_path = os.path.join(work_dir, "callback.json")
+
+    def write_callback():
+        with open(callback_path, "wb") as f:
+            f.write(payload_bytes)
+
+    transcript, parse_times = measure(lambda: parse_response(payload), args.repeats)
+    sentences, split_times = measure(lambda: split_into_sentences(transcript), args.repeats)
+    chunks, chunk_times = measure(lambda: create_chunks(sentences), args.repeats)
+    # The pipeline logs every chunk, so its output is discarded while it's timed
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, pipeline_times = measure(
+            lambda: process_transcript(
+                {"request_id": payload["metadata"]["request_id"], "callback_path": callback_path}
+            ),
+            args.repeats,
+            setup=write_callback,
+        )
+    return {
+        "minutes": minutes,
+        "payload_mb": len(payload_bytes) / 1e6,
+        "sentences": len(sentences),
+        "chunks": len(chunks),
+        "timings": {
+            "parse_response": parse_times,
+            "split_into_sentences": split_times,
+            "create_chunks": chunk_times,
+            "process_transcript": pipeline_times,
+        },
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results, baseline=None):
+    """Print the best times, with the change against a baseline run where one is given."""
+    baseline_timings = {}
+    if baseline is not None:
+        for episode in baseline["episodes"]:
+            for name, timing in episode["timings"].items():
+                baseline_timings[(episode["minutes"], name)] = timing["best"]
+
+    header = f"{'minutes':>8} {'payload MB':>11} {'path':>21} {'best s':>9} {'median s':>9}"
+    if baseline is not None:
+        header += f" {'baseline s':>11} {'change':>8}"
+    print(header)
+    for episode in results["episodes"]:
+        for name, timing in episode["timings"].items():
+            line = (
+                f"{episode['minutes']:>8g} {episode['payload_mb']:>11.1f} {name:>21} "
+                f"{timing['best']:>9.4f} {timing['median']:>9.4f}"
+            )
+            previous = baseline_timings.get((episode["minutes"], name))
+            if previous:
+                line += f" {previous:>11.4f} {timing['best'] / previous - 1:>+8.1%}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the transcript hot paths.")
+    parser.add_argument(
+        "--minutes", type=float, nargs="+", default=[30, 120], help="Episode lengths to benchmark."
+    )
+    parser.add_argument("--speakers", type=int, default=2, help="Speakers in each episode.")
+    parser.add_argument(
+        "--sentences-per-paragraph", type=int, default=4, help="Sentences in each paragraph."
+    )
+    parser.add_argument(
+        "--word-detail",
+        choices=sorted(WORD_FIELDS),
+        default="full",
+        help="How much word-level detail the callbacks carry.",
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per path.")
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.0, help="Seconds the stubbed LLM takes per chunk."
+    )
+    parser.add_argument(
+        "--output",
+        help=f"Where to save the results. Defaults to {RESULTS_DIR}/<commit>.json.",
+    )
+    parser.add_argument("--compare", help="A saved results file to compare against.")
+    args = parser.parse_args()
+
+    commit = current_commit()
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"{commit}.json"))
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    stub_llm(args.llm_latency)
+    results = {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {
+            "speakers": args.speakers,
+            "sentences_per_paragraph": args.sentences_per_paragraph,
+            "word_detail": args.word_detail,
+            "repeats": args.repeats,
+            "llm_latency": args.llm_latency,
+            "chunk_token_budget": transcription_utils.CHUNK_TOKEN_BUDGET,
+            "post_process_workers": int(os.getenv("POST_PROCESS_WORKERS", "4")),
+        },
+        "episodes": [],
+    }
+
+    # The pipeline writes transcripts, jobs and emails relative to the working directory,
+    # so it runs in a scratch directory with its own database and no email recipient
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ["DATABASE_PATH"] = os.path.join(work_dir, "benchmark.db")
+        os.environ["TEST_EMAIL"] = ""
+        os.chdir(work_dir)
+        try:
+            for minutes in args.minutes:
+                results["episodes"].append(benchmark_episode(minutes, args, work_dir))
+        finally:
+            os.chdir(original_dir)
+
+    print_results(results, baseline)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Reports what importing the app's entry points costs at startup, broken down by the
+# top-level packages they pull in. Run from the repository root:
+#   python -m benchmarks.import_time
+#   python -m benchmarks.import_time --modules flask_app --baseline HEAD~1
+# --baseline measures another commit (extracted with git archive) alongside the working tree.
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from collections import defaultdict
+
+
+def measure_import(module, cwd, env):
+    """
+    Import module in a fresh interpreter with -X importtime.
+
+    Returns:
+        tuple: Wall-clock seconds for the import, and a dict from each top-level package
+            imported to its cumulative import time in seconds.
+    """
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - start)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    # -X importtime lists each module after the modules it imported, indented two spaces
+    # per level, so the modules the entry point imported directly are the level 1 lines
+    # just before its own line
+    packages = defaultdict(float)
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 1 and cumulative.strip().isdigit():
+            children.append((name.strip(), int(cumulative) / 1e6))
+        elif depth == 0:
+            if name.strip() == module:
+                for child, seconds in children:
+                    packages[child.split(".")[0]] += seconds
+            children = []
+    wall_seconds = float(result.stdout.strip().splitlines()[-1])
+    return wall_seconds, dict(packages)
+
+
+def profile(module, cwd, env, repeats):
+    """Return the median wall time, and the per-package times of the fastest run."""
+    runs = [measure_import(module, cwd, env) for _ in range(repeats)]
+    fastest = min(runs, key=lambda run: run[0])
+    return statistics.median(run[0] for run in runs), fastest[1]
+
+
+def extract_ref(ref, directory):
+    """Write the tree of a git ref into directory."""
+    archive = subprocess.run(["git", "archive", ref], capture_output=True, check=True).stdout
+    archive_path = os.path.join(directory, "tree.tar")
+    with open(archive_path, "wb") as f:
+        f.write(archive)
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(directory)
+    os.remove(archive_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import-time cost of the app's entry points.")
+    parser.add_argument(
+        "--modules", nargs="+", default=["flask_app", "worker"], help="Modules to import."
+    )
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per module.")
+    parser.add_argument("--top", type=int, default=12, help="Packages to list per module.")
+    parser.add_argument("--baseline", help="A git ref to compare the working tree against.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Importing the app creates its database and folders; keep those out of the way
+        env = dict(os.environ, DATABASE_PATH=os.path.join(temp_dir, "import_time.db"), DEBUG="False")
+        # Older trees create the OpenAI client on import, which needs a key
+        env.setdefault("OPENAI_API_KEY", "import-time-report")
+        trees = {"working tree": os.getcwd()}
+        if args.baseline:
+            baseline_dir = os.path.join(temp_dir, "baseline")
+            os.makedirs(baseline_dir)
+            extract_ref(args.baseline, baseline_dir)
+            trees = {args.baseline: baseline_dir, **trees}
+
+        for module in args.modules:
+            results = {}
+            for label, tree in trees.items():
+                try:
+                    results[label] = profile(module, tree, env, args.repeats)
+                except RuntimeError as e:
+                    print(f"{label}: {e}")
+            if not results:
+                continue
+
+            print(f"\nimport {module}")
+            labels = list(results)
+            print(f"{'package':>24} " + " ".join(f"{label[:14]:>14}" for label in labels))
+            packages = set().union(*(packages for _, packages in results.values()))
+            ordered = sorted(
+                packages, key=lambda name: -max(results[label][1].get(name, 0) for label in labels)
+            )
+            for name in ordered[: args.top]:
+                cells = []
+                for label in labels:
+                    seconds = results[label][1].get(name)
+                    cells.append(f"{seconds * 1000:>11.1f} ms" if seconds is not None else f"{'-':>14}")
+                print(f"{name:>24} " + " ".join(cells))
+            print(
+                f"{'total (median wall)':>24} "
+                + " ".join(f"{results[label][0] * 1000:>11.1f} ms" for label in labels)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# Drives concurrent uploads and webhook deliveries against a running app, and reports
+# throughput, latency percentiles for each stage and the resource use of the app's
+# processes. Start benchmarks.fake_vendors, the app and a worker first (see the comment at
+# the top of fake_vendors.py), then run from the repository root:
+#   python -m benchmarks.load_test --uploads 50 --webhooks 200 --concurrency 10 \
+#       --pid $(pgrep -f "flask run") --pid $(pgrep -f worker.py)
+import argparse
+import io
+import json
+import os
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.payloads import make_callback_payload
+
+# Job stages reported by GET /jobs/<id>, in the order they run
+STAGES = ("confirmation_email", "deepgram", "post_process", "completion_email")
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class ResourceSampler:
+    """
+    Samples the CPU and memory use of processes from /proc while the test runs.
+
+    Only works on Linux; elsewhere no samples are taken.
+    """
+
+    def __init__(self, pids, interval=0.5):
+        self.pids = pids
+        self.interval = interval
+        self.peak_rss = {pid: 0 for pid in pids}
+        self.cpu_seconds = {}
+        self._start_cpu = {}
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def start(self):
+        self._start_cpu = {pid: self._cpu(pid) for pid in self.pids}
+        self._start_time = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+        elapsed = time.perf_counter() - self._start_time
+        for pid in self.pids:
+            start, end = self._start_cpu.get(pid), self._cpu(pid)
+            if start is not None and end is not None:
+                self.cpu_seconds[pid] = end - start
+        return elapsed
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            for pid in self.pids:
+                rss = self._rss(pid)
+                if rss is not None:
+                    self.peak_rss[pid] = max(self.peak_rss[pid], rss)
+
+    def _cpu(self, pid):
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+
+
+def silent_wav(size_bytes):
+    """
+    Return a WAV file of about size_bytes of 16 kHz mono silence, so uploads are real audio
+    whatever TRANSCODE_UPLOADS is set to. The first samples are random, so no two are the
+    same and none is answered with an earlier transcript.
+    """
+    samples = uuid.uuid4().bytes + bytes(max(0, size_bytes - 60) // 2 * 2)
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(samples)
+    return output.getvalue()
+
+
+def upload(app_url, audio, email):
+    """Send one upload to /transcribe and return its latency and job ID."""
+    start_time = time.perf_counter()
+    response = requests.post(
+        f"{app_url}/transcribe",
+        files={"file": ("load-test.wav", audio, "audio/wav")},
+        data={"email": email},
+        headers={"Accept": "application/json"},
+        timeout=600,
+    )
+    latency = time.perf_counter() - start_time
+    job_id = response.json().get("job_id") if response.status_code == 202 else None
+    return latency, response.status_code, job_id
+
+
+def deliver_webhook(app_url, body):
+    """Send one callback to /webhook and return its latency and status."""
+    start_time = time.perf_counter()
+    response = requests.post(
+        f"{app_url}/webhook", data=body, headers={"Content-Type": "application/json"}, timeout=600
+    )
+    return time.perf_counter() - start_time, response.status_code
+
+
+def wait_for_jobs(app_url, job_ids, timeout):
+    """
+    Poll job status until every job has finished all its stages, or timeout runs out.
+
+    Returns:
+        dict: The last status of each job.
+    """
+    deadline = time.monotonic() + timeout
+    jobs = {}
+    pending = set(job_ids)
+    while pending and time.monotonic() < deadline:
+        for job_id in list(pending):
+            job = requests.get(f"{app_url}/jobs/{job_id}", timeout=30).json()
+            jobs[job_id] = job
+            stages_done = all(
+                timing.get("finished_at") for timing in job.get("stages", {}).values()
+            )
+            if job["state"] == "failed" or (job["state"] == "complete" and stages_done):
+                pending.discard(job_id)
+        if pending:
+            time.sleep(1)
+    return jobs
+
+
+def wait_for_queue(app_url, timeout):
+    """Wait until the work queue and outbox are drained, and return how long it took."""
+    start_time = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = requests.get(f"{app_url}/stats", timeout=30).json()
+        busy = sum(stats["work_queue"].get(state, 0) for state in ("pending", "leased"))
+        busy += sum(stats.get("outbox", {}).get(state, 0) for state in ("pending", "sending"))
+        if not busy:
+            break
+        time.sleep(1)
+    return time.perf_counter() - start_time
+
+
+def print_latencies(name, values):
+    if not values:
+        print(f"{name:>22} {'-':>6}")
+        return
+    print(
+        f"{name:>22} {len(values):>6} {percentile(values, 0.5):>9.3f} {percentile(values, 0.95):>9.3f} "
+        f"{percentile(values, 0.99):>9.3f} {max(values):>9.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a running app.")
+    parser.add_argument("--app-url", default="http://127.0.0.1:5000", help="Where the app is running.")
+    parser.add_argument("--uploads", type=int, default=20, help="Uploads to send to /transcribe.")
+    parser.add_argument("--upload-mb", type=float, default=5, help="Size of each upload.")
+    parser.add_argument("--webhooks", type=int, default=50, help="Callbacks to send straight to /webhook.")
+    parser.add_argument("--callback-minutes", type=float, default=30, help="Length of those callbacks.")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight at once.")
+    parser.add_argument("--email", default="load-test@example.com", help="Address uploads are sent with.")
+    parser.add_argument("--timeout", type=float, default=900, help="Seconds to wait for work to finish.")
+    parser.add_argument(
+        "--pid", type=int, action="append", default=[], help="A process to measure (repeatable)."
+    )
+    args = parser.parse_args()
+
+    sampler = ResourceSampler(args.pid)
+    sampler.start()
+    latencies = {}
+    statuses = {}
+
+    if args.uploads:
+        size = int(args.upload_mb * 1024 * 1024)
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(
+                pool.map(
+                    lambda _: upload(args.app_url, silent_wav(size), args.email),
+                    range(args.uploads),
+                )
+            )
+        upload_seconds = time.perf_counter() - start_time
+        latencies["transcribe request"] = [latency for latency, _, _ in results]
+        statuses["transcribe"] = [status for _, status, _ in results]
+        job_ids = [job_id for _, _, job_id in results if job_id]
+        jobs = wait_for_jobs(args.app_url, job_ids, args.timeout)
+        end_to_end_seconds = time.perf_counter() - start_time
+        for stage in STAGES:
+            latencies[stage] = [
+                job["stages"][stage]["duration"]
+                for job in jobs.values()
+                if job["stages"].get(stage, {}).get("duration") is not None
+            ]
+        latencies["job end to end"] = [
+            job["updated_at"] - job["created_at"] for job in jobs.values() if job["state"] == "complete"
+        ]
+        completed = len(latencies["job end to end"])
+        print(
+            f"Uploads: {args.uploads} sent in {upload_seconds:.1f} s "
+            f"({args.uploads / upload_seconds:.1f} per second); {completed} jobs completed in "
+            f"{end_to_end_seconds:.1f} s ({completed / end_to_end_seconds:.2f} per second)"
+        )
+
+    if args.webhooks:
+        bodies = []
+        for index in range(args.webhooks):
+            payload = make_callback_payload(minutes=args.callback_minutes, seed=index)
+            payload["metadata"]["request_id"] = f"load-test-{uuid.uuid4()}"
+            bodies.append(json.dumps(payload).encode("utf-8"))
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(pool.map(lambda body: deliver_webhook(args.app_url, body), bodies))
+        webhook_seconds = time.perf_counter() - start_time
+        drain_seconds = wait_for_queue(args.app_url, args.timeout)
+        latencies["webhook request"] = [latency for latency, _ in results]
+        statuses["webhook"] = [status for _, status in results]
+        print(
+            f"Webhooks: {args.webhooks} delivered in {webhook_seconds:.1f} s "
+            f"({args.webhooks / webhook_seconds:.1f} per second); queue drained "
+            f"{drain_seconds:.1f} s later ({args.webhooks / (webhook_seconds + drain_seconds):.2f} "
+            "transcripts per second)"
+        )
+
+    elapsed = sampler.stop()
+    for endpoint, codes in statuses.items():
+        counts = {code: codes.count(code) for code in sorted(set(codes))}
+        print(f"{endpoint} status codes: {counts}")
+
+    print(f"\n{'stage':>22} {'count':>6} {'p50 s':>9} {'p95 s':>9} {'p99 s':>9} {'max s':>9}")
+    for name, values in latencies.items():
+        print_latencies(name, values)
+
+    if args.pid:
+        print(f"\n{'pid':>8} {'CPU s':>8} {'CPU %':>7} {'peak RSS MB':>12}")
+        for pid in args.pid:
+            cpu = sampler.cpu_seconds.get(pid)
+            cpu_text = f"{cpu:>8.1f} {cpu / elapsed:>7.0%}" if cpu is not None else f"{'-':>8} {'-':>7}"
+            print(f"{pid:>8} {cpu_text} {sampler.peak_rss[pid] / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Compares parsing a Deepgram callback by loading the whole JSON document with parsing it
+# incrementally. Run from the repository root: `python -m benchmarks.parser_benchmark`
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.payloads import write_callback_payload
+from transcription_utils import parse_response, parse_response_stream
+
+
+def parse_loaded(path):
+    """Parse the way the webhook used to: build the whole document, then walk it."""
+    with open(path, "rb") as f:
+        data = json.load(f)
+    return data["metadata"]["request_id"], parse_response(data)
+
+
+def parse_streamed(path):
+    with open(path, "rb") as f:
+        return parse_response_stream(f)
+
+
+def measure(parse, path, repeats):
+    """Return the best time over repeats, and the peak traced memory of one run, for parse(path)."""
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = parse(path)
+        times.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    parse(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Deepgram callback parsing.")
+    parser.add_argument(
+        "--minutes",
+        type=float,
+        nargs="+",
+        default=[30, 120, 240],
+        help="Episode lengths to generate payloads for.",
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per parser.")
+    args = parser.parse_args()
+
+    print(f"{'minutes':>8} {'payload MB':>11} {'parser':>9} {'best s':>8} {'peak MB':>9}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for minutes in args.minutes:
+            path = os.path.join(temp_dir, f"callback-{minutes}.json")
+            size = write_callback_payload(path, minutes=minutes)
+            results = {}
+            for name, parse in (("loaded", parse_loaded), ("streamed", parse_streamed)):
+                results[name], best, peak = measure(parse, path, args.repeats)
+                print(
+                    f"{minutes:>8g} {size / 1e6:>11.1f} {name:>9} {best:>8.3f} {peak / 1e6:>9.1f}"
+                )
+            if results["loaded"] != results["streamed"]:
+                raise AssertionError("Streamed and loaded parsers produced different transcripts.")
+
+
+if __name__ == "__main__":
+    main()
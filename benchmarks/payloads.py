@@ -0,0 +1,119 @@
+import json
+import random
+
+WORDS = (
+    "the of and to a in that is was he for it with as his on be at by this had not are "
+    "but from or have an they which one you were her all she there would their we him "
+    "been has when who will more no if out so said what up its about into than them can "
+    "only other new some could time these two may then do first any my now such like our "
+    "over man me even most made after also did many before must through back years where "
+    "much your way well down should because each just those people how too little state "
+    "good very make world still own see men work long get here between both life being "
+    "under never day same another know while last might us great old year off come since "
+    "against go came right used take three podcast episode research really actually think"
+).split()
+
+
+# The fields each word carries at each level of word detail
+WORD_FIELDS = {
+    "full": ("word", "start", "end", "confidence", "speaker", "speaker_confidence", "punctuated_word"),
+    "timings": ("word", "start", "end", "confidence"),
+    "none": (),
+}
+
+
+def make_callback_payload(minutes=60, speakers=2, sentences_per_paragraph=4, seed=0, word_detail="full"):
+    """
+    Build a synthetic Deepgram callback with the same shape as a real one.
+
+    By default the payload includes the word-level arrays that real diarized callbacks
+    carry, which make up most of their size.
+
+    Args:
+        minutes (float): Length of the simulated episode. Speech is generated at about 150 words a minute.
+        speakers (int): Number of distinct speakers.
+        sentences_per_paragraph (int): Sentences in each paragraph.
+        seed (int): Random seed, so payloads are reproducible.
+        word_detail (str): "full" for every word field Deepgram sends with diarization,
+            "timings" for words without speaker fields, or "none" to leave out the
+            words array altogether.
+
+    Returns:
+        dict: The callback payload.
+    """
+    fields = WORD_FIELDS[word_detail]
+    rng = random.Random(seed)
+    total_words = int(minutes * 150)
+    words = []
+    paragraphs = []
+    current_time = 0.0
+    speaker = 0
+    word_count = 0
+    while word_count < total_words:
+        # Speakers usually alternate, and sometimes carry on for another paragraph
+        if rng.random() < 0.7:
+            speaker = (speaker + 1) % speakers
+        sentences = []
+        paragraph_start = current_time
+        for _ in range(sentences_per_paragraph):
+            sentence_words = []
+            sentence_start = current_time
+            for _ in range(rng.randint(6, 24)):
+                word = rng.choice(WORDS)
+                duration = rng.uniform(0.15, 0.6)
+                word_entry = {
+                    "word": word,
+                    "start": round(current_time, 3),
+                    "end": round(current_time + duration, 3),
+                    "confidence": round(rng.uniform(0.7, 1.0), 4),
+                    "speaker": speaker,
+                    "speaker_confidence": round(rng.uniform(0.5, 1.0), 4),
+                    "punctuated_word": word,
+                }
+                words.append({field: word_entry[field] for field in fields})
+                sentence_words.append(word)
+                word_count += 1
+                current_time += duration
+            text = " ".join(sentence_words).capitalize() + rng.choice([".", ".", ".", "?", "!"])
+            sentences.append({"text": text, "start": round(sentence_start, 3), "end": round(current_time, 3)})
+        paragraphs.append(
+            {
+                "sentences": sentences,
+                "speaker": speaker,
+                "num_words": sum(len(sentence["text"].split()) for sentence in sentences),
+                "start": round(paragraph_start, 3),
+                "end": round(current_time, 3),
+            }
+        )
+    transcript = " ".join(
+        sentence["text"] for paragraph in paragraphs for sentence in paragraph["sentences"]
+    )
+    alternative = {"transcript": transcript, "confidence": 0.98}
+    if fields:
+        alternative["words"] = words
+    alternative["paragraphs"] = {"transcript": transcript, "paragraphs": paragraphs}
+    return {
+        "metadata": {
+            "transaction_key": "deprecated",
+            "request_id": f"synthetic-{seed}-{minutes}",
+            "created": "2024-01-01T00:00:00.000Z",
+            "duration": round(current_time, 3),
+            "channels": 1,
+            "models": ["synthetic"],
+        },
+        "results": {
+            "channels": [
+                {
+                    "alternatives": [alternative]
+                }
+            ]
+        },
+    }
+
+
+def write_callback_payload(path, **kwargs):
+    """Write a synthetic callback (see make_callback_payload) to a JSON file and return its size in bytes."""
+    payload = json.dumps(make_callback_payload(**kwargs)).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(payload)
+    return len(payload)
@@ -0,0 +1,66 @@
+# Measures how quickly and accurately silence_utils finds split points, on synthetic
+# speech-like audio with pauses at known positions. Run from the repository root:
+#   python -m benchmarks.split_point_benchmark --hours 3
+import argparse
+import time
+
+import numpy as np
+
+from silence_utils import ANALYSIS_SAMPLE_RATE, SPLIT_SEARCH_SECONDS, find_quietest_point
+
+
+def make_speech_window(rng, seconds, pause_at, pause_seconds=0.6, sample_rate=ANALYSIS_SAMPLE_RATE):
+    """
+    Synthesise a window of speech-like audio with one sentence-length pause.
+
+    Speech is modelled as noise with a syllable-rate amplitude envelope, broken up by
+    short gaps between words. A single longer pause is placed at pause_at seconds.
+
+    Returns:
+        numpy.ndarray: int16 samples.
+    """
+    count = int(seconds * sample_rate)
+    t = np.arange(count) / sample_rate
+    syllables = 0.6 + 0.4 * np.sin(2 * np.pi * rng.uniform(3, 6) * t) ** 2
+    samples = rng.normal(0, 3000, count) * syllables
+    # Short gaps between words
+    for gap in rng.uniform(0, seconds, int(seconds * 2)):
+        start = int(gap * sample_rate)
+        samples[start : start + int(rng.uniform(0.05, 0.15) * sample_rate)] *= 0.05
+    start = int((pause_at - pause_seconds / 2) * sample_rate)
+    samples[start : start + int(pause_seconds * sample_rate)] = rng.normal(0, 30, int(pause_seconds * sample_rate))
+    return np.clip(samples, -32768, 32767).astype(np.int16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark silence-aware split point detection.")
+    parser.add_argument("--hours", type=float, default=3, help="Length of the simulated recording.")
+    parser.add_argument("--segment-minutes", type=float, default=30, help="Target segment length.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    window_seconds = 2 * SPLIT_SEARCH_SECONDS
+    boundaries = int(args.hours * 60 / args.segment_minutes) - 1
+    errors = []
+    analysis_time = 0.0
+    for _ in range(boundaries):
+        pause_at = rng.uniform(2, window_seconds - 2)
+        samples = make_speech_window(rng, window_seconds, pause_at)
+        start_time = time.perf_counter()
+        found = find_quietest_point(samples)
+        analysis_time += time.perf_counter() - start_time
+        errors.append(abs(found - pause_at))
+
+    errors = np.array(errors)
+    print(f"Recording: {args.hours:g} hours, {boundaries} boundaries, {window_seconds:g}-second search windows.")
+    print(f"Analysis time: {analysis_time:.3f} seconds in total, {1000 * analysis_time / max(boundaries, 1):.1f} ms per boundary.")
+    print(
+        f"Distance from the planted pause: median {np.median(errors):.3f} s, max {errors.max():.3f} s; "
+        f"{np.mean(errors < 0.3):.0%} within 0.3 s."
+    )
+    print("Decoding each window with ffmpeg is not included in the analysis time.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import threading
+
+
+class ChunkCache:
+    """
+    A content-addressed on-disk cache for post-processed transcript chunks.
+
+    Each entry is stored as a file named after a SHA-256 hash of everything that
+    determines the model's output (chunk text, system prompt, model and temperature).
+    When the cache grows beyond max_bytes, the least recently used entries are
+    evicted. Recency is tracked with file modification times, so it survives restarts.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def make_key(chunk, system_prompt, model, temperature):
+        """
+        Build the cache key for a chunk and the parameters it is processed with.
+
+        Args:
+            chunk (str): The chunk of transcript text.
+            system_prompt (str): The system prompt sent alongside the chunk.
+            model (str): The name of the model.
+            temperature (float): The sampling temperature.
+
+        Returns:
+            str: A hex-encoded SHA-256 digest.
+        """
+        digest = hashlib.sha256()
+        for part in (model, repr(float(temperature)), system_prompt, chunk):
+            encoded = part.encode("utf-8")
+            # Length-prefix each part so that different splits can't collide
+            digest.update(len(encoded).to_bytes(8, "big"))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Look up a processed chunk, marking it as recently used.
+
+        Args:
+            key (str): The key returned by make_key.
+
+        Returns:
+            str or None: The cached text, or None on a miss.
+        """
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def contains(self, key):
+        """Return whether an entry exists, without counting a lookup or marking it as used."""
+        return os.path.exists(self._path(key))
+
+    def put(self, key, value):
+        """
+        Store a processed chunk, evicting older entries if the cache is over its size limit.
+
+        Args:
+            key (str): The key returned by make_key.
+            value (str): The processed chunk text.
+        """
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(value)
+            # Write then rename, so a crash never leaves a half-written entry behind
+            os.replace(temp_path, path)
+            self._total_bytes += os.path.getsize(path) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        """Return the hit, miss and eviction counters along with the current cache size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self._total_bytes,
+            }
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.md")
+
+    def _entries(self):
+        """Yield (path, last_used, size) for every entry in the cache directory."""
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".md"):
+                stat = entry.stat()
+                yield entry.path, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes. Caller holds the lock."""
+        for path, _, size in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._total_bytes -= size
+            self.evictions += 1
+
+
+_chunk_cache = None
+_chunk_cache_lock = threading.Lock()
+
+
+def get_chunk_cache():
+    """
+    Return the shared chunk cache, configured from the environment.
+
+    CHUNK_CACHE_DIR sets the directory (default "chunk_cache") and CHUNK_CACHE_MAX_BYTES
+    the size limit (default 100 MB). Setting CHUNK_CACHE_MAX_BYTES to 0 disables caching.
+
+    Returns:
+        ChunkCache or None: The cache, or None if caching is disabled.
+    """
+    global _chunk_cache
+    max_bytes = int(os.getenv("CHUNK_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+    if max_bytes <= 0:
+        return None
+    with _chunk_cache_lock:
+        if _chunk_cache is None:
+            cache_dir = os.getenv("CHUNK_CACHE_DIR", "chunk_cache")
+            _chunk_cache = ChunkCache(cache_dir, max_bytes)
+        return _chunk_cache
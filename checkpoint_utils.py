@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import threading
+
+# Where the worker keeps the checkpoints of transcripts being post-processed
+CHECKPOINT_FOLDER = os.getenv("CHECKPOINT_FOLDER", "temp_checkpoints")
+
+
+class ChunkCheckpoint:
+    """
+    The post-processed chunks of one transcript, saved as each one completes.
+
+    Chunks are appended to a JSON Lines file as soon as the model returns them, in
+    whatever order they finish, so when post-processing fails part way (or the process
+    running it dies), the next attempt only sends the chunks that are missing. Each
+    entry records a hash of the text it was made from, so a saved result is only reused
+    for exactly the same chunk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._chunks = {}
+        self._needs_newline = False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._needs_newline = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line of a checkpoint written when the process died
+                        continue
+                    self._chunks[entry["index"]] = entry
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def get(self, index, chunk):
+        """
+        Return the saved result for a chunk, if it was made from the same text.
+
+        Args:
+            index (int): The chunk's position in the transcript.
+            chunk (str): The chunk's text.
+
+        Returns:
+            str or None: The processed chunk, or None if it hasn't been saved.
+        """
+        with self._lock:
+            entry = self._chunks.get(index)
+            if entry is None or entry["hash"] != _hash(chunk):
+                return None
+            self.reused += 1
+        return entry["text"]
+
+    def put(self, index, chunk, text):
+        """Save the result for a chunk, and flush it to disk before returning."""
+        entry = {"index": index, "hash": _hash(chunk), "text": text}
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self._needs_newline:
+                    f.write("\n")
+                    self._needs_newline = False
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._chunks[index] = entry
+
+    def remove(self):
+        """Delete the checkpoint, once the transcript it was for has been written."""
+        with self._lock:
+            self._chunks = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def _hash(chunk):
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
@@ -0,0 +1,28 @@
+import os
+import sqlite3
+
+DATABASE_PATH = os.getenv("DATABASE_PATH", "data/transcriber.db")
+
+
+def connect(db_path=DATABASE_PATH):
+    """
+    Open a connection to the local SQLite database.
+
+    Connections use autocommit mode (transactions are opened explicitly with BEGIN) and
+    write-ahead logging, so that the web and worker processes can read while another
+    process writes.
+
+    Args:
+        db_path (str): Path to the database file. Defaults to the DATABASE_PATH environment variable.
+
+    Returns:
+        sqlite3.Connection: The open connection.
+    """
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
@@ -1,6 +1,12 @@
 
+import json
 import os
 import requests
+import http_utils
+from upload_utils import MultipartBody
+
+MAILGUN_API_URL = os.getenv("MAILGUN_API_URL", "https://api.eu.mailgun.net").rstrip("/")
+
 
 def send_confirmation_email(recipient_email):
     """
@@ -9,28 +15,45 @@ def send_confirmation_email(recipient_email):
     Args:
         recipient_email (str): The email address of the recipient.
 
+    Returns:
+        requests.Response: The response from the email API.
+    """
+    return send_confirmation_emails([recipient_email])
+
+
+def send_confirmation_emails(recipient_emails):
+    """
+    Sends the confirmation email to several recipients in a single Mailgun request.
+
+    Mailgun's batch sending (recipient-variables) delivers a separate copy to each
+    recipient, so recipients don't see each other's addresses.
+
+    Args:
+        recipient_emails (list): The email addresses of the recipients (at most 1000).
+
     Returns:
         requests.Response: The response from the email API.
     """
     mailgun_domain = os.getenv("MAILGUN_DOMAIN")
     mailgun_api_key = os.getenv("MAILGUN_API_KEY")
 
-    url = f"https://api.eu.mailgun.net/v3/{mailgun_domain}/messages"
+    url = f"{MAILGUN_API_URL}/v3/{mailgun_domain}/messages"
 
     data = {
         "from": f"Transcription Service <noreply@{mailgun_domain}>",
-        "to": [recipient_email],
+        "to": list(recipient_emails),
         "subject": "Transcription Request Received",
         "text": "Your transcription request has been received and is being processed. We'll notify you when it's complete.",
+        "recipient-variables": json.dumps({email: {} for email in recipient_emails}),
     }
 
-    print(f"Sending email to {recipient_email}")
+    print(f"Sending email to {', '.join(recipient_emails)}")
     print(f"Using Mailgun URL: {url}")
     print(f"Request data: {data}")
 
     try:
-        response = requests.post(
-            url, auth=("api", mailgun_api_key), data=data, timeout=10
+        response = http_utils.post(
+            "mailgun", url, auth=("api", mailgun_api_key), data=data
         )
         print(f"Mailgun API response status: {response.status_code}")
         print(f"Mailgun API response text: {response.text}")
@@ -44,8 +67,12 @@ def send_completion_email(recipient_email, transcript_path):
     """
     Sends an email to the recipient with the completed transcript.
 
+    The transcript is streamed from disk as the request is sent, rather than read into
+    memory, and the file is closed as soon as the request finishes.
+
     Args:
         recipient_email (str): The email address of the recipient.
+        transcript_path (str): The path of the transcript to attach.
 
     Returns:
         requests.Response: The response from the email API.
@@ -53,23 +80,30 @@ def send_completion_email(recipient_email, transcript_path):
     mailgun_domain = os.getenv("MAILGUN_DOMAIN")
     mailgun_api_key = os.getenv("MAILGUN_API_KEY")
 
-    url = f"https://api.eu.mailgun.net/v3/{mailgun_domain}/messages"
+    url = f"{MAILGUN_API_URL}/v3/{mailgun_domain}/messages"
 
     data = {
         "from": f"Transcription Service <mailgun@{mailgun_domain}>",
         "to": [recipient_email],
         "subject": "Transcription Request Complete",
         "text": "Your transcription is ready, and you should find it as an attachment.\n\nThank you for using Podcast Transcripter!",
-        #"attachment": (transcript_path, open(transcript_path, "rb")),
     }
-    files = [("attachment", ("transcript.md", open(transcript_path, "rb")))]
     print(f"Sending email to {recipient_email}")
     print(f"Using Mailgun URL: {url}")
     print(f"Request data: {data}")
 
+    body = MultipartBody(
+        [(name, value) for name, values in data.items() for value in _as_list(values)],
+        files=[("attachment", "transcript.md", transcript_path, "text/markdown")],
+    )
+
     try:
-        response = requests.post(
-            url, auth=("api", mailgun_api_key), data=data, files=files, timeout=10
+        response = http_utils.post(
+            "mailgun",
+            url,
+            auth=("api", mailgun_api_key),
+            data=body,
+            headers={"Content-Type": body.content_type},
         )
         print(f"Mailgun API response status: {response.status_code}")
         print(f"Mailgun API response text: {response.text}")
@@ -77,3 +111,7 @@ def send_completion_email(recipient_email, transcript_path):
     except requests.RequestException as e:
         print(f"Error sending email: {str(e)}")
         raise
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorFull(Exception):
+    """Raised when a BoundedExecutor's backlog is full."""
+
+
+class BoundedExecutor:
+    """
+    A thread pool with a fixed number of workers and a bounded backlog.
+
+    ThreadPoolExecutor queues an unlimited amount of work. This wrapper refuses new work
+    (raising ExecutorFull) once max_workers tasks are running and max_backlog more are
+    waiting, so callers can push back instead of piling up work they can't finish.
+    """
+
+    def __init__(self, max_workers, max_backlog, thread_name_prefix=""):
+        self.max_workers = max_workers
+        self.max_backlog = max_backlog
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_backlog)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) to run on the pool.
+
+        Returns:
+            concurrent.futures.Future: The future for the call.
+
+        Raises:
+            ExecutorFull: If every worker is busy and the backlog is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorFull(
+                f"{self.max_workers} tasks running and {self.max_backlog} waiting."
+            )
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        """Stop accepting work; if wait is True, block until queued and running tasks finish."""
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,165 @@
+import ipaddress
+import os
+import socket
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin, urlsplit
+
+import http_utils
+
+# Most of a feed that is read while looking for an episode
+FEED_MAX_BYTES = int(os.getenv("FEED_MAX_BYTES", str(20 * 1024 * 1024)))
+# Feeds on private and loopback addresses are refused, so the server can't be used to
+# reach internal services. Set to True to test against a local feed
+FEED_ALLOW_PRIVATE_HOSTS = os.getenv("FEED_ALLOW_PRIVATE_HOSTS", "False").lower() == "true"
+FEED_MAX_REDIRECTS = 5
+
+
+class FeedError(Exception):
+    """A feed that couldn't be fetched, or doesn't have the episode asked for."""
+
+
+def check_audio_url(url):
+    """
+    Check that a URL is one Deepgram can fetch audio from.
+
+    Raises:
+        FeedError: If it isn't an absolute http or https URL.
+    """
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise FeedError(f"Not an http or https URL: {url}")
+
+
+def find_episode(feed_url, episode=None):
+    """
+    Find the audio of one episode in a podcast feed.
+
+    The feed is parsed as it downloads, and only read as far as the episode, so looking
+    up a recent episode doesn't download the whole back catalogue.
+
+    Args:
+        feed_url (str): The feed's URL.
+        episode (str, optional): Which episode to take: empty or "latest" for the first
+            in the feed (the newest, in almost every podcast feed), a number for that
+            many from the top (1 being the first), or else text matched against each
+            episode's GUID, or found in its title, ignoring case.
+
+    Raises:
+        FeedError: If the feed can't be fetched or parsed, or has no such episode.
+
+    Returns:
+        dict: The episode, as yielded by iter_episodes.
+    """
+    selector = (episode or "").strip()
+    if selector.lower() in ("", "latest"):
+        selector = "1"
+    position = int(selector) if selector.isdigit() else None
+
+    for index, item in enumerate(iter_episodes(feed_url), start=1):
+        if position is not None:
+            if index == position:
+                return item
+        elif selector.lower() == item["guid"].lower() or selector.lower() in item["title"].lower():
+            return item
+    raise FeedError(f"No episode matching {episode or 'latest'!r} in the feed.")
+
+
+def iter_episodes(feed_url):
+    """
+    Yield the episodes of a podcast feed that have audio, in feed order, as the feed
+    downloads. RSS items and Atom entries are both understood.
+
+    Raises:
+        FeedError: If the feed can't be fetched or parsed, or is larger than FEED_MAX_BYTES.
+
+    Yields:
+        dict: Each episode's "title", "guid" and audio "url".
+    """
+    response = _open_feed(feed_url)
+    try:
+        for item in _iter_items(_LimitedReader(response.raw, FEED_MAX_BYTES)):
+            if item["url"] is not None:
+                item["url"] = urljoin(response.url, item["url"])
+                yield item
+    except ET.ParseError as e:
+        raise FeedError(f"Couldn't parse the feed: {e}")
+    finally:
+        response.close()
+
+
+def _open_feed(feed_url):
+    """Start downloading a feed, following redirects only to public hosts."""
+    url = feed_url
+    for _ in range(FEED_MAX_REDIRECTS + 1):
+        check_audio_url(url)
+        if not FEED_ALLOW_PRIVATE_HOSTS:
+            _check_public_host(urlsplit(url).hostname)
+        try:
+            response = http_utils.get("feeds", url, stream=True, allow_redirects=False)
+        except Exception as e:
+            raise FeedError(f"Couldn't fetch the feed: {e}")
+        if response.is_redirect:
+            url = urljoin(url, response.headers["Location"])
+            response.close()
+            continue
+        if response.status_code != 200:
+            response.close()
+            raise FeedError(f"Fetching the feed returned status code {response.status_code}")
+        response.raw.decode_content = True
+        return response
+    raise FeedError("The feed redirected too many times.")
+
+
+def _check_public_host(hostname):
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(hostname, None)}
+    except socket.gaierror as e:
+        raise FeedError(f"Couldn't look up {hostname}: {e}")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            raise FeedError(f"{hostname} is not a public host.")
+
+
+def _iter_items(stream):
+    """
+    Yield each RSS item or Atom entry in a feed as a dict of its title, GUID and audio URL
+    (None if it has no audio), clearing each from memory once it has been read.
+    """
+    for _, element in ET.iterparse(stream, events=("end",)):
+        tag = _local_name(element.tag)
+        if tag not in ("item", "entry"):
+            continue
+        item = {"title": "", "guid": "", "url": None}
+        for child in element:
+            name = _local_name(child.tag)
+            if name == "title":
+                item["title"] = (child.text or "").strip()
+            elif name in ("guid", "id"):
+                item["guid"] = (child.text or "").strip()
+            elif name == "enclosure" and item["url"] is None:
+                item["url"] = child.get("url")
+            elif name == "link" and child.get("rel") == "enclosure" and item["url"] is None:
+                item["url"] = child.get("href")
+        element.clear()
+        yield item
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+class _LimitedReader:
+    """A file-like wrapper that refuses to read more than max_bytes."""
+
+    def __init__(self, stream, max_bytes):
+        self._stream = stream
+        self._remaining = max_bytes
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            raise FeedError("The feed is too large.")
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._stream.read(size)
+        self._remaining -= len(data)
+        return data
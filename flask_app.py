@@ -7,21 +7,41 @@
 # Visit the `localhost` page
 # Upload a file through the page, and keep the app running at least until Gladia returns a transcript.
 
+import hashlib
 import os
 import sys
-import threading
 import json
+import tempfile
+import time
+import uuid
 
-
-# Imports for ngrok integration
-from pyngrok import ngrok
 import requests
 from dotenv import load_dotenv
-from pydub import AudioSegment
-from alive_progress import alive_bar
-from flask import Flask, request, jsonify, render_template
-from email_utils import send_confirmation_email, send_completion_email
-from transcription_utils import parse_response, transcribe_audio_file_requests
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from werkzeug.utils import secure_filename
+from executor_utils import BoundedExecutor, ExecutorFull
+from feed_utils import FeedError, check_audio_url, find_episode
+from http_utils import pool_stats
+from metrics_utils import CONTENT_TYPE, counter, gauge, histogram, render
+from job_utils import get_job_store
+from outbox import get_outbox
+from segment_utils import (
+    SEGMENT_SECONDS,
+    get_audio_duration,
+    split_audio_segments,
+    stitch_segment_results,
+    transcribe_segments,
+)
+from transcript_store import TRANSCRIPT_REUSE, get_transcript_store, make_fingerprint
+from work_queue import WorkQueue
+from transcription_utils import (
+    read_callback_request_id,
+    transcribe_audio_file_requests,
+    transcribe_audio_url_requests,
+)
+from transcode_utils import TranscodeError, UploadBody, transcode_stats
+from upload_sessions import UploadSessionError, UploadSessions
+from upload_utils import UPLOAD_CHUNK_SIZE, StreamingFormReader
 
 
 print(f"Running in directory: {os.getcwd()}")
@@ -40,6 +60,60 @@ print(f"Gladia API Key loaded: {'Yes' if gladia_api_key else 'No'}")
 app = Flask(__name__)
 app.config["UPLOAD_FOLDER"] = "temp_uploads"
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+app.config["CALLBACK_FOLDER"] = "temp_callbacks"
+os.makedirs(app.config["CALLBACK_FOLDER"], exist_ok=True)
+
+# Stream uploads straight to Deepgram rather than saving them to UPLOAD_FOLDER first
+stream_uploads = os.getenv("STREAM_UPLOADS", "True").lower() == "true"
+# Transcribe long recordings as segments in parallel. Segmenting needs the file on disk,
+# so uploads are spooled rather than streamed when this is on
+segmented_transcription = os.getenv("SEGMENTED_TRANSCRIPTION", "False").lower() == "true"
+
+job_store = get_job_store()
+work_queue = WorkQueue()
+outbox = get_outbox()
+transcript_store = get_transcript_store()
+upload_sessions = UploadSessions(app.config["UPLOAD_FOLDER"])
+# Uploads run on this pool so requests can return straight away.
+# Its backlog is bounded, so a burst of uploads is refused rather than queued forever.
+job_executor = BoundedExecutor(
+    max_workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_backlog=int(os.getenv("JOB_BACKLOG", "32")),
+    thread_name_prefix="job",
+)
+# Beyond this many queued transcripts, the webhook asks Deepgram to retry later
+webhook_max_backlog = int(os.getenv("WEBHOOK_MAX_BACKLOG", "100"))
+# How often job event streams check for changes, backing off to the longest interval
+# while nothing changes, and how long each stream stays open before the browser is asked
+# to reconnect (which frees the server thread it holds)
+events_poll_interval = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))
+events_max_poll_interval = float(os.getenv("EVENTS_MAX_POLL_INTERVAL", "5"))
+events_stream_seconds = float(os.getenv("EVENTS_STREAM_SECONDS", "300"))
+
+UPLOAD_BYTES = counter(
+    "transcriber_upload_bytes_total",
+    "Audio bytes received from users, and sent on to Deepgram after any transcoding.",
+    ["direction"],
+)
+UPLOAD_SECONDS = histogram(
+    "transcriber_upload_seconds", "Time taken to send an upload to Deepgram.", ["outcome"]
+)
+DEEPGRAM_TURNAROUND_SECONDS = histogram(
+    "transcriber_deepgram_turnaround_seconds",
+    "Time from an upload being accepted by Deepgram to its callback arriving.",
+)
+gauge(
+    "transcriber_queue_depth",
+    "Tasks in the work queue, by state.",
+    ["state"],
+    function=lambda: {(state,): count for state, count in work_queue.depth().items()},
+)
+gauge(
+    "transcriber_outbox_depth",
+    "Emails in the outbox, by state.",
+    ["state"],
+    function=lambda: {(state,): count for state, count in outbox.depth().items()},
+)
 
 
 def get_ngrok_url():
@@ -78,68 +152,687 @@ def index():
     return render_template("index.html")
 
 
-@app.route("/transcribe", methods=["POST"])
+def get_callback_url():
+    """Return the URL Deepgram should send transcripts to."""
+    callback_url = (
+        ngrok_url + "/webhook"
+        if is_development
+        else os.getenv("CALLBACK_URL", "https://podcast-transcriber.onrender.com/webhook")
+    )
+    print(f"Callback URL: {callback_url}")
+    return callback_url
+
+
 @app.route("/transcribe", methods=["POST"])
 def transcribe():
-    vocab = request.form.get("vocab", "")
-    email = request.form.get("email")
-    file = request.files.get("file")
+    callback_url = get_callback_url()
+
+    job_id = job_store.create()
+
+    try:
+        if request.is_json:
+            # Audio given by URL only needs a small JSON body
+            data = request.get_json(silent=True)
+            form, uploaded, reused_path = (data if isinstance(data, dict) else {}), False, None
+        # Stream multipart uploads straight through to Deepgram; spool anything else to disk
+        elif (
+            stream_uploads
+            and not segmented_transcription
+            and request.mimetype == "multipart/form-data"
+            and "boundary" in request.mimetype_params
+        ):
+            form, uploaded, reused_path = stream_upload(job_id, callback_url)
+        else:
+            form, uploaded, reused_path = spool_upload(job_id, callback_url)
+
+        if not uploaded and (form.get("audio_url") or form.get("feed_url")):
+            uploaded = start_url_job(job_id, form, callback_url)
+    except ExecutorFull:
+        job_store.update(job_id, state="failed", error="Server busy.")
+        return (
+            render_template(
+                "response.html",
+                message="The server is busy right now. Please try again in a few minutes.",
+            ),
+            503,
+        )
+    except FeedError as e:
+        job_store.update(job_id, state="failed", error=str(e))
+        return render_template("response.html", message=str(e)), 400
+    except (requests.RequestException, RuntimeError) as e:
+        # A streamed upload that Deepgram refused or couldn't be reached for
+        print(f"Job {job_id} failed while uploading: {str(e)}")
+        job_store.update(job_id, state="failed", error=str(e))
+        message = "The audio couldn't be sent for transcription. Please try again later."
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify({"status": "error", "message": message, **job_links(job_id)}), 502
+        return render_template("response.html", message=message), 502
+    except ValueError as e:
+        # A streamed upload whose multipart body was malformed or cut short
+        print(f"Job {job_id} failed while reading the upload: {str(e)}")
+        job_store.update(job_id, state="failed", error=str(e))
+        message = "The upload was incomplete or malformed. Please try again."
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify({"status": "error", "message": message, **job_links(job_id)}), 400
+        return render_template("response.html", message=message), 400
+
+    if not uploaded:
+        job_store.update(job_id, state="failed", error="No file uploaded.")
+        return render_template("response.html", message="No file or URL given.")
+
+    recipient_email = form.get("email") or os.getenv("TEST_EMAIL")
+    accept_job(job_id, recipient_email, reused_path)
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(job_links(job_id)), 202
+
+    # Return a response to the user
+    return render_job_progress(job_id, recipient_email)
+
+
+def job_links(job_id):
+    """The URLs a client can follow a job's progress at."""
+    return {
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "progress_url": f"/jobs/{job_id}/progress",
+    }
+
+
+def render_job_progress(job_id, recipient_email):
+    """Render the page that shows a job's stages and transcript as they happen."""
+    links = job_links(job_id)
+    return render_template(
+        "response.html",
+        message=f"Transcription in progress. Check {recipient_email} for results.",
+        job_id=job_id,
+        status_url=links["status_url"],
+        events_url=links["events_url"],
+    )
+
+
+def accept_job(job_id, recipient_email, reused_path):
+    """
+    Record who to notify about an accepted upload, and either send them an earlier
+    transcript of it or confirm that it is being transcribed.
+    """
+    job_store.update(job_id, email=recipient_email)
+
+    if reused_path:
+        deliver_reused_transcript(job_id, recipient_email, reused_path)
+    # The confirmation email is sent by the outbox sender, not while the user waits
+    elif recipient_email:
+        outbox.enqueue("confirmation", recipient_email, job_id=job_id)
+        job_store.start_stage(job_id, "confirmation_email")
+    else:
+        print("Email message: No email provided.")
+
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """
+    Start a resumable upload. The JSON body gives the file's name and size in bytes,
+    and the vocab and email form fields.
+
+    The reply gives the upload's ID and part size. The browser then sends each part
+    with PUT /uploads/<id>/parts/<index>, several at once if it likes, and finishes
+    with POST /uploads/<id>/complete. GET /uploads/<id> lists the parts still missing,
+    so an interrupted upload can carry on where it stopped.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get("size") or 0)
+    except (TypeError, ValueError):
+        raise UploadSessionError("size must be a number of bytes.")
+    fields = {name: data.get(name) or "" for name in ("vocab", "email")}
+    filename = secure_filename(data.get("filename") or "") or "upload"
+    upload = upload_sessions.create(filename, size, fields)
+    return jsonify(upload_status(upload)), 201
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def get_upload(upload_id):
+    upload = upload_sessions.get(upload_id)
+    if upload is None:
+        raise UploadSessionError("Upload not found.", status=404)
+    return jsonify(upload_status(upload)), 200
+
+
+@app.route("/uploads/<upload_id>/parts/<int:part>", methods=["PUT"])
+def put_upload_part(upload_id, part):
+    """Write one part of a resumable upload. The body is the part's bytes."""
+    upload = upload_sessions.write_part(
+        upload_id, part, request.stream, request.content_length, UPLOAD_CHUNK_SIZE
+    )
+    return jsonify(upload_status(upload)), 200
+
+
+@app.route("/uploads/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    """
+    Start transcribing a resumable upload once all its parts have arrived.
+
+    An optional JSON body gives the vocab and email form fields as they are now, in case
+    they were changed since the upload was started. The assembled file is hashed, to look
+    for an earlier transcript, and sent to Deepgram in the background (see
+    upload_completed_file), so even a large file doesn't hold up the request.
+    """
+    data = request.get_json(silent=True)
+    upload = upload_sessions.complete(upload_id)
+    fields = dict(upload["fields"])
+    if isinstance(data, dict):
+        fields.update(
+            (name, data[name]) for name in ("vocab", "email") if isinstance(data.get(name), str)
+        )
+    job_id = job_store.create()
+    recipient_email = fields.get("email") or os.getenv("TEST_EMAIL")
+    try:
+        job_executor.submit(
+            upload_completed_file,
+            job_id,
+            upload["path"],
+            get_callback_url(),
+            parse_custom_vocab(fields.get("vocab")),
+            recipient_email,
+        )
+    except ExecutorFull:
+        # Keep the parts, so the browser can try completing the upload again later
+        upload_sessions.reopen(upload_id)
+        job_store.update(job_id, state="failed", error="Server busy.")
+        response = jsonify({"status": "busy", "message": "The server is busy. Try again shortly."})
+        response.headers["Retry-After"] = "30"
+        return response, 503
+    upload_sessions.set_job(upload_id, job_id)
+    job_store.update(job_id, email=recipient_email)
+    return jsonify(job_links(job_id)), 202
+
+
+@app.errorhandler(UploadSessionError)
+def upload_session_error(e):
+    return jsonify({"status": "error", "message": str(e)}), e.status
+
+
+def upload_status(upload):
+    """The parts of an upload's record that the browser needs."""
+    fields = (
+        "id", "size", "part_size", "parts", "missing_parts", "received_bytes", "offset", "state",
+        "job_id",
+    )
+    return {name: upload[name] for name in fields}
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify(job), 200
+
 
+@app.route("/jobs/<job_id>/progress", methods=["GET"])
+def job_progress(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return render_template("response.html", message="Job not found."), 404
+    return render_job_progress(job_id, job["email"])
+
+
+@app.route("/jobs/<job_id>/resume", methods=["POST"])
+def resume_job(job_id):
+    """
+    Run post-processing again for a job whose retries were used up.
+
+    The chunks finished before it failed were checkpointed, so only the missing ones are
+    sent to the model again.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    if (
+        job["state"] != "failed"
+        or not job["request_id"]
+        or not work_queue.retry("process_transcript", job["request_id"])
+    ):
+        return (
+            jsonify({"status": "error", "message": "Only a job whose post-processing failed can be resumed."}),
+            409,
+        )
+    job_store.update(job_id, state="transcribed", error=None)
+    print(f"Job {job_id} resumed.")
+    return jsonify(job_links(job_id)), 202
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Stream a job's progress as server-sent events.
+
+    A "job" event carries the job (as from GET /jobs/<id>) whenever its state or stages
+    change, and a "chunk" event carries each post-processed chunk of the transcript, with
+    its index as the event ID, as soon as a worker has it. An "end" event follows once
+    the job is complete or has failed. After EVENTS_STREAM_SECONDS the stream closes and
+    the browser reconnects, sending the last chunk index it saw as Last-Event-ID, so no
+    chunk is sent twice.
+    """
+    if job_store.get(job_id) is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    try:
+        last_chunk = int(request.headers.get("Last-Event-ID", "-1"))
+    except ValueError:
+        last_chunk = -1
+    return Response(
+        stream_with_context(iter_job_events(job_id, last_chunk)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def iter_job_events(job_id, last_chunk):
+    """Yield a job's events as text/event-stream, until it ends or the stream times out."""
+    deadline = time.monotonic() + events_stream_seconds
+    last_job = None
+    last_sent = time.monotonic()
+    poll_interval = events_poll_interval
+    yield "retry: 1000\n\n"
+    while True:
+        job = job_store.get(job_id)
+        if job is None:
+            return
+        changed = False
+        # Send chunks before the job, so a client sees the whole transcript before "complete"
+        for chunk in job_store.get_chunks(job_id, after=last_chunk):
+            changed = True
+            last_chunk = chunk["index"]
+            yield f"id: {last_chunk}\nevent: chunk\ndata: {json.dumps(chunk)}\n\n"
+            last_sent = time.monotonic()
+        progress = (job["state"], job["stages"], job["error"])
+        if progress != last_job:
+            changed = True
+            last_job = progress
+            yield f"event: job\ndata: {json.dumps(job)}\n\n"
+            last_sent = time.monotonic()
+        if job["state"] in ("complete", "failed"):
+            yield "event: end\ndata: {}\n\n"
+            return
+        if time.monotonic() >= deadline:
+            return
+        # A comment now and then keeps proxies from closing an idle stream
+        if time.monotonic() - last_sent >= 15:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        # Idle streams check less and less often, so they don't hold up the job and queue writes
+        if changed:
+            poll_interval = events_poll_interval
+        else:
+            poll_interval = min(poll_interval * 2, events_max_poll_interval)
+        time.sleep(poll_interval)
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Report this web process's outbound connection pools, upload transcoding, work queue and outbox."""
+    return (
+        jsonify(
+            {
+                "http_pools": pool_stats(),
+                "transcoding": transcode_stats.snapshot(),
+                "work_queue": work_queue.depth(),
+                "outbox": outbox.depth(),
+            }
+        ),
+        200,
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Report this web process's metrics in the Prometheus text format."""
+    return render(), 200, {"Content-Type": CONTENT_TYPE}
+
+
+def parse_custom_vocab(vocab):
+    """Split the comma-separated vocabulary input into a list of words."""
+    return [word.strip() for word in (vocab or "").split(",") if word.strip()]
+
+
+def stream_upload(job_id, callback_url):
+    """
+    Pipe the uploaded file from the request body to Deepgram in bounded-size pieces.
+
+    The file is never written to disk or held in memory as a whole. Because the bytes
+    come straight from the user's request, this upload runs in the request thread.
+    Form fields that arrive before the file (such as the vocabulary) are used for the
+    Deepgram request; fields after it (such as the email) are read once the upload has
+    finished.
+
+    The audio is hashed as it streams past. Its fingerprint is only known once Deepgram
+    has the whole file, so a repeat upload is still transcribed, but a transcript
+    already made from it is delivered straight away instead of being post-processed again.
+
+    Args:
+        job_id (str): The job the upload belongs to.
+        callback_url (str): The URL Deepgram should send the transcript to.
+
+    Returns:
+        tuple: The form fields (dict), whether a file was uploaded, and the path of an
+            earlier transcript of the same upload (or None).
+    """
+    reader = StreamingFormReader(request.stream, request.mimetype_params["boundary"])
+    filename = reader.read_until_file()
+    if not filename:
+        return reader.read_remaining_fields(), False, None
+
+    custom_vocab = parse_custom_vocab(reader.fields.get("vocab"))
+    audio_sha256 = upload_to_deepgram(job_id, reader.iter_file(), callback_url, custom_vocab)
+    print(f"Streamed {reader.file_bytes} bytes of {filename} to Deepgram.")
+    reused_path = find_reusable_transcript(job_id, audio_sha256, custom_vocab)
+    return reader.read_remaining_fields(), True, reused_path
+
+
+def spool_upload(job_id, callback_url):
+    """
+    Save the uploaded file to the upload folder, and send it to Deepgram in the background.
+
+    This is the fallback for requests that can't be streamed.
+
+    Raises:
+        ExecutorFull: If the background pool can't take the upload.
+
+    Args:
+        job_id (str): The job the upload belongs to.
+        callback_url (str): The URL Deepgram should send the transcript to.
+
+    Returns:
+        tuple: The form fields (dict), whether a file was uploaded, and the path of an
+            earlier transcript of the same upload (or None), in which case nothing is
+            sent to Deepgram.
+    """
+    form = request.form.to_dict()
+    file = request.files.get("file")
     if not file:
-        return render_template("response.html", message="No file uploaded.")
+        return form, False, None
 
     # Process the vocabulary input
-    custom_vocab = [word.strip() for word in vocab.split(",") if word.strip()]
+    custom_vocab = parse_custom_vocab(form.get("vocab"))
 
-    # Save the uploaded file temporarily
-    temp_file_path = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
-    file.save(temp_file_path)
+    # Save the uploaded file temporarily, under the job ID so names can't clash, hashing
+    # it on the way
+    temp_file_path = os.path.join(
+        app.config["UPLOAD_FOLDER"], f"{job_id}-{secure_filename(file.filename)}"
+    )
+    audio_hash = hashlib.sha256()
+    with open(temp_file_path, "wb") as f:
+        for piece in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b""):
+            audio_hash.update(piece)
+            f.write(piece)
 
-    callback_url = (
-        ngrok_url + "/webhook"
-        if is_development
-        else "https://podcast-transcriber.onrender.com/webhook"
+    try:
+        reused_path = start_spooled_job(
+            job_id, temp_file_path, audio_hash.hexdigest(), callback_url, custom_vocab
+        )
+    except ExecutorFull:
+        os.remove(temp_file_path)
+        raise
+    return form, True, reused_path
+
+
+def start_spooled_job(job_id, temp_file_path, audio_sha256, callback_url, custom_vocab):
+    """
+    Start the job for an upload saved to disk: reuse an earlier transcript of it, or send
+    it to Deepgram in the background. Either way the file is removed once it's done with.
+
+    Raises:
+        ExecutorFull: If the background pool can't take the upload. The file is kept.
+
+    Returns:
+        str or None: The path of an earlier transcript of the same upload, if one is reused.
+    """
+    reused_path = find_reusable_transcript(job_id, audio_sha256, custom_vocab)
+    if reused_path:
+        os.remove(temp_file_path)
+        return reused_path
+
+    job_executor.submit(upload_spooled_file, job_id, temp_file_path, callback_url, custom_vocab)
+    return None
+
+
+def start_url_job(job_id, form, callback_url):
+    """
+    Transcribe audio that Deepgram fetches itself, given either its URL ("audio_url") or
+    a podcast feed ("feed_url") and which episode to take ("episode"; see find_episode).
+
+    Only the URLs pass through this server. The feed is read, and Deepgram is asked to
+    fetch the audio, in the background.
+
+    Raises:
+        FeedError: If the URL given isn't an http or https URL, or a field of a JSON body
+            isn't a string.
+        ExecutorFull: If the background pool can't take the job.
+
+    Returns:
+        bool: True, as the job has its audio.
+    """
+    if isinstance(form.get("episode"), int) and not isinstance(form.get("episode"), bool):
+        form["episode"] = str(form["episode"])
+    for name in ("audio_url", "feed_url", "episode", "vocab", "email"):
+        if form.get(name) is not None and not isinstance(form[name], str):
+            raise FeedError(f"{name} must be a string.")
+    custom_vocab = parse_custom_vocab(form.get("vocab"))
+    audio_url = (form.get("audio_url") or "").strip()
+    feed_url = (form.get("feed_url") or "").strip()
+    check_audio_url(audio_url or feed_url)
+    job_executor.submit(
+        submit_audio_url,
+        job_id,
+        audio_url,
+        feed_url,
+        form.get("episode"),
+        callback_url,
+        custom_vocab,
     )
-    print(f"Callback URL: {callback_url}")
+    return True
 
+
+def submit_audio_url(job_id, audio_url, feed_url, episode, callback_url, custom_vocab):
+    """
+    Find a feed's episode if need be, and ask Deepgram to fetch and transcribe the audio,
+    as the job's "feed" and "submit" stages.
+    """
     try:
-        with open(temp_file_path, "rb") as audio_file:
-            # response = transcribe_deepgram_audio(audio_file, callback_url, deepgram_api_key, custom_vocab)
-            response = transcribe_audio_file_requests(
-                audio_file, callback_url, deepgram_api_key, custom_vocab
+        if feed_url:
+            with job_store.stage(job_id, "feed", state="resolving"):
+                found = find_episode(feed_url, episode)
+            audio_url = found["url"]
+            print(f"Found episode {found['title']!r} at {audio_url}.")
+        with job_store.stage(job_id, "submit", state="uploading"):
+            response = transcribe_audio_url_requests(
+                audio_url, callback_url, deepgram_api_key, custom_vocab
             )
-        print(
-            f"API response: {str(response)[:100]}..."
-        )  # Print only first 100 characters
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"Deepgram rejected the URL. Status code: {response.status_code}"
+                )
+        job_store.update(job_id, request_id=response.json().get("request_id"))
+        job_store.start_stage(job_id, "deepgram", state="transcribing")
+    except Exception as e:
+        print(f"Error submitting {audio_url or feed_url}: {str(e)}")
+        job_store.update(job_id, state="failed", error=str(e))
+
+
+def find_reusable_transcript(job_id, audio_sha256, custom_vocab):
+    """
+    Record an upload's fingerprint on its job, and look for an earlier transcript of it.
+
+    Returns:
+        str or None: The path of the earlier transcript, if reuse is on and there is one.
+    """
+    fingerprint = make_fingerprint(audio_sha256, custom_vocab)
+    job_store.update(job_id, fingerprint=fingerprint)
+    if not TRANSCRIPT_REUSE:
+        return None
+    return transcript_store.get(fingerprint)
+
+
+def deliver_reused_transcript(job_id, recipient_email, transcript_path):
+    """Complete a job with an earlier transcript of the same upload, and email it."""
+    print(f"Reusing {transcript_path} for job {job_id}.")
+    if recipient_email:
+        outbox.enqueue(
+            "completion", recipient_email, job_id=job_id, attachment_path=transcript_path
+        )
+        job_store.start_stage(job_id, "completion_email")
+    job_store.update(job_id, state="complete")
+
+
+def upload_completed_file(job_id, path, callback_url, custom_vocab, recipient_email):
+    """
+    Hash a completed resumable upload, then either reuse an earlier transcript of it or
+    send it to Deepgram, and tell the user which.
+    """
+    try:
+        audio_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            for piece in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                audio_hash.update(piece)
+        reused_path = find_reusable_transcript(job_id, audio_hash.hexdigest(), custom_vocab)
+    except Exception as e:
+        print(f"Error hashing {path}: {str(e)}")
+        job_store.update(job_id, state="failed", error=str(e))
+        os.remove(path)
+        return
+    accept_job(job_id, recipient_email, reused_path)
+    if reused_path:
+        os.remove(path)
+        return
+    upload_spooled_file(job_id, path, callback_url, custom_vocab)
+
+
+def upload_spooled_file(job_id, temp_file_path, callback_url, custom_vocab):
+    """Send a spooled upload to Deepgram, then remove it from the upload folder."""
+    try:
+        # Recordings well over one segment long are transcribed in parallel segments
+        if (
+            segmented_transcription
+            and get_audio_duration(temp_file_path) > 1.5 * SEGMENT_SECONDS
+        ):
+            transcribe_in_segments(job_id, temp_file_path, custom_vocab)
+        else:
+            with open(temp_file_path, "rb") as audio_file:
+                upload_to_deepgram(job_id, audio_file, callback_url, custom_vocab)
+    except Exception as e:
+        print(f"Error uploading {temp_file_path}: {str(e)}")
+        job_store.update(job_id, state="failed", error=str(e))
     finally:
         # Clean up the temporary file
         os.remove(temp_file_path)
 
-    recipient_email = email or os.getenv("TEST_EMAIL")
 
-    # Send a confirmation email to the user
-    if recipient_email:
-        try:
-            email_response = send_confirmation_email(recipient_email)
-            if email_response.status_code == 200:
-                email_message = "Confirmation email sent."
-            else:
-                email_message = f"Failed to send confirmation email. Status code: {email_response.status_code}"
-        except requests.Timeout:
-            email_message = "Failed to send confirmation email due to timeout."
-        except requests.RequestException as e:
-            email_message = f"Failed to send confirmation email. Error: {str(e)}"
-    else:
-        email_message = "No email provided."
-    print(f"Email message: {email_message}")
+def transcribe_in_segments(job_id, audio_path, custom_vocab):
+    """
+    Transcribe a long recording as segments in parallel, and queue the stitched result.
 
-    # Return a response to the user
-    return render_template(
-        "response.html",
-        message=f"Transcription in progress. Check {recipient_email} for results.",
+    The recording is cut without decoding (see split_audio_segments) at quiet points
+    near each segment boundary (see find_split_points), the segments are
+    transcribed concurrently, and their results are combined into a single
+    callback-shaped file that is queued for post-processing like a webhook delivery.
+
+    Args:
+        job_id (str): The job the upload belongs to.
+        audio_path (str): Path to the spooled recording.
+        custom_vocab (list): Custom vocabulary to boost.
+    """
+    # Imported here so numpy is only loaded by processes that segment recordings
+    from silence_utils import find_split_points
+
+    with tempfile.TemporaryDirectory(dir=app.config["UPLOAD_FOLDER"]) as segment_dir:
+        with job_store.stage(job_id, "segment", state="uploading"):
+            # Cut at pauses near each boundary so no words are split between segments
+            split_points = find_split_points(
+                audio_path, get_audio_duration(audio_path), SEGMENT_SECONDS
+            )
+            segments = split_audio_segments(
+                audio_path, segment_dir, split_points=split_points
+            )
+        with job_store.stage(job_id, "upload"):
+            results = transcribe_segments(segments, deepgram_api_key, custom_vocab)
+
+    request_id = f"segmented-{job_id}"
+    payload = stitch_segment_results(
+        results, [segment["start"] for segment in segments], request_id
+    )
+    callback_path = os.path.join(app.config["CALLBACK_FOLDER"], f"{request_id}.json")
+    with open(callback_path, "w") as f:
+        json.dump(payload, f)
+    job_store.update(job_id, request_id=request_id, state="transcribed")
+    work_queue.enqueue(
+        "process_transcript",
+        {"request_id": request_id, "callback_path": callback_path},
+        dedupe_key=request_id,
     )
 
 
+def upload_to_deepgram(job_id, audio_file, callback_url, custom_vocab):
+    """
+    Submit audio to Deepgram as the job's "upload" stage, and record the request ID.
+
+    The audio is transcoded to compact speech-grade audio on the way, when the
+    measurements so far say that saves time (see transcode_utils). If ffmpeg fails part
+    way through a file saved to disk, the file is sent again untranscoded. Once the upload is
+    accepted the job moves to the "transcribing" state, and the "deepgram" stage runs
+    until the webhook receives the transcript.
+
+    Args:
+        job_id (str): The job the upload belongs to.
+        audio_file: An open file, or an iterable of byte pieces.
+        callback_url (str): The URL Deepgram should send the transcript to.
+        custom_vocab (list): Custom vocabulary to boost.
+
+    Returns:
+        str: Hex SHA-256 digest of the audio as uploaded (before any transcoding).
+    """
+    with job_store.stage(job_id, "upload", state="uploading"):
+        body = UploadBody(audio_file, transcode=transcode_stats.should_transcode())
+        start_time = time.perf_counter()
+        try:
+            try:
+                response = transcribe_audio_file_requests(
+                    body, callback_url, deepgram_api_key, custom_vocab
+                )
+            except TranscodeError as e:
+                if not hasattr(audio_file, "seek"):
+                    raise
+                print(f"{e} Sending the original audio instead.")
+                audio_file.seek(0)
+                body = UploadBody(audio_file, transcode=False)
+                start_time = time.perf_counter()
+                response = transcribe_audio_file_requests(
+                    body, callback_url, deepgram_api_key, custom_vocab
+                )
+        except Exception:
+            UPLOAD_SECONDS.observe(time.perf_counter() - start_time, outcome="error")
+            raise
+        finally:
+            UPLOAD_BYTES.inc(body.input_bytes, direction="received")
+            UPLOAD_BYTES.inc(body.output_bytes, direction="sent")
+        upload_seconds = time.perf_counter() - start_time
+        UPLOAD_SECONDS.observe(
+            upload_seconds, outcome="ok" if response.status_code == 200 else "rejected"
+        )
+        transcode_stats.record(body, upload_seconds)
+        print(
+            f"API response: {str(response)[:100]}..."
+        )  # Print only first 100 characters
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"Deepgram rejected the upload. Status code: {response.status_code}"
+            )
+    request_id = response.json().get("request_id")
+    job_store.update(job_id, request_id=request_id)
+    job_store.start_stage(job_id, "deepgram", state="transcribing")
+    return body.sha256.hexdigest()
+
+
 def allowed_file(filename):
     """
     Check if the uploaded file has an allowed extension.
@@ -154,48 +847,29 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in allowed_extensions
 
 
-def process_transcript(data):
+def save_callback(stream):
     """
-    Process the transcript data received from Deepgram API.
-    
+    Copy a callback body to the callback folder in bounded-size pieces.
+
     Args:
-        data (dict): JSON data containing the transcript and metadata from Deepgram
-        
+        stream: The request body stream.
+
     Returns:
-        None: Writes transcript to file and sends email notification
+        str: The path of the saved callback.
     """
-    try:
-        response_to_md = parse_response(data)
-        transcript_id = data["metadata"]["request_id"]
-        print(f"Transcription ID: {transcript_id}. Now writing to file.")
-        os.makedirs("transcriptions", exist_ok=True)
-        transcript_path = f"transcriptions/transcript-{transcript_id}.md"
-        with open(transcript_path, "w") as f:
-            f.write(response_to_md)
-
-        recipient_email = os.getenv("TEST_EMAIL")
-        if recipient_email:
-            try:
-                email_response = send_completion_email(recipient_email, transcript_path)
-                email_message = (
-                    "Completion email sent."
-                    if email_response.status_code == 200
-                    else f"Failed to send completion email. Status code: {email_response.status_code}"
-                )
-            except requests.RequestException as e:
-                email_message = f"Failed to send completion email. Error: {str(e)}"
-        else:
-            email_message = "No email provided."
-        print(email_message)
-    except Exception as e:
-        print(f"Error processing transcript: {str(e)}")
+    callback_path = os.path.join(app.config["CALLBACK_FOLDER"], f"{uuid.uuid4().hex}.json")
+    with open(callback_path, "wb") as f:
+        while True:
+            piece = stream.read(UPLOAD_CHUNK_SIZE)
+            if not piece:
+                break
+            f.write(piece)
+    return callback_path
 
 
 @app.route("/webhook", methods=["GET", "OPTIONS", "POST"])
 def webhook():
     print("Webhook hit with method:", request.method)
-    print("Request headers:", dict(request.headers))
-    # print("Request body:", request.get_data(as_text=True))
 
     # Allow GET requests during development for testing
     if request.method == "GET":
@@ -211,21 +885,41 @@ def webhook():
     elif request.method == "POST":
         try:
 
-            data = request.json
+            # Push back while the workers are behind, before reading the body; Deepgram
+            # retries failed callbacks
+            if work_queue.backlog() >= webhook_max_backlog:
+                print("Work queue is full. Asking Deepgram to retry later.")
+                response = jsonify(
+                    {"status": "busy", "message": "Too many transcripts queued"}
+                )
+                response.headers["Retry-After"] = "60"
+                return response, 503
+
+            # Save the callback as it streams in; a worker parses it incrementally
+            callback_path = save_callback(request.stream)
+            with open(callback_path, "rb") as f:
+                request_id = read_callback_request_id(f)
+            if request_id is None:
+                os.remove(callback_path)
+                raise ValueError("Callback has no metadata.request_id")
             print("Received JSON data from Deepgram API.")
+            job = job_store.find_by_request_id(request_id)
+            deepgram_stage = job["stages"].get("deepgram") if job else None
+            if deepgram_stage and not deepgram_stage.get("finished_at"):
+                DEEPGRAM_TURNAROUND_SECONDS.observe(time.time() - deepgram_stage["started_at"])
+
+            # Queue the transcript for a worker process (see worker.py). Retried or
+            # repeated callbacks for the same request ID are only processed once.
+            data = {"request_id": request_id, "callback_path": callback_path}
+            if work_queue.enqueue("process_transcript", data, dedupe_key=request_id) is None:
+                print(f"Transcript {request_id} already queued or processed. Skipping.")
+                os.remove(callback_path)
+                message = "Webhook already received"
+            else:
+                message = "Webhook received and processing started"
 
             # Immediately return a success response
-            response = jsonify(
-                {
-                    "status": "success",
-                    "message": "Webhook received and processing started",
-                }
-            )
-
-            # Start processing in a separate thread
-            threading.Thread(target=process_transcript, args=(data,)).start()
-
-            return response, 200
+            return jsonify({"status": "success", "message": message}), 200
 
         except Exception as e:
             print(f"Error processing webhook data: {str(e)}")
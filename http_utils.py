@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics_utils import counter, histogram
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+
+DEEPGRAM_TIMEOUT = (
+    float(os.getenv("DEEPGRAM_CONNECT_TIMEOUT", "10")),
+    float(os.getenv("DEEPGRAM_READ_TIMEOUT", "1000")),
+)
+
+# Settings for each outbound service. Streamed Deepgram uploads send a generator body,
+# which can't be replayed, so they are only retried when the connection can't be made in
+# the first place. Deepgram requests with a replayable body (URL submits, and uploads of
+# whole files, which are rewound) are also retried on 429 and gateway errors, as are
+# Mailgun requests (attachments are re-read from disk); neither is retried on plain 500s,
+# which may mean the request was accepted. Podcast feeds are plain GETs, so they are
+# retried the same way.
+SERVICES = {
+    "deepgram": {
+        "timeout": DEEPGRAM_TIMEOUT,
+        "retry_statuses": (),
+    },
+    "deepgram_replayable": {
+        "timeout": DEEPGRAM_TIMEOUT,
+        "retry_statuses": (429, 502, 503, 504),
+    },
+    "mailgun": {
+        "timeout": (
+            float(os.getenv("MAILGUN_CONNECT_TIMEOUT", "5")),
+            float(os.getenv("MAILGUN_READ_TIMEOUT", "10")),
+        ),
+        "retry_statuses": (429, 502, 503, 504),
+    },
+    "feeds": {
+        "timeout": (
+            float(os.getenv("FEED_CONNECT_TIMEOUT", "5")),
+            float(os.getenv("FEED_READ_TIMEOUT", "30")),
+        ),
+        "retry_statuses": (429, 502, 503, 504),
+    },
+}
+
+REQUEST_SECONDS = histogram(
+    "transcriber_http_request_seconds",
+    "Time taken by requests to outside services, including retries.",
+    ["service", "status"],
+)
+RETRIES = counter("transcriber_http_retries_total", "Requests retried, by service.", ["service"])
+RATE_LIMITED = counter(
+    "transcriber_http_rate_limited_total", "429 responses received, by service.", ["service"]
+)
+
+_sessions = {}
+_retry_counts = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(service):
+    """
+    Return the shared, keep-alive session for an outbound service.
+
+    Each service has its own connection pool of HTTP_POOL_SIZE connections per host, so
+    connections (and their TLS handshakes) are reused across requests and threads.
+
+    Args:
+        service (str): A key of SERVICES.
+
+    Returns:
+        requests.Session: The service's session.
+    """
+    with _sessions_lock:
+        if service not in _sessions:
+            config = SERVICES[service]
+            retry = Retry(
+                total=HTTP_MAX_RETRIES,
+                connect=HTTP_MAX_RETRIES,
+                read=0,
+                status=HTTP_MAX_RETRIES if config["retry_statuses"] else 0,
+                status_forcelist=config["retry_statuses"],
+                allowed_methods=None,
+                backoff_factor=1,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[service] = session
+            _retry_counts[service] = 0
+        return _sessions[service]
+
+
+def post(service, url, **kwargs):
+    """
+    Send a POST request through a service's shared session, with its default timeouts.
+
+    Args:
+        service (str): A key of SERVICES.
+        url (str): The URL to post to.
+        **kwargs: Passed on to requests; timeout defaults to the service's (connect, read) timeouts.
+
+    Returns:
+        requests.Response: The response.
+    """
+    return send(service, "POST", url, **kwargs)
+
+
+def get(service, url, **kwargs):
+    """Send a GET request through a service's shared session, like post."""
+    return send(service, "GET", url, **kwargs)
+
+
+def send(service, method, url, **kwargs):
+    """Send a request through a service's shared session, recording its latency and retries."""
+    kwargs.setdefault("timeout", SERVICES[service]["timeout"])
+    start_time = time.perf_counter()
+    try:
+        response = get_session(service).request(method, url, **kwargs)
+    except requests.RequestException:
+        REQUEST_SECONDS.observe(time.perf_counter() - start_time, service=service, status="error")
+        raise
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start_time, service=service, status=response.status_code
+    )
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        with _sessions_lock:
+            _retry_counts[service] += len(retries.history)
+        RETRIES.inc(len(retries.history), service=service)
+        rate_limited = sum(1 for attempt in retries.history if attempt.status == 429)
+        if rate_limited:
+            RATE_LIMITED.inc(rate_limited, service=service)
+    if response.status_code == 429:
+        RATE_LIMITED.inc(service=service)
+    return response
+
+
+def pool_stats():
+    """
+    Report connection pool usage for each service that has been used.
+
+    For each host, "connections_opened" counts new connections and "requests" counts
+    requests sent, so a ratio close to 1 means connections aren't being reused (and
+    the pool may be too small for the number of concurrent requests).
+
+    Returns:
+        dict: Per-service retry counts and per-host pool usage.
+    """
+    stats = {}
+    with _sessions_lock:
+        for service, session in _sessions.items():
+            adapter = session.get_adapter("https://")
+            hosts = {}
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                hosts[f"{pool.scheme}://{pool.host}"] = {
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    # The pool's queue holds None for slots that have no connection yet
+                    "idle_connections": sum(
+                        1 for connection in list(pool.pool.queue) if connection is not None
+                    )
+                    if pool.pool is not None
+                    else 0,
+                    "max_connections": HTTP_POOL_SIZE,
+                }
+            stats[service] = {"retries": _retry_counts[service], "hosts": hosts}
+    return stats
@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from db_utils import DATABASE_PATH, connect
+from metrics_utils import histogram
+
+# Seconds after a job finishes before the chunks kept for its progress page are deleted
+JOB_CHUNKS_TTL = float(os.getenv("JOB_CHUNKS_TTL", "3600"))
+
+STAGE_SECONDS = histogram(
+    "transcriber_job_stage_seconds", "Time taken by each stage of a job.", ["stage", "outcome"]
+)
+
+
+class JobStore:
+    """
+    Tracks transcription jobs and how long each of their stages took.
+
+    Jobs live in SQLite rather than in memory, so that a status request can be answered
+    by any web process, not just the one that accepted the upload. So do the chunks of
+    each transcript as they are post-processed, so any web process can show them while
+    the rest of the transcript is still being worked on.
+    """
+
+    def __init__(self, db_path=DATABASE_PATH):
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                email TEXT,
+                request_id TEXT,
+                fingerprint TEXT,
+                error TEXT,
+                stages TEXT NOT NULL DEFAULT '{}',
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "fingerprint" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN fingerprint TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_request_id ON jobs (request_id)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_chunks (
+                job_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (job_id, chunk_index)
+            )
+            """
+        )
+
+    def create(self, email=None):
+        """
+        Create a new job in the "queued" state.
+
+        Args:
+            email (str, optional): The address to notify when the job finishes.
+
+        Returns:
+            str: The new job's ID.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, state, email, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, "queued", email, now, now),
+            )
+        return job_id
+
+    def get(self, job_id):
+        """
+        Look up a job by its ID.
+
+        Returns:
+            dict or None: The job, including its stage timings, or None if it doesn't exist.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def find_by_request_id(self, request_id):
+        """
+        Look up the job for a Deepgram request ID.
+
+        Returns:
+            dict or None: The job, or None if the request wasn't submitted through the job API.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE request_id = ?", (request_id,)
+            ).fetchone()
+        return self._to_dict(row)
+
+    def update(self, job_id, **fields):
+        """
+        Set one or more of a job's state, email, request_id, fingerprint and error fields.
+        """
+        allowed = {"state", "email", "request_id", "fingerprint", "error"}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id)
+            )
+
+    def start_stage(self, job_id, stage, state=None):
+        """
+        Record that a stage has started, optionally moving the job to a new state.
+        """
+        def apply(stages):
+            stages[stage] = {"started_at": time.time(), "finished_at": None, "duration": None}
+
+        self._update_stages(job_id, apply, state=state)
+
+    def finish_stage(self, job_id, stage, error=None, failed_state="failed"):
+        """
+        Record that a stage has finished. If it failed, the job moves to failed_state,
+        which is "retrying" for work the queue will try again.
+        """
+        def apply(stages):
+            now = time.time()
+            timing = stages.setdefault(stage, {"started_at": now})
+            timing["finished_at"] = now
+            timing["duration"] = now - timing["started_at"]
+            if error:
+                timing["error"] = error
+            STAGE_SECONDS.observe(
+                timing["duration"], stage=stage, outcome="failed" if error else "ok"
+            )
+
+        self._update_stages(
+            job_id, apply, state=failed_state if error else None, error=error
+        )
+
+    @contextmanager
+    def stage(self, job_id, stage, state=None, failed_state="failed"):
+        """
+        Time a block of code as one of a job's stages. If the block raises, the job
+        moves to failed_state (see finish_stage).
+
+        If job_id is None the block runs untracked, so that work for requests submitted
+        outside the job API is processed the same way.
+        """
+        if job_id is None:
+            yield
+            return
+        self.start_stage(job_id, stage, state=state)
+        try:
+            yield
+        except Exception as e:
+            self.finish_stage(job_id, stage, error=str(e), failed_state=failed_state)
+            raise
+        self.finish_stage(job_id, stage)
+
+    def _update_stages(self, job_id, apply, state=None, error=None):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT stages FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("ROLLBACK")
+                    return
+                stages = json.loads(row["stages"])
+                apply(stages)
+                self._conn.execute(
+                    """
+                    UPDATE jobs SET stages = ?, updated_at = ?,
+                        state = COALESCE(?, state), error = COALESCE(?, error)
+                    WHERE id = ?
+                    """,
+                    (json.dumps(stages), time.time(), state, error, job_id),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def add_chunk(self, job_id, index, text):
+        """
+        Record a post-processed chunk of a job's transcript. If the job is retried, its
+        new chunks replace the earlier ones.
+        """
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO job_chunks (job_id, chunk_index, text, created_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (job_id, index, text, time.time()),
+            )
+
+    def prune_chunks(self, ttl=JOB_CHUNKS_TTL):
+        """
+        Delete the chunks of jobs that completed or failed more than ttl seconds ago. By
+        then their progress pages have shown the whole transcript, which is also in the
+        transcript file and the completion email. A failed job that is resumed adds its
+        chunks again.
+
+        Returns:
+            int: The number of chunks deleted.
+        """
+        cutoff = time.time() - ttl
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                DELETE FROM job_chunks WHERE job_id IN (
+                    SELECT id FROM jobs WHERE state IN ('complete', 'failed') AND updated_at < ?
+                )
+                """,
+                (cutoff,),
+            )
+        return cursor.rowcount
+
+    def get_chunks(self, job_id, after=-1):
+        """
+        Return the post-processed chunks of a job's transcript, in order.
+
+        Args:
+            job_id (str): The job.
+            after (int): Only return chunks with a higher index than this.
+
+        Returns:
+            list: Each chunk as a dict of its "index" and "text".
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT chunk_index, text FROM job_chunks
+                WHERE job_id = ? AND chunk_index > ?
+                ORDER BY chunk_index
+                """,
+                (job_id, after),
+            ).fetchall()
+        return [{"index": row["chunk_index"], "text": row["text"]} for row in rows]
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["stages"] = json.loads(job["stages"])
+        return job
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """Return the shared job store for this process."""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
@@ -0,0 +1,350 @@
+import os
+import threading
+import time
+import traceback
+
+import requests
+
+from db_utils import DATABASE_PATH, connect
+from email_utils import send_completion_email, send_confirmation_emails
+from job_utils import get_job_store
+from metrics_utils import histogram
+
+# Mailgun accepts up to 1000 recipients in one batch send
+OUTBOX_BATCH_SIZE = min(int(os.getenv("OUTBOX_BATCH_SIZE", "100")), 1000)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BACKOFF = float(os.getenv("OUTBOX_RETRY_BACKOFF", "30"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+# How long a sender may hold a claimed message before another sender may take it over
+OUTBOX_CLAIM_TIMEOUT = 300
+
+SEND_SECONDS = histogram(
+    "transcriber_email_send_seconds", "Time taken to send each email request.", ["kind", "outcome"]
+)
+DELIVERY_SECONDS = histogram(
+    "transcriber_email_delivery_seconds",
+    "Time from an email being queued to it being sent.",
+    ["kind"],
+)
+
+# The job stage each kind of message is recorded under
+STAGES = {
+    "confirmation": "confirmation_email",
+    "completion": "completion_email",
+}
+
+
+class Outbox:
+    """
+    Notification emails waiting to be sent, stored in SQLite.
+
+    Web and worker processes add messages to the outbox instead of calling Mailgun
+    themselves, so a slow or failing Mailgun never holds up a request or a transcript.
+    A background OutboxSender delivers them. Messages that fail are retried with
+    exponential backoff up to max_attempts, then marked as dead. Attachments are stored
+    as paths and only read when the message is sent.
+    """
+
+    def __init__(
+        self,
+        db_path=DATABASE_PATH,
+        max_attempts=OUTBOX_MAX_ATTEMPTS,
+        retry_backoff=OUTBOX_RETRY_BACKOFF,
+        claim_timeout=OUTBOX_CLAIM_TIMEOUT,
+    ):
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.claim_timeout = claim_timeout
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                attachment_path TEXT,
+                job_id TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_available ON outbox (kind, state, available_at)"
+        )
+
+    def enqueue(self, kind, recipient, job_id=None, attachment_path=None):
+        """
+        Add a message to the outbox.
+
+        Args:
+            kind (str): "confirmation" or "completion".
+            recipient (str): The address to send the message to.
+            job_id (str, optional): The job the message is about.
+            attachment_path (str, optional): A file to attach, read when the message is sent.
+
+        Returns:
+            int: The message's ID.
+        """
+        if kind not in STAGES:
+            raise ValueError(f"Unknown message kind: {kind}")
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                INSERT INTO outbox (kind, recipient, attachment_path, job_id, state,
+                    available_at, created_at)
+                VALUES (?, ?, ?, ?, 'pending', ?, ?)
+                """,
+                (kind, recipient, attachment_path, job_id, now, now),
+            )
+        return cursor.lastrowid
+
+    def expire(self, kind):
+        """
+        Mark messages of one kind whose claim ran out on their last attempt as dead, since
+        they most likely killed the sender, and trying again could send them twice.
+
+        Returns:
+            list: The messages marked as dead, as dicts.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT * FROM outbox
+                    WHERE kind = ? AND state = 'sending' AND available_at <= ? AND attempts >= ?
+                    """,
+                    (kind, now, self.max_attempts),
+                ).fetchall()
+                self._conn.executemany(
+                    """
+                    UPDATE outbox SET state = 'dead', last_error = 'The claim ran out on the last attempt.'
+                    WHERE id = ?
+                    """,
+                    [(row["id"],) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [dict(row) for row in rows]
+
+    def claim(self, kind, limit):
+        """
+        Take up to limit messages of one kind that are due to be sent, oldest first,
+        including messages whose previous claim has run out with attempts left (see expire).
+
+        Returns:
+            list: The claimed messages, as dicts.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT * FROM outbox
+                    WHERE kind = ? AND available_at <= ?
+                        AND (state = 'pending' OR (state = 'sending' AND attempts < ?))
+                    ORDER BY available_at, id
+                    LIMIT ?
+                    """,
+                    (kind, now, self.max_attempts, limit),
+                ).fetchall()
+                # While sending, available_at holds the time the claim runs out
+                self._conn.executemany(
+                    """
+                    UPDATE outbox SET state = 'sending', attempts = attempts + 1,
+                        available_at = ?
+                    WHERE id = ?
+                    """,
+                    [(now + self.claim_timeout, row["id"]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        messages = [dict(row) for row in rows]
+        for message in messages:
+            message["attempts"] += 1
+        return messages
+
+    def mark_sent(self, message_ids):
+        """Mark claimed messages as sent."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET state = 'sent', sent_at = ? WHERE id = ?",
+                [(now, message_id) for message_id in message_ids],
+            )
+
+    def fail(self, message, error):
+        """
+        Record a failed attempt to send a message. It is tried again after a backoff,
+        or marked as dead once it has used up its attempts.
+
+        Returns:
+            str: The message's new state, "pending" or "dead".
+        """
+        attempts = message["attempts"]
+        state = "dead" if attempts >= self.max_attempts else "pending"
+        available_at = time.time() + self.retry_backoff * 2 ** (attempts - 1)
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE outbox SET state = ?, available_at = ?, last_error = ?
+                WHERE id = ? AND state = 'sending'
+                """,
+                (state, available_at, error, message["id"]),
+            )
+        return state
+
+    def depth(self):
+        """
+        Count the messages in each state.
+
+        Returns:
+            dict: A mapping from state ("pending", "sending", "sent", "dead") to message count.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) AS count FROM outbox GROUP BY state"
+            ).fetchall()
+        return {row["state"]: row["count"] for row in rows}
+
+
+class OutboxSender:
+    """
+    Delivers the messages in an outbox.
+
+    Confirmation emails are identical apart from the recipient, so pending ones are sent
+    together, up to batch_size recipients per Mailgun request. Completion emails each
+    carry their own attachment and are sent one at a time. When a message is delivered,
+    or gives up, its job stage is finished. A failed email doesn't fail the job.
+    """
+
+    def __init__(self, outbox, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL):
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.job_store = get_job_store()
+
+    def run(self, stopping):
+        """Send messages as they become due until stopping is set."""
+        while not stopping.is_set():
+            try:
+                sent = self.send_pending()
+            except Exception:
+                traceback.print_exc()
+                sent = 0
+            if not sent:
+                stopping.wait(self.poll_interval)
+
+    def send_pending(self):
+        """
+        Send one batch of confirmations and up to batch_size completion emails.
+
+        Returns:
+            int: The number of messages attempted.
+        """
+        for kind in STAGES:
+            for message in self.outbox.expire(kind):
+                print(f"{kind.capitalize()} email {message['id']} ran out of attempts while being sent; now dead.")
+                self._finish_stage(message)
+        confirmations = self.outbox.claim("confirmation", self.batch_size)
+        if confirmations:
+            self._deliver_confirmations(confirmations)
+        completions = self.outbox.claim("completion", self.batch_size)
+        for message in completions:
+            self._deliver(
+                [message],
+                lambda: send_completion_email(message["recipient"], message["attachment_path"]),
+            )
+        return len(confirmations) + len(completions)
+
+    def _deliver_confirmations(self, messages):
+        """
+        Send confirmations to all their recipients in one Mailgun batch request.
+
+        One invalid address is enough for Mailgun to refuse a whole batch, so a refused
+        batch of several recipients is split in half and each half sent on its own, down
+        to single recipients, and only the bad recipients' confirmations fail.
+        """
+        recipients = sorted({message["recipient"] for message in messages})
+        on_refused = None
+        if len(recipients) > 1:
+            first_half = set(recipients[: len(recipients) // 2])
+
+            def on_refused():
+                print(f"Mailgun refused a confirmation batch of {len(recipients)} recipients; splitting it.")
+                self._deliver_confirmations(
+                    [message for message in messages if message["recipient"] in first_half]
+                )
+                self._deliver_confirmations(
+                    [message for message in messages if message["recipient"] not in first_half]
+                )
+
+        self._deliver(messages, lambda: send_confirmation_emails(recipients), on_refused)
+
+    def _deliver(self, messages, send, on_refused=None):
+        """
+        Send messages with one request, and record the outcome for each of them.
+
+        If on_refused is given, it is called instead of failing the messages when Mailgun
+        refuses the request with a 4xx (other than 429), which means something in the
+        request is bad rather than Mailgun being unavailable.
+        """
+        kind = messages[0]["kind"]
+        start_time = time.perf_counter()
+        try:
+            response = send()
+            refused = on_refused and 400 <= response.status_code < 500 and response.status_code != 429
+            if not refused and response.status_code != 200:
+                raise RuntimeError(f"Mailgun returned status code {response.status_code}")
+        except (requests.RequestException, RuntimeError, OSError) as e:
+            SEND_SECONDS.observe(time.perf_counter() - start_time, kind=kind, outcome="failed")
+            for message in messages:
+                state = self.outbox.fail(message, str(e))
+                print(
+                    f"Failed to send {message['kind']} email {message['id']} on attempt "
+                    f"{message['attempts']}; now {state}. Error: {str(e)}"
+                )
+                if state == "dead":
+                    self._finish_stage(message)
+            return
+        if refused:
+            SEND_SECONDS.observe(time.perf_counter() - start_time, kind=kind, outcome="failed")
+            on_refused()
+            return
+        SEND_SECONDS.observe(time.perf_counter() - start_time, kind=kind, outcome="sent")
+        self.outbox.mark_sent([message["id"] for message in messages])
+        print(f"Sent {len(messages)} {kind} email(s).")
+        now = time.time()
+        for message in messages:
+            DELIVERY_SECONDS.observe(now - message["created_at"], kind=kind)
+            self._finish_stage(message)
+
+    def _finish_stage(self, message):
+        if message["job_id"]:
+            self.job_store.finish_stage(message["job_id"], STAGES[message["kind"]])
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """Return the shared outbox for this process."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
@@ -0,0 +1,106 @@
+import os
+import time
+
+from checkpoint_utils import CHECKPOINT_FOLDER, ChunkCheckpoint
+from job_utils import get_job_store
+from metrics_utils import histogram
+from outbox import get_outbox
+from transcript_store import get_transcript_store
+from transcription_utils import stream_post_process
+
+FIRST_CHUNK_SECONDS = histogram(
+    "transcriber_first_chunk_seconds",
+    "Time from a job being created to the first chunk of its transcript being ready to show.",
+)
+
+
+def process_transcript(data):
+    """
+    Post-process a transcript received from Deepgram API.
+
+    The callback saved by the webhook is parsed, post-processed and written to the
+    transcript file as one streaming pipeline (see stream_post_process). Each chunk is
+    also added to the job as soon as it is ready, for the job's live progress page. The
+    saved callback is only removed once the completion email is queued and the job is
+    complete, so the task can be retried from any step. Errors are raised rather than
+    swallowed, so that the worker running the task can retry it.
+
+    Chunks are checkpointed as they are processed (see checkpoint_utils), so a retry,
+    or a resume of a failed job, only sends the chunks that didn't make it last time.
+
+    Args:
+        data (dict): The Deepgram request ID ("request_id") and the path of the saved
+            callback JSON ("callback_path")
+
+    Returns:
+        None: Writes transcript to file and queues the email notification
+    """
+    job_store = get_job_store()
+    transcript_id = data["request_id"]
+    job = job_store.find_by_request_id(transcript_id)
+    job_id = job["id"] if job else None
+    checkpoint = ChunkCheckpoint(os.path.join(CHECKPOINT_FOLDER, f"{transcript_id}.jsonl"))
+    if job and job["state"] == "complete":
+        # An earlier transcript of the same upload was already delivered (see transcript_store)
+        print(f"Transcription ID: {transcript_id}. Job already complete; skipping.")
+        deepgram_stage = job["stages"].get("deepgram")
+        if deepgram_stage and not deepgram_stage.get("finished_at"):
+            job_store.finish_stage(job_id, "deepgram")
+        os.remove(data["callback_path"])
+        checkpoint.remove()
+        return
+    if job and job["state"] == "transcribing":
+        job_store.finish_stage(job_id, "deepgram")
+
+    print(f"Transcription ID: {transcript_id}. Now writing to file.")
+    os.makedirs("transcriptions", exist_ok=True)
+    transcript_path = f"transcriptions/transcript-{transcript_id}.md"
+    def on_chunk(index, text):
+        job_store.add_chunk(job_id, index, text)
+        if index == 0:
+            FIRST_CHUNK_SECONDS.observe(time.time() - job["created_at"])
+
+    if len(checkpoint):
+        print(f"Transcription ID: {transcript_id}. Resuming with {len(checkpoint)} chunks done.")
+    # The job only fails for good once the queue gives up on the task (see fail_transcript)
+    with job_store.stage(job_id, "post_process", state="processing", failed_state="retrying"):
+        with open(data["callback_path"], "rb") as callback_file, open(transcript_path, "w") as f:
+            stream_post_process(
+                callback_file, f, on_chunk=on_chunk if job_id else None, checkpoint=checkpoint
+            )
+    if job and job["fingerprint"]:
+        get_transcript_store().put(job["fingerprint"], transcript_path)
+
+    # The completion email is sent by the outbox sender, so a slow Mailgun doesn't hold up the worker
+    recipient_email = (job and job["email"]) or os.getenv("TEST_EMAIL")
+    if job and "completion_email" in job["stages"]:
+        # Queued by an earlier attempt that failed after it
+        print("Completion email already queued.")
+    elif recipient_email:
+        get_outbox().enqueue(
+            "completion", recipient_email, job_id=job_id, attachment_path=transcript_path
+        )
+        if job_id:
+            job_store.start_stage(job_id, "completion_email")
+        print("Completion email queued.")
+    else:
+        print("No email provided.")
+    if job_id:
+        job_store.update(job_id, state="complete")
+    os.remove(data["callback_path"])
+    checkpoint.remove()
+
+
+def fail_transcript(data, error):
+    """
+    Mark a transcript's job as failed once its task has used up its attempts, so it can
+    be resumed (see process_transcript).
+
+    Args:
+        data (dict): The task payload, as passed to process_transcript.
+        error (str): The last attempt's error.
+    """
+    job_store = get_job_store()
+    job = job_store.find_by_request_id(data["request_id"])
+    if job and job["state"] != "complete":
+        job_store.update(job["id"], state="failed", error=error)
@@ -0,0 +1,192 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics_utils import gauge, histogram
+
+# Limits assumed until the first OpenAI response reports the account's own in its
+# x-ratelimit-* headers
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "30000"))
+# How long to hold requests back after a 429 that doesn't say how long to wait
+DEFAULT_RETRY_AFTER = 1.0
+
+RATE_LIMIT_WAIT_SECONDS = histogram(
+    "transcriber_llm_rate_limit_wait_seconds",
+    "Time chunk requests waited for the OpenAI rate limiter.",
+)
+gauge(
+    "transcriber_llm_rate_limit_per_minute",
+    "OpenAI requests and tokens per minute the rate limiter allows.",
+    ["limit"],
+    function=lambda: {(kind,): value for kind, value in get_openai_rate_limiter().limits().items()},
+)
+
+
+class _Bucket:
+    """A token bucket that refills to its per-minute limit over a minute."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Seconds until the bucket holds amount, as of its last refill."""
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+
+class RateLimiter:
+    """
+    Keeps every OpenAI request made by this process under the account's request and token
+    limits, so concurrent transcripts share the limits instead of all running into them.
+
+    Each request waits for one request and its tokens from two token buckets, which refill
+    at the per-minute limits. The limits, and what is left of them, are learnt from the
+    x-ratelimit-* headers of each response, and since those count the account's requests
+    from every process, separate worker processes keep each other in check too. A 429
+    holds every request back for as long as it asks.
+
+    Requests waiting at the same time are let through one job at a time, in turn, so a
+    long transcript doesn't hold up a short one that arrives behind it.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        # Maps each job with requests waiting to its waiting requests, in the order served
+        self._waiting = OrderedDict()
+        self._paused_until = 0.0
+
+    def acquire(self, tokens, job=None):
+        """
+        Wait until a request of this many tokens can be sent.
+
+        Args:
+            tokens (int): The tokens the request counts against the limit. A request
+                larger than the whole limit waits for the bucket to be full.
+            job: Anything identifying the transcript the request is for. Waiting requests
+                are served round robin between jobs.
+        """
+        ticket = object()
+        start_time = time.monotonic()
+        with self._cond:
+            queue = self._waiting.setdefault(job, deque())
+            queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._requests.refill(now)
+                    self._tokens.refill(now)
+                    delay = None
+                    if next(iter(self._waiting.values()))[0] is ticket:
+                        cost = min(tokens, self._tokens.capacity)
+                        delay = max(
+                            self._paused_until - now,
+                            self._requests.wait_time(1),
+                            self._tokens.wait_time(cost),
+                        )
+                        if delay <= 0:
+                            self._requests.level -= 1
+                            self._tokens.level -= cost
+                            break
+                    self._cond.wait(delay)
+            finally:
+                queue.remove(ticket)
+                if queue:
+                    self._waiting.move_to_end(job)
+                else:
+                    del self._waiting[job]
+                self._cond.notify_all()
+        RATE_LIMIT_WAIT_SECONDS.observe(time.monotonic() - start_time)
+
+    def update(self, headers):
+        """
+        Learn the account's limits, and how much of them is left, from a response's
+        x-ratelimit-* headers.
+        """
+        with self._cond:
+            now = time.monotonic()
+            for bucket, kind in ((self._requests, "requests"), (self._tokens, "tokens")):
+                bucket.refill(now)
+                limit = _number(headers.get(f"x-ratelimit-limit-{kind}"))
+                if limit:
+                    # A higher limit than assumed is headroom straight away; the remaining
+                    # count below takes back whatever is already in use
+                    bucket.level += max(0, limit - bucket.capacity)
+                    bucket.capacity = limit
+                remaining = _number(headers.get(f"x-ratelimit-remaining-{kind}"))
+                if remaining is not None:
+                    bucket.level = min(bucket.level, remaining)
+                bucket.level = min(bucket.level, bucket.capacity)
+            self._cond.notify_all()
+
+    def throttle(self, headers):
+        """Hold every request back after a 429, for as long as its headers ask."""
+        delay = _retry_after(headers)
+        self.update(headers)
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._cond.notify_all()
+        print(f"OpenAI rate limit reached; holding requests back for {delay:.2f} seconds.")
+
+    def limits(self):
+        """Return the requests and tokens per minute currently assumed."""
+        with self._cond:
+            return {"requests": self._requests.capacity, "tokens": self._tokens.capacity}
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _duration(value):
+    """Parse a duration such as "1s", "6m0s" or "20ms", as OpenAI sends them, into seconds."""
+    if not value:
+        return None
+    seconds = None
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value):
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+        seconds = (seconds or 0) + float(amount) * scale
+    return seconds
+
+
+def _retry_after(headers):
+    """Return how many seconds a 429 asks to wait before trying again."""
+    retry_after_ms = _number(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    retry_after = _number(headers.get("retry-after"))
+    if retry_after is not None:
+        return retry_after
+    resets = [_duration(headers.get(f"x-ratelimit-reset-{kind}")) for kind in ("requests", "tokens")]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else DEFAULT_RETRY_AFTER
+
+
+_openai_rate_limiter = None
+_openai_rate_limiter_lock = threading.Lock()
+
+
+def get_openai_rate_limiter():
+    """
+    Return the rate limiter shared by every OpenAI request in this process, starting from
+    OPENAI_REQUESTS_PER_MINUTE and OPENAI_TOKENS_PER_MINUTE (defaults 500 and 30000).
+    """
+    global _openai_rate_limiter
+    with _openai_rate_limiter_lock:
+        if _openai_rate_limiter is None:
+            _openai_rate_limiter = RateLimiter(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE)
+        return _openai_rate_limiter
@@ -0,0 +1,155 @@
+import csv
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from transcription_utils import transcribe_audio_file_requests
+
+SEGMENT_SECONDS = int(os.getenv("SEGMENT_SECONDS", "1800"))
+SEGMENT_UPLOAD_WORKERS = int(os.getenv("SEGMENT_UPLOAD_WORKERS", "4"))
+
+
+def get_audio_duration(audio_path):
+    """
+    Read an audio file's duration from its container metadata with ffprobe, without decoding it.
+
+    Args:
+        audio_path (str): Path to the audio file.
+
+    Returns:
+        float: The duration in seconds.
+    """
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1",
+            audio_path,
+        ],
+        capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.strip())
+
+
+def split_audio_segments(audio_path, output_dir, segment_seconds=SEGMENT_SECONDS, split_points=None):
+    """
+    Cut an audio file into segments of about segment_seconds without decoding it.
+
+    ffmpeg copies the compressed stream into the segments (-c copy), so cuts fall on
+    packet boundaries and memory use stays small however long the recording is.
+    Unlike pydub's AudioSegment, nothing is decoded to raw PCM.
+
+    Args:
+        audio_path (str): Path to the audio file.
+        output_dir (str): Directory the segments are written to.
+        segment_seconds (float): Target length of each segment.
+        split_points (list, optional): Exact times to cut at (see silence_utils.find_split_points),
+            used instead of segment_seconds.
+
+    Returns:
+        list: A dict for each segment, in order, with its "path" and its "start" offset in seconds.
+    """
+    extension = os.path.splitext(audio_path)[1] or ".mp3"
+    segment_pattern = os.path.join(output_dir, f"segment-%04d{extension}")
+    segment_list = os.path.join(output_dir, "segments.csv")
+    subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-y",
+            "-i", audio_path,
+            "-map", "0:a:0",
+            "-c", "copy",
+            "-f", "segment",
+            *(
+                ["-segment_times", ",".join(f"{point:.3f}" for point in split_points)]
+                if split_points
+                else ["-segment_time", str(segment_seconds)]
+            ),
+            "-segment_list", segment_list,
+            "-segment_list_type", "csv",
+            "-reset_timestamps", "1",
+            segment_pattern,
+        ],
+        check=True,
+    )
+    segments = []
+    with open(segment_list, newline="") as f:
+        for filename, start, _ in csv.reader(f):
+            segments.append({"path": os.path.join(output_dir, filename), "start": float(start)})
+    print(f"Split {audio_path} into {len(segments)} segments.")
+    return segments
+
+
+def transcribe_segments(segments, deepgram_api_key, custom_vocab, max_workers=SEGMENT_UPLOAD_WORKERS):
+    """
+    Upload segments to Deepgram concurrently and wait for their transcripts.
+
+    Segments are transcribed synchronously (without a callback), so the results can be
+    stitched back together as soon as the slowest segment is done.
+
+    Args:
+        segments (list): Segments as returned by split_audio_segments.
+        deepgram_api_key (str): The Deepgram API key.
+        custom_vocab (list): Custom vocabulary to boost.
+        max_workers (int): Maximum number of segments uploaded at once.
+
+    Returns:
+        list: The Deepgram response JSON for each segment, in order.
+    """
+    def transcribe_segment(segment):
+        with open(segment["path"], "rb") as audio_file:
+            response = transcribe_audio_file_requests(audio_file, None, deepgram_api_key, custom_vocab)
+        response.raise_for_status()
+        return response.json()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(transcribe_segment, segments))
+
+
+def stitch_segment_results(results, offsets, request_id):
+    """
+    Combine per-segment Deepgram results into a single callback-shaped payload.
+
+    Paragraph and sentence timestamps are shifted by each segment's start offset. Only
+    the paragraphs are carried over; word-level arrays are dropped, since nothing
+    downstream uses them. Speaker IDs are diarized separately in each segment, so the
+    same number may refer to different people either side of a segment boundary.
+
+    Args:
+        results (list): Deepgram response JSON for each segment, in order.
+        offsets (list): Each segment's start time in seconds.
+        request_id (str): The request ID to give the combined payload.
+
+    Returns:
+        dict: A payload with the same shape as a Deepgram callback.
+    """
+    paragraphs = []
+    transcripts = []
+    for result, offset in zip(results, offsets):
+        alternative = result["results"]["channels"][0]["alternatives"][0]
+        transcripts.append(alternative.get("transcript", ""))
+        for paragraph in alternative.get("paragraphs", {}).get("paragraphs", []):
+            paragraph = dict(paragraph)
+            paragraph["start"] = paragraph.get("start", 0) + offset
+            paragraph["end"] = paragraph.get("end", 0) + offset
+            paragraph["sentences"] = [
+                dict(sentence, start=sentence.get("start", 0) + offset, end=sentence.get("end", 0) + offset)
+                for sentence in paragraph["sentences"]
+            ]
+            paragraphs.append(paragraph)
+    transcript = " ".join(text for text in transcripts if text)
+    duration = sum(result["metadata"].get("duration", 0) for result in results)
+    return {
+        "metadata": {"request_id": request_id, "duration": duration, "segments": len(results)},
+        "results": {
+            "channels": [
+                {
+                    "alternatives": [
+                        {
+                            "transcript": transcript,
+                            "paragraphs": {"transcript": transcript, "paragraphs": paragraphs},
+                        }
+                    ]
+                }
+            ]
+        },
+    }
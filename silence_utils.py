@@ -0,0 +1,119 @@
+import os
+import subprocess
+
+import numpy as np
+
+# Audio is analysed at this rate; speech energy doesn't need more
+ANALYSIS_SAMPLE_RATE = 8000
+# How far either side of each target boundary to look for a quiet point
+SPLIT_SEARCH_SECONDS = float(os.getenv("SPLIT_SEARCH_SECONDS", "30"))
+
+
+def read_pcm_window(audio_path, start, duration, sample_rate=ANALYSIS_SAMPLE_RATE):
+    """
+    Decode a short window of an audio file to mono 16-bit samples at a low sample rate.
+
+    ffmpeg seeks to the window before decoding, so only the window itself is decoded
+    and held in memory, however long the file is.
+
+    Args:
+        audio_path (str): Path to the audio file.
+        start (float): Start of the window in seconds.
+        duration (float): Length of the window in seconds.
+        sample_rate (int): Sample rate to decode at.
+
+    Returns:
+        numpy.ndarray: The samples as int16.
+    """
+    result = subprocess.run(
+        [
+            "ffmpeg", "-v", "error",
+            "-ss", f"{max(start, 0):.3f}", "-t", f"{duration:.3f}",
+            "-i", audio_path,
+            "-vn", "-ac", "1", "-ar", str(sample_rate),
+            "-f", "s16le", "pipe:1",
+        ],
+        capture_output=True, check=True,
+    )
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+
+def energy_envelope(samples, sample_rate=ANALYSIS_SAMPLE_RATE, frame_seconds=0.02):
+    """
+    Compute the RMS energy of consecutive frames of audio.
+
+    Args:
+        samples (numpy.ndarray): Mono samples.
+        sample_rate (int): The samples' sample rate.
+        frame_seconds (float): Length of each frame.
+
+    Returns:
+        numpy.ndarray: One RMS value per whole frame.
+    """
+    frame_size = max(1, int(sample_rate * frame_seconds))
+    frame_count = len(samples) // frame_size
+    frames = samples[: frame_count * frame_size].astype(np.float32).reshape(frame_count, frame_size)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+def find_quietest_point(
+    samples,
+    sample_rate=ANALYSIS_SAMPLE_RATE,
+    frame_seconds=0.02,
+    min_silence_seconds=0.4,
+    distance_weight=0.1,
+):
+    """
+    Find the middle of the quietest stretch in a window of audio.
+
+    The energy envelope is averaged over min_silence_seconds, so that a pause long
+    enough to be between sentences wins over a brief dip inside a word. Points further
+    from the centre of the window are penalised slightly, so that among equally quiet
+    pauses the one closest to the target boundary is chosen.
+
+    Args:
+        samples (numpy.ndarray): Mono samples, centred on the target boundary.
+        sample_rate (int): The samples' sample rate.
+        frame_seconds (float): Resolution of the energy envelope.
+        min_silence_seconds (float): Length of pause to look for.
+        distance_weight (float): How strongly to prefer points near the centre (0 to ignore distance).
+
+    Returns:
+        float: Offset of the quietest point from the start of the window, in seconds.
+    """
+    envelope = energy_envelope(samples, sample_rate, frame_seconds)
+    if len(envelope) == 0:
+        return len(samples) / sample_rate / 2
+    width = max(1, min(len(envelope), int(round(min_silence_seconds / frame_seconds))))
+    smoothed = np.convolve(envelope, np.ones(width, dtype=np.float32) / width, mode="same")
+    positions = np.arange(len(smoothed))
+    centre = (len(smoothed) - 1) / 2
+    distance = np.abs(positions - centre) / max(centre, 1)
+    scores = smoothed * (1 + distance_weight * distance) + 1e-3 * distance
+    return (int(np.argmin(scores)) + 0.5) * frame_seconds
+
+
+def find_split_points(audio_path, duration, segment_seconds, search_seconds=SPLIT_SEARCH_SECONDS):
+    """
+    Choose split points near every multiple of segment_seconds, moved to the nearest quiet moment.
+
+    Only a window of 2 * search_seconds around each target is decoded and analysed,
+    so the cost depends on the number of segments rather than the length of the file.
+
+    Args:
+        audio_path (str): Path to the audio file.
+        duration (float): The file's duration in seconds.
+        segment_seconds (float): Target segment length.
+        search_seconds (float): How far either side of each target to search.
+
+    Returns:
+        list: The split times in seconds, in increasing order.
+    """
+    split_points = []
+    target = segment_seconds
+    while target < duration - segment_seconds / 2:
+        window_start = max(target - search_seconds, 0)
+        samples = read_pcm_window(audio_path, window_start, 2 * search_seconds)
+        split_points.append(window_start + find_quietest_point(samples))
+        target += segment_seconds
+    return split_points
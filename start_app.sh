@@ -10,8 +10,12 @@ NGROK_PID=$!
 # Wait a moment for ngrok to start
 sleep 2
 
+# Start a queue worker in the background
+python worker.py &
+WORKER_PID=$!
+
 # Start Flask application
 flask run
 
-# When Flask is stopped, also stop ngrok
-kill $NGROK_PID 
\ No newline at end of file
+# When Flask is stopped, also stop ngrok and the worker
+kill $NGROK_PID $WORKER_PID
\ No newline at end of file
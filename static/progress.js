@@ -0,0 +1,45 @@
+// Shows a job's stages and its transcript, chunk by chunk, as the server reports them on
+// /jobs/<id>/events. EventSource reconnects by itself when the stream closes, and tells the
+// server the last chunk it saw.
+function describeStage(name, timing) {
+  if (timing.error) {
+    return `${name}: failed (${timing.error})`;
+  }
+  if (timing.finished_at) {
+    return `${name}: done in ${timing.duration.toFixed(1)} s`;
+  }
+  return `${name}: in progress`;
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+  const container = document.getElementById("job-progress");
+  if (!container || !window.EventSource) {
+    return;
+  }
+  const stages = container.querySelector(".job-stages");
+  const transcript = container.querySelector(".job-transcript");
+  const source = new EventSource(container.dataset.eventsUrl);
+
+  source.addEventListener("job", (event) => {
+    const job = JSON.parse(event.data);
+    stages.innerHTML = "";
+    const ordered = Object.entries(job.stages).sort((a, b) => a[1].started_at - b[1].started_at);
+    for (const [name, timing] of ordered) {
+      const item = document.createElement("li");
+      item.textContent = describeStage(name.replace(/_/g, " "), timing);
+      stages.append(item);
+    }
+    const state = document.createElement("li");
+    state.textContent = `Job ${job.state.replace(/_/g, " ")}`;
+    stages.append(state);
+  });
+
+  source.addEventListener("chunk", (event) => {
+    const chunk = JSON.parse(event.data);
+    const section = document.createElement("div");
+    section.textContent = (chunk.index ? "\n\n" : "") + chunk.text;
+    transcript.append(section);
+  });
+
+  source.addEventListener("end", () => source.close());
+});
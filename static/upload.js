@@ -0,0 +1,143 @@
+// Sends the upload form's file to /uploads in parts, several at once, so a dropped
+// connection only costs the parts in flight. The upload's ID is remembered in
+// localStorage, so submitting the same file again (even after a reload) sends only the
+// parts the server is missing. Browsers without fetch fall back to posting the form.
+const PARALLEL_PARTS = 3;
+const MAX_PART_ATTEMPTS = 5;
+
+function uploadKey(file) {
+  return `upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+async function readReply(response) {
+  const body = await response.json().catch(() => ({}));
+  if (!response.ok) {
+    const error = new Error(body.message || `Server returned ${response.status}`);
+    error.status = response.status;
+    error.retryAfter = Number(response.headers.get("Retry-After")) || 0;
+    throw error;
+  }
+  return body;
+}
+
+async function findOrCreateUpload(file, form) {
+  const savedId = localStorage.getItem(uploadKey(file));
+  if (savedId) {
+    const response = await fetch(`/uploads/${savedId}`);
+    if (response.ok) {
+      const upload = await response.json();
+      if (upload.state === "receiving") {
+        return upload;
+      }
+    }
+    localStorage.removeItem(uploadKey(file));
+  }
+  const upload = await readReply(
+    await fetch("/uploads", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        filename: file.name,
+        size: file.size,
+        vocab: form.elements.vocab.value,
+        email: form.elements.email.value,
+      }),
+    })
+  );
+  localStorage.setItem(uploadKey(file), upload.id);
+  return upload;
+}
+
+async function sendPart(upload, file, part) {
+  const start = part * upload.part_size;
+  const blob = file.slice(start, Math.min(start + upload.part_size, file.size));
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await readReply(
+        await fetch(`/uploads/${upload.id}/parts/${part}`, { method: "PUT", body: blob })
+      );
+    } catch (error) {
+      // Client errors won't go away by trying again; network errors and 5xx might
+      const retryable = !error.status || error.status >= 500;
+      if (!retryable || attempt >= MAX_PART_ATTEMPTS) {
+        throw error;
+      }
+      await sleep(1000 * 2 ** (attempt - 1));
+    }
+  }
+}
+
+async function completeUpload(upload, form) {
+  // The fields as they are now, in case they changed since a resumed upload was started
+  const fields = { vocab: form.elements.vocab.value, email: form.elements.email.value };
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await readReply(
+        await fetch(`/uploads/${upload.id}/complete`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify(fields),
+        })
+      );
+    } catch (error) {
+      if (error.status !== 503 || attempt >= MAX_PART_ATTEMPTS) {
+        throw error;
+      }
+      await sleep((error.retryAfter || 30) * 1000);
+    }
+  }
+}
+
+async function resumableUpload(form, showStatus) {
+  const file = form.elements.file.files[0];
+  const upload = await findOrCreateUpload(file, form);
+  const missing = upload.missing_parts.slice();
+  let received = upload.received_bytes;
+  const showProgress = () =>
+    showStatus(`Uploading ${file.name}: ${Math.floor((100 * received) / file.size)}%`);
+  showProgress();
+
+  const sendParts = async () => {
+    while (missing.length) {
+      const part = missing.shift();
+      const start = part * upload.part_size;
+      await sendPart(upload, file, part);
+      received += Math.min(upload.part_size, file.size - start);
+      showProgress();
+    }
+  };
+  await Promise.all(Array.from({ length: PARALLEL_PARTS }, sendParts));
+
+  showStatus("Upload finished. Starting transcription...");
+  const job = await completeUpload(upload, form);
+  localStorage.removeItem(uploadKey(file));
+  return job;
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+  const form = document.getElementById("upload-form");
+  const status = document.getElementById("upload-status");
+  const submit = form.querySelector('input[type="submit"]');
+  const showStatus = (message) => {
+    status.textContent = message;
+  };
+
+  form.addEventListener("submit", async (event) => {
+    if (!window.fetch || !window.localStorage || !form.elements.file.files.length) {
+      return;
+    }
+    event.preventDefault();
+    submit.disabled = true;
+    try {
+      const job = await resumableUpload(form, showStatus);
+      window.location.assign(job.progress_url);
+    } catch (error) {
+      showStatus(`Upload interrupted (${error.message}). Submit again to carry on where it stopped.`);
+      submit.disabled = false;
+    }
+  });
+});
@@ -0,0 +1,253 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from upload_utils import UPLOAD_CHUNK_SIZE
+
+# "never" (the default) and "always" force it; "auto" transcodes when the measured numbers
+# say it saves time
+TRANSCODE_UPLOADS = os.getenv("TRANSCODE_UPLOADS", "never").lower()
+TRANSCODE_BITRATE = os.getenv("TRANSCODE_BITRATE", "32k")
+# In "auto" mode, every this many uploads is sent the other way than the measurements say,
+# so both ways keep being measured
+TRANSCODE_PROBE_EVERY = int(os.getenv("TRANSCODE_PROBE_EVERY", "10"))
+# How much of the original audio is kept while waiting for ffmpeg's first output, so that
+# it can still be sent untranscoded if ffmpeg can't read it
+TRANSCODE_FALLBACK_BYTES = 32 * 1024 * 1024
+
+
+class TranscodeError(RuntimeError):
+    """ffmpeg failed after part of its output had already been sent."""
+
+
+def ffmpeg_available():
+    """Return whether ffmpeg is on the PATH."""
+    return shutil.which("ffmpeg") is not None
+
+
+class UploadBody:
+    """
+    An iterable request body for an audio upload, optionally transcoded on the fly.
+
+    When transcoding, the audio is piped through ffmpeg and re-encoded as mono 16 kHz
+    Opus at TRANSCODE_BITRATE, which is plenty for speech recognition. Input is fed
+    to ffmpeg from a background thread while its output is read back in pieces, so the
+    file is never buffered as a whole. The sizes and timings, and a SHA-256 digest of the
+    original audio, are recorded on the object as it is consumed.
+
+    If ffmpeg can't be started, or fails before producing any output (as it does for audio
+    it can't decode), the original audio is sent instead, and transcode is set to False.
+    """
+
+    def __init__(self, audio_file, transcode):
+        self.transcode = transcode
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.transcode_seconds = 0.0
+        self.sha256 = hashlib.sha256()
+        if hasattr(audio_file, "read"):
+            self._pieces = iter(lambda: audio_file.read(UPLOAD_CHUNK_SIZE), b"")
+        else:
+            self._pieces = iter(audio_file)
+
+    def __iter__(self):
+        if self.transcode:
+            try:
+                yield from self._transcoded()
+                return
+            except _FallBack as e:
+                print(f"Couldn't transcode the upload ({e}); sending the original audio.")
+                self.transcode = False
+                self.output_bytes = 0
+                pieces = e.pieces
+        else:
+            pieces = self._pieces
+        for piece in pieces:
+            self.output_bytes += len(piece)
+            yield piece
+
+    def _plain(self, consumed):
+        """Yield the pieces already fed to ffmpeg, then the rest of the input."""
+        yield from consumed
+        for piece in self._pieces:
+            self.input_bytes += len(piece)
+            self.sha256.update(piece)
+            yield piece
+
+    def _transcoded(self):
+        start_time = time.perf_counter()
+        try:
+            process = subprocess.Popen(
+                [
+                    "ffmpeg", "-v", "error",
+                    "-i", "pipe:0",
+                    "-vn", "-ac", "1", "-ar", "16000",
+                    "-c:a", "libopus", "-b:a", TRANSCODE_BITRATE, "-application", "voip",
+                    "-f", "ogg", "pipe:1",
+                ],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        except OSError as e:
+            raise _FallBack(str(e), self._plain([]))
+        # The input fed to ffmpeg is kept until its first output, to fall back on
+        self._consumed = []
+        feeder = threading.Thread(target=self._feed, args=(process,), daemon=True)
+        feeder.start()
+        try:
+            while True:
+                piece = process.stdout.read(UPLOAD_CHUNK_SIZE)
+                if not piece:
+                    break
+                self._consumed = None
+                self.output_bytes += len(piece)
+                yield piece
+        finally:
+            process.stdout.close()
+            status = process.wait()
+            feeder.join()
+            self.transcode_seconds = time.perf_counter() - start_time
+        if status != 0:
+            message = f"ffmpeg exited with status {status}"
+            if self.output_bytes == 0 and self._consumed is not None:
+                raise _FallBack(message, self._plain(self._consumed))
+            raise TranscodeError(f"{message} while transcoding.")
+
+    def _feed(self, process):
+        try:
+            for piece in self._pieces:
+                self.input_bytes += len(piece)
+                self.sha256.update(piece)
+                consumed = self._consumed
+                if consumed is not None:
+                    if self.input_bytes <= TRANSCODE_FALLBACK_BYTES:
+                        consumed.append(piece)
+                    else:
+                        self._consumed = None
+                process.stdin.write(piece)
+        except BrokenPipeError:
+            # ffmpeg stopped reading; its exit status reports why
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+
+class _FallBack(Exception):
+    """ffmpeg failed before sending anything; pieces yields the original audio instead."""
+
+    def __init__(self, message, pieces):
+        super().__init__(message)
+        self.pieces = pieces
+
+
+class TranscodeStats:
+    """
+    Running measurements used to decide whether transcoding uploads saves time.
+
+    Tracks, in bytes of original audio per second, how fast untranscoded uploads reach
+    Deepgram and how fast transcoded ones do (transcoding and uploading together), along
+    with how fast ffmpeg transcodes and how much smaller transcoded files are, as
+    exponentially weighted averages. Each rate is only measured from uploads sent that
+    way, so neither can be skewed by the other.
+    """
+
+    def __init__(self, smoothing=0.3):
+        self.smoothing = smoothing
+        self.upload_rate = None
+        self.transcoded_upload_rate = None
+        self.transcode_rate = None
+        self.size_ratio = None
+        self.uploads = 0
+        self.transcoded = 0
+        self.seconds_saved = 0.0
+        self._decisions = 0
+        self._lock = threading.Lock()
+
+    def should_transcode(self):
+        """
+        Decide whether the next upload should be transcoded.
+
+        In "auto" mode, the first upload is sent untranscoded and the second transcoded,
+        to measure both. After that, uploads are transcoded while that has been at least
+        10% faster, except that every TRANSCODE_PROBE_EVERY-th upload is sent the other
+        way, so a change in bandwidth or load is noticed. Uploads are never transcoded
+        when ffmpeg isn't installed.
+        """
+        if TRANSCODE_UPLOADS != "auto":
+            return TRANSCODE_UPLOADS == "always" and ffmpeg_available()
+        if not ffmpeg_available():
+            return False
+        with self._lock:
+            self._decisions += 1
+            if self.upload_rate is None:
+                return False
+            if self.transcoded_upload_rate is None:
+                return True
+            faster = self.transcoded_upload_rate > self.upload_rate / 0.9
+            if TRANSCODE_PROBE_EVERY and self._decisions % TRANSCODE_PROBE_EVERY == 0:
+                return not faster
+            return faster
+
+    def record(self, body, upload_seconds):
+        """
+        Record a finished upload and print how much transcoding saved, if it was used.
+
+        Args:
+            body (UploadBody): The body that was uploaded.
+            upload_seconds (float): How long the whole upload took.
+        """
+        if not body.input_bytes or upload_seconds <= 0:
+            return
+        rate = body.input_bytes / upload_seconds
+        with self._lock:
+            self.uploads += 1
+            if not body.transcode:
+                self.upload_rate = self._average(self.upload_rate, rate)
+                return
+            self.transcoded += 1
+            self.transcoded_upload_rate = self._average(self.transcoded_upload_rate, rate)
+            self.size_ratio = self._average(self.size_ratio, body.output_bytes / body.input_bytes)
+            if body.transcode_seconds > 0:
+                self.transcode_rate = self._average(
+                    self.transcode_rate, body.input_bytes / body.transcode_seconds
+                )
+            saved = None
+            if self.upload_rate is not None:
+                # Time the original file would have taken at the measured untranscoded rate
+                saved = body.input_bytes / self.upload_rate - upload_seconds
+                self.seconds_saved += saved
+        message = (
+            f"Transcoded {body.input_bytes / 1e6:.1f} MB to {body.output_bytes / 1e6:.1f} MB "
+            f"({1 - body.output_bytes / body.input_bytes:.0%} smaller) in {body.transcode_seconds:.1f} seconds. "
+            f"Upload took {upload_seconds:.1f} seconds"
+        )
+        if saved is not None:
+            message += f", about {saved:.1f} seconds less than the original would have"
+        print(message + ".")
+
+    def snapshot(self):
+        """Return the current measurements as a dict."""
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "transcoded": self.transcoded,
+                "upload_bytes_per_second": self.upload_rate,
+                "transcoded_upload_bytes_per_second": self.transcoded_upload_rate,
+                "transcode_bytes_per_second": self.transcode_rate,
+                "size_ratio": self.size_ratio,
+                "seconds_saved": self.seconds_saved,
+            }
+
+    def _average(self, current, sample):
+        if current is None:
+            return sample
+        return (1 - self.smoothing) * current + self.smoothing * sample
+
+
+transcode_stats = TranscodeStats()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from db_utils import DATABASE_PATH, connect
+from metrics_utils import counter
+from transcription_utils import (
+    CHUNK_TOKEN_BUDGET,
+    DEEPGRAM_PARAMS,
+    GPT_MODEL,
+    GPT_TEMPERATURE,
+    SYSTEM_PROMPT,
+)
+
+# Reuse finished transcripts for repeat uploads of the same audio
+TRANSCRIPT_REUSE = os.getenv("TRANSCRIPT_REUSE", "True").lower() == "true"
+
+LOOKUPS = counter(
+    "transcriber_transcript_reuse_total",
+    "Uploads checked against finished transcripts, by whether one could be reused.",
+    ["outcome"],
+)
+
+
+def make_fingerprint(audio_sha256, custom_vocab):
+    """
+    Identify an upload by its audio and everything that shapes its transcript.
+
+    Two uploads with the same fingerprint would be transcribed and post-processed
+    identically: the same audio, vocabulary, Deepgram options, model, prompt and chunk
+    budget.
+
+    Args:
+        audio_sha256 (str): Hex SHA-256 digest of the uploaded audio bytes.
+        custom_vocab (list): The custom vocabulary sent to Deepgram.
+
+    Returns:
+        str: A hex SHA-256 fingerprint.
+    """
+    parameters = {
+        "audio": audio_sha256,
+        "vocab": sorted(custom_vocab or []),
+        "deepgram": DEEPGRAM_PARAMS,
+        "model": GPT_MODEL,
+        "temperature": GPT_TEMPERATURE,
+        "prompt": hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest(),
+        "chunk_token_budget": CHUNK_TOKEN_BUDGET,
+    }
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TranscriptStore:
+    """
+    Finished transcripts, indexed by the fingerprint of the upload that produced them.
+
+    The transcripts themselves stay where the pipeline wrote them; the store only
+    records their paths, and forgets entries whose file has since been removed.
+    """
+
+    def __init__(self, db_path=DATABASE_PATH):
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transcripts (
+                fingerprint TEXT PRIMARY KEY,
+                transcript_path TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used_at REAL
+            )
+            """
+        )
+
+    def get(self, fingerprint):
+        """
+        Find the transcript for a fingerprint, and count the reuse.
+
+        Returns:
+            str or None: The transcript's path, or None if there isn't one (or it was deleted).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT transcript_path FROM transcripts WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+            if row is None:
+                LOOKUPS.inc(outcome="miss")
+                return None
+            if not os.path.exists(row["transcript_path"]):
+                self._conn.execute("DELETE FROM transcripts WHERE fingerprint = ?", (fingerprint,))
+                LOOKUPS.inc(outcome="miss")
+                return None
+            self._conn.execute(
+                "UPDATE transcripts SET hits = hits + 1, last_used_at = ? WHERE fingerprint = ?",
+                (time.time(), fingerprint),
+            )
+        LOOKUPS.inc(outcome="hit")
+        return row["transcript_path"]
+
+    def put(self, fingerprint, transcript_path):
+        """Record the transcript produced for a fingerprint."""
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO transcripts (fingerprint, transcript_path, created_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (fingerprint) DO UPDATE SET transcript_path = excluded.transcript_path
+                """,
+                (fingerprint, transcript_path, time.time()),
+            )
+
+
+_transcript_store = None
+_transcript_store_lock = threading.Lock()
+
+
+def get_transcript_store():
+    """Return the shared transcript store for this process."""
+    global _transcript_store
+    with _transcript_store_lock:
+        if _transcript_store is None:
+            _transcript_store = TranscriptStore()
+        return _transcript_store
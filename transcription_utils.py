@@ -1,100 +1,429 @@
 import os
+import threading
 import time
-from typing import List
-import requests
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import ijson
+import http_utils
 from dotenv import load_dotenv
 import re
-from openai import OpenAI, RateLimitError
+from cache_utils import get_chunk_cache
+from metrics_utils import counter, histogram, timed
+from rate_limit_utils import get_openai_rate_limiter
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Point at a stand-in server for load testing (see benchmarks/fake_vendors.py). The OpenAI
+# client reads OPENAI_BASE_URL itself
+DEEPGRAM_API_URL = os.getenv("DEEPGRAM_API_URL", "https://api.deepgram.com").rstrip("/")
+# Options sent with every transcription request
+DEEPGRAM_PARAMS = {
+    "diarize": "true",
+    "smart_format": "true",
+    "model": "nova-2",
+}
+
+GPT_MODEL = "gpt-4o-2024-11-20"
+GPT_TEMPERATURE = 0.5
+GPT_MAX_OUTPUT_TOKENS = 5000
+# Tries for each chunk, counting those refused with a rate limit or failed by a server error
+GPT_MAX_ATTEMPTS = 5
+# The model returns roughly as many tokens as it is sent, so chunks must stay comfortably
+# below GPT_MAX_OUTPUT_TOKENS for the edited text to fit in a single response
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "3000"))
+SYSTEM_PROMPT = "You are an AI assistant that receives a verbatim transcript of an interview. You respond with the same text, MINIMALLY edited for clarity. You remove filler words, correct grammatical mistakes, and replace obvious transcription mistakes with the more likely alternative given the context. You remove obvious repetition. If a line from a speaker is just filler, such as '[Spaker 0]: Mhmm.', then you can just delete the line as if the speaker never interrupted. You add links in markdown format to resources mentioned where you are confident of the link (so 'World Health Organisation' could become '[World Health Organisation](https://www.who.int/)'). When a speaker appears to start talking about a new topic, add a markdown-formated h3 header (### [Topic]) before the next speaker is introduced in bold, replacing [Topic] with the actual new topic. The speaker name (e.g. '[SPEAKER 0]:') should precede the speaker text without a line break. You DO NOT invent any new sentences. You DO NOT modify the speaker names in bold. You DO NOT remove any substantial content and you DO NOT summarise answers — the transcript you return should effectively be as long as the original, minus filler words and obvious repetition. You don't need to make speech less casual than it already is. The text should be returned in just the same format as it was received."
+
+PARSE_SECONDS = histogram(
+    "transcriber_parse_seconds", "Time spent parsing Deepgram callbacks into paragraphs."
+)
+LLM_SECONDS = histogram(
+    "transcriber_llm_chunk_seconds", "Time taken to post-process one chunk.", ["outcome"]
+)
+LLM_TOKENS = histogram(
+    "transcriber_llm_chunk_tokens",
+    "Tokens sent and received for one chunk.",
+    ["direction"],
+    buckets=(100, 250, 500, 1000, 2000, 3000, 4000, 5000, 8000, 16000),
+)
+LLM_RATE_LIMITED = counter(
+    "transcriber_llm_rate_limited_total", "Chunk requests the LLM refused with a rate limit."
+)
+
+
+class ChunkProcessingError(Exception):
+    """Raised when chunks of a transcript couldn't be post-processed."""
 
 
 def transcribe_audio_file_requests(
-    audio_file, callback_url, deepgram_api_key, custom_vocab
+    audio_file, callback_url, deepgram_api_key, custom_vocab, **kwargs
 ):
-    """Transcribe an audio file using the Deepgram API and the requests library."""
+    """
+    Transcribe an audio file using the Deepgram API and the requests library.
+
+    audio_file can be an open file or an iterable of byte pieces; an iterable is sent
+    with chunked transfer encoding, so it never needs to be held in memory as a whole.
+    An open file is retried on 429 and gateway errors; an iterable only when the
+    connection can't be made.
+    If callback_url is None, the request waits for the transcript and the response
+    contains it (pass stream=True to read a long transcript from the response in pieces).
+    Other keyword arguments are passed on to requests.
+    """
     # Define the URL for the Deepgram API endpoint
-    url = "https://api.deepgram.com/v1/listen"
+    url = f"{DEEPGRAM_API_URL}/v1/listen"
 
     # Define the headers for the HTTP request
     headers = {"Authorization": f"Token {deepgram_api_key}", "Content-Type": "audio/*"}
 
-    # Define query parameters
-    params = {
-        "callback": callback_url,
-        "diarize": "true",
-        "smart_format": "true",
-        "model": "nova-2",
-    }
+    params = deepgram_params(callback_url, custom_vocab)
+    # A whole file can be rewound and sent again if Deepgram turns it away; a stream can't
+    replayable = isinstance(audio_file, bytes) or hasattr(audio_file, "seek")
+    service = "deepgram_replayable" if replayable else "deepgram"
+    response = http_utils.post(
+        service, url, headers=headers, params=params, data=audio_file, **kwargs
+    )
+    print(response)
+    return response
+
+
+def transcribe_audio_url_requests(audio_url, callback_url, deepgram_api_key, custom_vocab, **kwargs):
+    """
+    Ask Deepgram to fetch and transcribe audio from a URL, so the audio never passes
+    through this server. Otherwise the same as transcribe_audio_file_requests.
+    """
+    url = f"{DEEPGRAM_API_URL}/v1/listen"
+    headers = {"Authorization": f"Token {deepgram_api_key}", "Content-Type": "application/json"}
+    params = deepgram_params(callback_url, custom_vocab)
+    response = http_utils.post(
+        "deepgram_replayable", url, headers=headers, params=params, json={"url": audio_url}, **kwargs
+    )
+    print(response)
+    return response
+
+
+def deepgram_params(callback_url, custom_vocab):
+    """Return the query parameters for a Deepgram transcription request."""
+    params = dict(DEEPGRAM_PARAMS)
+    if callback_url:
+        params["callback"] = callback_url
 
     # Add custom vocabulary if provided
     if custom_vocab:
         params["keywords"] = ",".join(custom_vocab)
+    return params
 
-    response = requests.post(url, headers=headers, params=params, data=audio_file, timeout=1000)
-    print(response)
-    return response
+
+# ijson prefix of the paragraphs in a Deepgram callback (results.channels[].alternatives[].paragraphs.paragraphs[])
+PARAGRAPHS_PREFIX = "results.channels.item.alternatives.item.paragraphs.paragraphs.item"
 
 
 def parse_response(json_response):
     """Parse the JSON response and return a markdown-formatted transcript."""
     segments = json_response["results"]["channels"][0]["alternatives"][0]["paragraphs"]
-    # Variables to keep track of ongoing speaker and their text
-    markdown_output = []
+    paragraphs = (
+        (
+            paragraph["speaker"],
+            " ".join(sentence["text"] for sentence in paragraph["sentences"]),
+        )
+        for paragraph in segments["paragraphs"]
+    )
+    return "\n\n".join(format_speaker_turns(paragraphs))
+
+
+def parse_response_stream(stream):
+    """
+    Parse a Deepgram callback incrementally from a file-like object.
+
+    Only the request ID and the paragraphs of the first alternative of the first channel
+    are extracted; everything else (including the word-level arrays) is skipped over
+    without being built into Python objects, so memory use doesn't grow with the size
+    of the payload.
+
+    Args:
+        stream: A binary file-like object containing the callback JSON.
+
+    Returns:
+        tuple: The Deepgram request ID and the markdown-formatted transcript.
+    """
+    metadata = {}
+    paragraphs = iter_callback_paragraphs(stream, metadata)
+    transcript = "\n\n".join(format_speaker_turns(paragraphs))
+    return metadata.get("request_id"), transcript
+
+
+def read_callback_request_id(stream):
+    """
+    Read the request ID from a Deepgram callback, stopping as soon as it is found.
+
+    Args:
+        stream: A binary file-like object containing the callback JSON.
+
+    Returns:
+        str or None: The callback's metadata.request_id, if it has one.
+    """
+    return next(ijson.items(stream, "metadata.request_id"), None)
+
+
+def iter_callback_paragraphs(stream, metadata):
+    """
+    Yield (speaker, text) for each paragraph of a Deepgram callback, parsed incrementally.
+
+    Args:
+        stream: A binary file-like object containing the callback JSON.
+        metadata (dict): Filled in with the callback's request_id once it has been read.
+
+    Yields:
+        tuple: The paragraph's speaker ID and its sentences joined into one string.
+    """
+    channel = alternative = -1
+    speaker = None
+    sentences = []
+    for prefix, event, value in ijson.parse(stream):
+        if prefix == "metadata.request_id":
+            metadata["request_id"] = value
+        elif event == "start_map" and prefix == "results.channels.item":
+            channel += 1
+            alternative = -1
+        elif event == "start_map" and prefix == "results.channels.item.alternatives.item":
+            alternative += 1
+        elif channel != 0 or alternative != 0:
+            if (channel > 0 or alternative > 0) and "request_id" in metadata:
+                # Everything we need has been read
+                return
+        elif prefix == PARAGRAPHS_PREFIX + ".speaker":
+            speaker = value
+        elif prefix == PARAGRAPHS_PREFIX + ".sentences.item.text":
+            sentences.append(value)
+        elif event == "end_map" and prefix == PARAGRAPHS_PREFIX:
+            yield speaker, " ".join(sentences)
+            speaker = None
+            sentences = []
+
+
+def format_speaker_turns(paragraphs):
+    """
+    Group consecutive paragraphs by speaker, in a single pass.
+
+    Args:
+        paragraphs: An iterable of (speaker, text) tuples.
+
+    Yields:
+        str: One markdown block per speaker turn, with the speaker label on its own line.
+    """
     current_speaker = None
     speaker_text = []
-    paragraphs = segments["paragraphs"]
-    for paragraph in paragraphs:
-        speaker_id = str(paragraph["speaker"])
-        # If we have a change in speaker or it's the last paragraph
-        if current_speaker is not None and (
-            current_speaker != speaker_id or paragraph == paragraphs[-1]
-        ):
-            markdown_output.append(f"\n\n**[SPEAKER {speaker_id}]**: ")
-            markdown_output.append(" ".join(speaker_text))
-            # Reset for the next speaker
+    for speaker, text in paragraphs:
+        speaker_id = str(speaker)
+        if speaker_text and speaker_id != current_speaker:
+            yield f"**[SPEAKER {current_speaker}]**: \n" + " ".join(speaker_text)
             speaker_text = []
         current_speaker = speaker_id
-        # Concatenate all sentences in the paragraph
-        paragraph_text = " ".join(
-            sentence["text"] for sentence in paragraph["sentences"]
-        )
-        speaker_text.append(paragraph_text)
-    # Handling the text for the last segment
+        speaker_text.append(text)
+    # Handling the text for the last speaker
     if speaker_text:
-        markdown_output.append(" ".join(speaker_text))
-
-    full_transcript = "\n".join(markdown_output)
-    # Return the markdown transcript
-    # return full_transcript
-    # Save the full transcript to a file
-    with open("transcription_test.md", "w") as f:
-        f.write("Transcript before formatting:\n\n" + full_transcript)
-    return post_process_transcript(full_transcript)
+        yield f"**[SPEAKER {current_speaker}]**: \n" + " ".join(speaker_text)
 
 
-def post_process_transcript(transcript: str) -> str:
+def post_process_transcript(transcript: str, max_workers: Optional[int] = None) -> str:
     """
     Post-process a transcript by splitting it into chunks and processing each chunk with GPT-4.
 
+    Chunks are sent to the model concurrently through a bounded thread pool, and are
+    joined back together in their original order.
+
     Args:
         transcript (str): The input transcript to be processed.
+        max_workers (int, optional): Maximum number of chunks in flight at once. Defaults
+            to the POST_PROCESS_WORKERS environment variable (4 if unset). A value of 1
+            processes the chunks sequentially.
+
+    Raises:
+        ChunkProcessingError: If any chunk couldn't be processed.
 
     Returns:
         str: The processed transcript.
     """
     sentences = split_into_sentences(transcript)
-    chunks = create_chunks(sentences)
-
+    plan = plan_chunks(sentences)
+    chunks = plan["chunks"]
+    print(
+        f"Planned {len(chunks)} chunks of up to {plan['budget']} tokens "
+        f"({plan['fill']:.0%} full on average); {plan['requests']} need an API request."
+    )
+
+    start_time = time.perf_counter()
     processed_chunks = []
-
-    for chunk in chunks:
-        processed_chunk = process_chunk_with_gpt4(chunk)
+    chunk_times = []
+    for index, (processed_chunk, chunk_time) in enumerate(
+        iter_processed_chunks(chunks, max_workers)
+    ):
+        print(f"Chunk {index + 1} of {len(chunks)} took {chunk_time:.2f} seconds.")
         processed_chunks.append(processed_chunk)
+        chunk_times.append(chunk_time)
+    _print_post_process_summary(chunk_times, time.perf_counter() - start_time)
 
+    failed = [index for index, chunk in enumerate(processed_chunks) if chunk is None]
+    if failed:
+        raise ChunkProcessingError(
+            f"{len(failed)} of {len(chunks)} chunks failed, starting with chunk {failed[0] + 1}."
+        )
     return "\n\n".join(processed_chunks)
 
 
+def stream_post_process(
+    callback_file, output_file, max_workers: Optional[int] = None, on_chunk=None, checkpoint=None
+) -> int:
+    """
+    Post-process a Deepgram callback into a transcript file as a single streaming pipeline.
+
+    Paragraphs are parsed from the callback, grouped by speaker, split into sentences
+    and packed into chunks lazily, so the first chunks are with the model while later
+    paragraphs are still being read. Processed chunks are appended to output_file in
+    order as soon as they (and every chunk before them) are done. Only a bounded number
+    of chunks is held at any time, so memory use doesn't grow with episode length.
+
+    With a checkpoint, each chunk is saved as soon as the model returns it, and chunks
+    saved by an earlier attempt aren't sent again. If a chunk fails, the rest are still
+    processed and saved, so the next attempt only has to redo the ones that failed.
+
+    Args:
+        callback_file: A binary file-like object containing the callback JSON.
+        output_file: A text file-like object the processed transcript is written to.
+        max_workers (int, optional): Maximum number of chunks in flight at once (see post_process_transcript).
+        on_chunk (callable, optional): Called with the index and text of each processed
+            chunk once it has been written, so it can be shown before the transcript is done.
+        checkpoint (ChunkCheckpoint, optional): Where finished chunks are saved and reused
+            from (see checkpoint_utils).
+
+    Raises:
+        ChunkProcessingError: If any chunk couldn't be processed. The transcript written
+            so far stops before the first failed chunk.
+
+    Returns:
+        int: The number of chunks processed.
+    """
+    paragraphs = timed(iter_callback_paragraphs(callback_file, {}), PARSE_SECONDS)
+    turns = format_speaker_turns(paragraphs)
+    chunks = iter_chunks(iter_turn_sentences(turns))
+
+    start_time = time.perf_counter()
+    chunk_times = []
+    failed = []
+    for index, (processed_chunk, chunk_time) in enumerate(
+        iter_processed_chunks(chunks, max_workers, checkpoint)
+    ):
+        chunk_times.append(chunk_time)
+        if processed_chunk is None:
+            print(f"Chunk {index + 1} failed.")
+            failed.append(index)
+            if checkpoint is None:
+                break
+        if failed:
+            # Later chunks are still processed, and saved to the checkpoint
+            continue
+        print(f"Chunk {index + 1} took {chunk_time:.2f} seconds.")
+        if index:
+            output_file.write("\n\n")
+        output_file.write(processed_chunk)
+        output_file.flush()
+        if on_chunk is not None:
+            on_chunk(index, processed_chunk)
+    _print_post_process_summary(chunk_times, time.perf_counter() - start_time)
+    if checkpoint is not None and checkpoint.reused:
+        print(f"Reused {checkpoint.reused} chunks saved by an earlier attempt.")
+    if failed:
+        raise ChunkProcessingError(
+            f"{len(failed)} of {len(chunk_times)} chunks failed, starting with chunk {failed[0] + 1}."
+        )
+    return len(chunk_times)
+
+
+def iter_processed_chunks(chunks, max_workers: Optional[int] = None, checkpoint=None):
+    """
+    Process chunks with GPT-4 concurrently, yielding the results in the original order.
+
+    Chunks are pulled from the iterable lazily: at most twice max_workers are submitted
+    ahead of the next result to be yielded.
+
+    Args:
+        chunks: An iterable of chunk texts.
+        max_workers (int, optional): Maximum number of chunks in flight at once. Defaults
+            to the POST_PROCESS_WORKERS environment variable (4 if unset).
+        checkpoint (ChunkCheckpoint, optional): Chunks already saved here are taken from
+            it; the rest are saved to it as soon as they are processed.
+
+    The chunks count as one job for the OpenAI rate limiter, which shares the account's
+    limits fairly between transcripts being processed at the same time.
+
+    Yields:
+        tuple: The processed chunk (None if it failed) and the number of seconds it took.
+    """
+    if max_workers is None:
+        max_workers = int(os.getenv("POST_PROCESS_WORKERS", "4"))
+    job = object()
+
+    def process(index, chunk):
+        if checkpoint is not None:
+            saved_chunk = checkpoint.get(index, chunk)
+            if saved_chunk is not None:
+                return saved_chunk, 0.0
+        processed_chunk, chunk_time = _timed_process_chunk(chunk, job)
+        if checkpoint is not None and processed_chunk is not None:
+            checkpoint.put(index, chunk, processed_chunk)
+        return processed_chunk, chunk_time
+
+    if max_workers <= 1:
+        for index, chunk in enumerate(chunks):
+            yield process(index, chunk)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for index, chunk in enumerate(chunks):
+            pending.append(executor.submit(process, index, chunk))
+            # Hand back finished results straight away, and wait once the window is full
+            while pending and (pending[0].done() or len(pending) >= 2 * max_workers):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _print_post_process_summary(chunk_times, total_time):
+    sequential_time = sum(chunk_times)
+    print(
+        f"Post-processed {len(chunk_times)} chunks in {total_time:.2f} seconds "
+        f"(sum of chunk times: {sequential_time:.2f} seconds)."
+    )
+    cache = get_chunk_cache()
+    if cache is not None:
+        print(f"Chunk cache stats: {cache.stats()}")
+
+
+# Caps the chunks being processed at once across every transcript (see limit_llm_concurrency)
+_llm_slots = nullcontext()
+
+
+def limit_llm_concurrency(limit: Optional[int]) -> None:
+    """
+    Cap how many chunks are processed at once across the whole process, however many
+    transcripts are being post-processed and whatever max_workers each uses.
+
+    Args:
+        limit (int, optional): The most chunks in flight at once. 0 or None removes the cap.
+    """
+    global _llm_slots
+    _llm_slots = threading.BoundedSemaphore(limit) if limit else nullcontext()
+
+
+def _timed_process_chunk(chunk: str, job=None) -> Tuple[Optional[str], float]:
+    """Process a chunk with GPT-4 and return the result alongside the time it took."""
+    with _llm_slots:
+        start_time = time.perf_counter()
+        processed_chunk = process_chunk_with_gpt4(chunk, job)
+        chunk_time = time.perf_counter() - start_time
+    LLM_SECONDS.observe(chunk_time, outcome="ok" if processed_chunk is not None else "failed")
+    return processed_chunk, chunk_time
+
+
 def split_into_sentences(text: str) -> List[str]:
     """
     Split the text into sentences, preserving speaker labels and line breaks.
@@ -120,75 +449,297 @@ def split_into_sentences(text: str) -> List[str]:
     return [s for s in sentences if s]  # Remove empty strings but keep '\n'
 
 
-def create_chunks(sentences: List[str], max_tokens: int = 600) -> List[str]:
+def create_chunks(sentences: List[str], max_tokens: Optional[int] = None) -> List[str]:
     """
     Create chunks of sentences that fit within the max_tokens limit.
 
     Args:
         sentences (List[str]): List of sentences to be chunked.
-        max_tokens (int): Maximum number of tokens per chunk.
+        max_tokens (int, optional): Maximum number of model tokens per chunk. Defaults to CHUNK_TOKEN_BUDGET.
 
     Returns:
         List[str]: A list of chunks.
     """
-    chunks = []
-    current_chunk = []
-    current_token_count = 0
+    return plan_chunks(sentences, max_tokens)["chunks"]
 
+
+def plan_chunks(sentences: List[str], max_tokens: Optional[int] = None, min_fill: float = 0.5) -> dict:
+    """
+    Pack sentences into as few chunks as possible, each within a budget of model tokens.
+
+    Chunks are filled as close to the budget as the sentences allow. When a chunk is
+    full, it is ended at the last speaker label instead, as long as that leaves it at
+    least min_fill full, so that speaker turns aren't cut in half. A chunk never ends
+    with a speaker label separated from that speaker's text.
+
+    Args:
+        sentences (List[str]): List of sentences, as returned by split_into_sentences.
+        max_tokens (int, optional): Maximum number of model tokens per chunk. Defaults to CHUNK_TOKEN_BUDGET.
+        min_fill (float): The fraction of the budget a chunk must reach to be ended early at a speaker label.
+
+    Returns:
+        dict: The chunks ("chunks"), their token counts summed over their sentences
+        ("token_counts"), the budget used
+        ("budget"), the average fraction of the budget filled ("fill"), and the number of
+        chunks that aren't in the chunk cache and so need an API request ("requests").
+    """
+    budget = max_tokens or CHUNK_TOKEN_BUDGET
+    # Each chunk's count is the sum of its sentences' counts, so nothing is encoded twice
+    planned = list(_iter_counted_chunks(sentences, budget, min_fill))
+    chunk_texts = [chunk for chunk, _ in planned]
+    token_counts = [tokens for _, tokens in planned]
+    cache = get_chunk_cache()
+    requests_needed = len(chunk_texts)
+    if cache is not None:
+        requests_needed = sum(
+            not cache.contains(cache.make_key(chunk, SYSTEM_PROMPT, GPT_MODEL, GPT_TEMPERATURE))
+            for chunk in chunk_texts
+        )
+    return {
+        "chunks": chunk_texts,
+        "token_counts": token_counts,
+        "budget": budget,
+        "fill": sum(token_counts) / (budget * len(token_counts)) if token_counts else 0.0,
+        "requests": requests_needed,
+    }
+
+
+def iter_chunks(sentences, max_tokens: Optional[int] = None, min_fill: float = 0.5):
+    """
+    Pack sentences into chunks lazily, yielding each chunk as soon as it is complete.
+
+    See plan_chunks for how chunk boundaries are chosen.
+
+    Args:
+        sentences: An iterable of sentences, as returned by split_into_sentences.
+        max_tokens (int, optional): Maximum number of model tokens per chunk. Defaults to CHUNK_TOKEN_BUDGET.
+        min_fill (float): The fraction of the budget a chunk must reach to be ended early at a speaker label.
+
+    Yields:
+        str: The text of the next chunk.
+    """
+    for chunk, _ in _iter_counted_chunks(sentences, max_tokens, min_fill):
+        yield chunk
+
+
+def _iter_counted_chunks(sentences, max_tokens=None, min_fill=0.5):
+    """Like iter_chunks, but yield each chunk with its token count, summed over its sentences."""
+    budget = max_tokens or CHUNK_TOKEN_BUDGET
+    current = []
+    current_counts = []
+    current_tokens = 0
+    for sentence in sentences:
+        sentence_tokens = count_text_tokens(sentence)
+        is_label = _is_speaker_label(sentence)
+        if current and current_tokens + sentence_tokens > budget:
+            split = len(current)
+            labels = [index for index, piece in enumerate(current) if _is_speaker_label(piece)]
+            if not is_label and labels and labels[-1] > 0 and sum(current_counts[: labels[-1]]) >= min_fill * budget:
+                split = labels[-1]
+            else:
+                # Move a trailing speaker label (and blank lines) over to the next chunk
+                while split > 0 and (_is_speaker_label(current[split - 1]) or current[split - 1] == "\n"):
+                    split -= 1
+                split = split or len(current)
+            chunk = _join_sentences(current[:split])
+            if chunk:
+                yield chunk, sum(current_counts[:split])
+            current = current[split:]
+            current_counts = current_counts[split:]
+            current_tokens = sum(current_counts)
+        current.append(sentence)
+        current_counts.append(sentence_tokens)
+        current_tokens += sentence_tokens
+    chunk = _join_sentences(current)
+    if chunk:
+        yield chunk, current_tokens
+
+
+def iter_turn_sentences(turns):
+    """Split each speaker turn (see format_speaker_turns) into sentences, with a blank line between turns."""
+    for turn in turns:
+        yield from split_into_sentences(turn)
+        yield "\n"
+
+
+def _is_speaker_label(sentence: str) -> bool:
+    return sentence.strip().startswith("**[SPEAKER")
+
+
+def _join_sentences(sentences: List[str]) -> str:
+    """Join sentences back into text: a space between sentences, and a blank line before each speaker label."""
+    parts = []
+    paragraph_break = False
     for sentence in sentences:
-        sentence_tokens = len(sentence.split())
-        if current_token_count + sentence_tokens > max_tokens:
-            chunks.append("".join(current_chunk))
-            current_chunk = []
-            current_token_count = 0
+        if sentence == "\n":
+            paragraph_break = True
+            continue
+        if _is_speaker_label(sentence):
+            if parts:
+                parts.append("\n\n")
+            # The speaker's text follows the label on the same line
+            parts.append(sentence.strip() + " ")
+        elif parts:
+            if paragraph_break:
+                parts.append("\n\n")
+            elif not parts[-1].endswith(" "):
+                parts.append(" ")
+            parts.append(sentence.strip())
+        else:
+            parts.append(sentence.strip())
+        paragraph_break = False
+    return "".join(parts).strip()
+
+
+_token_encoding = None
+_token_encoding_lock = threading.Lock()
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """
+    Count the model tokens in each of a list of texts.
+
+    Uses the model's tiktoken encoding. If the encoding can't be loaded (tiktoken
+    downloads it on first use), counts are estimated at four characters per token.
+
+    Args:
+        texts (List[str]): The texts to count.
+
+    Returns:
+        List[int]: The number of tokens in each text.
+    """
+    encoding = _get_token_encoding()
+    if encoding is False:
+        return [(len(text) + 3) // 4 for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
 
-        current_chunk.append(sentence)
-        current_token_count += sentence_tokens
 
-    if current_chunk:
-        chunks.append("".join(current_chunk))
+def count_text_tokens(text: str) -> int:
+    """
+    Count the model tokens in a single text, as count_tokens does.
+
+    Encodes the text directly, without the thread pool tiktoken uses for a batch, which
+    costs more than encoding one short text.
+    """
+    encoding = _get_token_encoding()
+    if encoding is False:
+        return (len(text) + 3) // 4
+    return len(encoding.encode_ordinary(text))
+
+
+def _get_token_encoding():
+    """Return the model's tiktoken encoding, loading it on first use, or False if it can't be loaded."""
+    global _token_encoding
+    with _token_encoding_lock:
+        if _token_encoding is None:
+            try:
+                import tiktoken
+
+                _token_encoding = tiktoken.encoding_for_model(GPT_MODEL)
+            except Exception as e:
+                print(f"Couldn't load the tokenizer for {GPT_MODEL} ({type(e).__name__}). Estimating token counts.")
+                _token_encoding = False
+        return _token_encoding
+
+
+_client = None
+_client_lock = threading.Lock()
 
-    return chunks
 
+def get_openai_client():
+    """
+    Return the shared OpenAI client, creating it on first use.
+
+    openai is imported here rather than at module level, because it is slow to import
+    and only the workers that post-process transcripts need it.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+
+            _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return _client
 
-def process_chunk_with_gpt4(chunk):
+
+def process_chunk_with_gpt4(chunk, job=None):
     """
     Process a chunk of text with GPT-4.
 
+    Results are stored in the on-disk chunk cache, so a chunk that has already been
+    processed with the same prompt, model and temperature is returned without an API call.
+
+    Each request waits for the process's OpenAI rate limiter (see rate_limit_utils), which
+    learns the account's limits from the responses. A request refused with a 429 waits
+    for the limiter again; server and connection errors are retried with exponential
+    backoff, up to GPT_MAX_ATTEMPTS tries in all.
+
     Args:
         chunk (str): The chunk of text to be processed.
+        job (optional): Identifies the transcript the chunk belongs to, so the rate
+            limiter can share the limits fairly between transcripts.
 
     Returns:
         str: The processed chunk of text.
     """
-    max_retries = 3
-    for attempt in range(max_retries):
+    cache = get_chunk_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(chunk, SYSTEM_PROMPT, GPT_MODEL, GPT_TEMPERATURE)
+        cached_chunk = cache.get(cache_key)
+        if cached_chunk is not None:
+            print(f"Cache hit for chunk: {chunk[:50]}...")
+            return cached_chunk
+
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+
+    limiter = get_openai_rate_limiter()
+    # OpenAI counts max_tokens against the token limit when a request is made
+    request_tokens = count_text_tokens(SYSTEM_PROMPT) + count_text_tokens(chunk) + GPT_MAX_OUTPUT_TOKENS
+    for attempt in range(GPT_MAX_ATTEMPTS):
+        limiter.acquire(request_tokens, job)
         try:
+            # Retries are made here rather than by the client, so every attempt goes through the limiter
+            client = get_openai_client().with_options(max_retries=0)
             print(f"Processing chunk: {chunk[:200]}...")
-            response = client.chat.completions.create(
-                model="gpt-4o-2024-11-20",  # Updated to a standard GPT-4 model
+            raw_response = client.chat.completions.with_raw_response.create(
+                model=GPT_MODEL,
                 messages=[
                     {
                         "role": "system",
-                        "content": "You are an AI assistant that receives a verbatim transcript of an interview. You respond with the same text, MINIMALLY edited for clarity. You remove filler words, correct grammatical mistakes, and replace obvious transcription mistakes with the more likely alternative given the context. You remove obvious repetition. If a line from a speaker is just filler, such as '[Spaker 0]: Mhmm.', then you can just delete the line as if the speaker never interrupted. You add links in markdown format to resources mentioned where you are confident of the link (so 'World Health Organisation' could become '[World Health Organisation](https://www.who.int/)'). When a speaker appears to start talking about a new topic, add a markdown-formated h3 header (### [Topic]) before the next speaker is introduced in bold, replacing [Topic] with the actual new topic. The speaker name (e.g. '[SPEAKER 0]:') should precede the speaker text without a line break. You DO NOT invent any new sentences. You DO NOT modify the speaker names in bold. You DO NOT remove any substantial content and you DO NOT summarise answers — the transcript you return should effectively be as long as the original, minus filler words and obvious repetition. You don't need to make speech less casual than it already is. The text should be returned in just the same format as it was received.",
+                        "content": SYSTEM_PROMPT,
                     },
                     {"role": "user", "content": chunk},
                 ],
-                max_tokens=5000,
+                max_tokens=GPT_MAX_OUTPUT_TOKENS,
                 n=1,
-                temperature=0.5,
+                temperature=GPT_TEMPERATURE,
             )
+            limiter.update(raw_response.headers)
+            response = raw_response.parse()
+
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                LLM_TOKENS.observe(usage.prompt_tokens, direction="prompt")
+                LLM_TOKENS.observe(usage.completion_tokens, direction="completion")
 
             if response.choices and len(response.choices) > 0:
                 processed_chunk = response.choices[0].message.content.strip()
                 print(f"Processed chunk: {processed_chunk[:200]}...")
+                if cache is not None:
+                    cache.put(cache_key, processed_chunk)
                 return processed_chunk
             else:
                 print(f"Unexpected response structure: {response}")
                 return None
         except Exception as e:
-            if isinstance(e, RateLimitError) and attempt < max_retries - 1:
-                time.sleep(2**attempt)  # Exponential backoff
+            if isinstance(e, RateLimitError):
+                LLM_RATE_LIMITED.inc()
+                limiter.throttle(e.response.headers)
+            retryable = isinstance(e, (RateLimitError, APIConnectionError, InternalServerError))
+            if retryable and attempt < GPT_MAX_ATTEMPTS - 1:
+                if not isinstance(e, RateLimitError):
+                    time.sleep(2**attempt)  # Exponential backoff
             else:
                 print(f"Error processing chunk: {e}")
                 return None
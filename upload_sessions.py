@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from db_utils import DATABASE_PATH, connect
+
+# Size of each part of a resumable upload. The last part may be shorter
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+# Largest file a resumable upload may be
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+# Unfinished uploads, and their partial files, are removed after this many seconds
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))
+
+
+class UploadSessionError(Exception):
+    """A resumable upload request that can't be accepted, with the HTTP status to reply with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadSessions:
+    """
+    Resumable uploads, sent by the browser as fixed-size parts.
+
+    Each upload is written to a file of its final size in the upload folder, with every
+    part written at its own offset, so parts can arrive in any order and several at once.
+    Which parts have arrived is stored in SQLite, so any web process can accept the next
+    part, and an upload interrupted by a dropped connection or a reload carries on from
+    the parts that are missing instead of starting again.
+    """
+
+    def __init__(
+        self,
+        upload_folder,
+        db_path=DATABASE_PATH,
+        part_size=UPLOAD_PART_SIZE,
+        max_bytes=UPLOAD_MAX_BYTES,
+        ttl=UPLOAD_SESSION_TTL,
+    ):
+        self.upload_folder = upload_folder
+        self.part_size = part_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                part_size INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                fields TEXT NOT NULL DEFAULT '{}',
+                state TEXT NOT NULL,
+                job_id TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_parts (
+                upload_id TEXT NOT NULL,
+                part INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (upload_id, part)
+            )
+            """
+        )
+
+    def create(self, filename, size, fields=None):
+        """
+        Start a resumable upload.
+
+        Args:
+            filename (str): The name of the file being uploaded, already made safe.
+            size (int): The file's size in bytes.
+            fields (dict, optional): Form fields sent with the upload (vocabulary, email).
+
+        Raises:
+            UploadSessionError: If the size is missing or too large.
+
+        Returns:
+            dict: The new upload, as returned by get.
+        """
+        if size <= 0:
+            raise UploadSessionError("The file is empty.")
+        if size > self.max_bytes:
+            raise UploadSessionError(f"Files can be at most {self.max_bytes} bytes.", status=413)
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.upload_folder, f"{upload_id}-{filename}")
+        # Allocate the whole file up front so parts can be written at any offset
+        with open(path, "wb") as f:
+            f.truncate(size)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO uploads (id, filename, size, part_size, path, fields, state,
+                    created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'receiving', ?, ?)
+                """,
+                (upload_id, filename, size, self.part_size, path, json.dumps(fields or {}), now, now),
+            )
+        return self.get(upload_id)
+
+    def get(self, upload_id):
+        """
+        Look up an upload and how much of it has arrived.
+
+        Returns:
+            dict or None: The upload, with the number of parts, the parts still missing,
+                the bytes received, and the offset up to which every byte has arrived.
+                None if there is no such upload.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+            if row is None:
+                return None
+            parts = self._conn.execute(
+                "SELECT part, size FROM upload_parts WHERE upload_id = ? ORDER BY part",
+                (upload_id,),
+            ).fetchall()
+        upload = dict(row)
+        upload["fields"] = json.loads(upload["fields"])
+        upload["parts"] = -(-upload["size"] // upload["part_size"])
+        received = {part["part"] for part in parts}
+        upload["missing_parts"] = [part for part in range(upload["parts"]) if part not in received]
+        upload["received_bytes"] = sum(part["size"] for part in parts)
+        first_missing = upload["missing_parts"][0] if upload["missing_parts"] else upload["parts"]
+        upload["offset"] = min(first_missing * upload["part_size"], upload["size"])
+        return upload
+
+    def part_range(self, upload, part):
+        """
+        Return the byte offset and length of one part of an upload.
+
+        Raises:
+            UploadSessionError: If the upload has no such part.
+        """
+        if not 0 <= part < upload["parts"]:
+            raise UploadSessionError(f"Part {part} is out of range.", status=416)
+        offset = part * upload["part_size"]
+        return offset, min(upload["part_size"], upload["size"] - offset)
+
+    def write_part(self, upload_id, part, stream, content_length, chunk_size):
+        """
+        Write one part of an upload from a request body, and record that it arrived.
+
+        A part is only recorded once all of its bytes are on disk, so a part cut off
+        half way is simply sent again. Sending a part that already arrived overwrites it
+        with the same bytes.
+
+        Args:
+            upload_id (str): The upload.
+            part (int): The part's index, counting from 0.
+            stream: The request body.
+            content_length (int or None): The request's Content-Length.
+            chunk_size (int): How much of the body to read at a time.
+
+        Raises:
+            UploadSessionError: If there is no such upload or part, the upload has already
+                been completed, or the body isn't exactly the part's length.
+
+        Returns:
+            dict: The upload, as returned by get.
+        """
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadSessionError("Upload not found.", status=404)
+        if upload["state"] != "receiving":
+            raise UploadSessionError("Upload has already been completed.", status=409)
+        offset, length = self.part_range(upload, part)
+        if content_length != length:
+            raise UploadSessionError(f"Part {part} must be {length} bytes.")
+
+        written = 0
+        with open(upload["path"], "r+b") as f:
+            f.seek(offset)
+            while written < length:
+                piece = stream.read(min(chunk_size, length - written))
+                if not piece:
+                    break
+                f.write(piece)
+                written += len(piece)
+        if written != length:
+            raise UploadSessionError(f"Part {part} was cut off after {written} bytes.")
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO upload_parts (upload_id, part, size) VALUES (?, ?, ?)",
+                (upload_id, part, length),
+            )
+            self._conn.execute(
+                "UPDATE uploads SET updated_at = ? WHERE id = ?", (time.time(), upload_id)
+            )
+        return self.get(upload_id)
+
+    def complete(self, upload_id):
+        """
+        Mark an upload whose parts have all arrived as complete.
+
+        Only one request can complete an upload, so a repeated request doesn't start a
+        second job.
+
+        Raises:
+            UploadSessionError: If there is no such upload, parts are still missing, or
+                it has already been completed.
+
+        Returns:
+            dict: The upload, as returned by get.
+        """
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadSessionError("Upload not found.", status=404)
+        if upload["missing_parts"]:
+            raise UploadSessionError(
+                f"{len(upload['missing_parts'])} parts are still missing.", status=409
+            )
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE uploads SET state = 'complete', updated_at = ? WHERE id = ? AND state = 'receiving'",
+                (time.time(), upload_id),
+            )
+        if not cursor.rowcount:
+            raise UploadSessionError("Upload has already been completed.", status=409)
+        upload["state"] = "complete"
+        return upload
+
+    def reopen(self, upload_id):
+        """Undo complete, for an upload whose job couldn't be started, so it can be completed again."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE uploads SET state = 'receiving', updated_at = ? WHERE id = ?",
+                (time.time(), upload_id),
+            )
+
+    def set_job(self, upload_id, job_id):
+        """Record the job a completed upload started."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE uploads SET job_id = ?, updated_at = ? WHERE id = ?",
+                (job_id, time.time(), upload_id),
+            )
+
+    def purge_expired(self):
+        """
+        Remove uploads that stopped receiving parts more than ttl seconds ago, with their
+        partial files. Completed uploads are forgotten too; their files belong to the job.
+
+        Returns:
+            int: The number of uploads removed.
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, path, state FROM uploads WHERE updated_at < ?", (cutoff,)
+            ).fetchall()
+            for row in rows:
+                self._conn.execute("DELETE FROM upload_parts WHERE upload_id = ?", (row["id"],))
+                self._conn.execute("DELETE FROM uploads WHERE id = ?", (row["id"],))
+        for row in rows:
+            if row["state"] == "receiving" and os.path.exists(row["path"]):
+                os.remove(row["path"])
+        return len(rows)
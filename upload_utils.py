@@ -0,0 +1,176 @@
+import os
+import secrets
+
+from werkzeug.datastructures import Headers
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    MultipartEncoder,
+    NeedData,
+)
+
+# Size of the pieces read from the incoming request and forwarded upstream
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+class StreamingFormReader:
+    """
+    Reads a multipart/form-data request body incrementally, without spooling it to disk.
+
+    Form fields are collected in memory as they arrive. The first file part is exposed
+    as a generator of byte pieces (see iter_file), so it can be handed straight to
+    requests as a streamed request body. Memory use is bounded by the chunk size,
+    whatever the size of the upload.
+    """
+
+    def __init__(self, stream, boundary, chunk_size=UPLOAD_CHUNK_SIZE, max_field_size=500 * 1024):
+        self.fields = {}
+        self.file_field = None
+        self.filename = None
+        self.file_bytes = 0
+        self._stream = stream
+        self._chunk_size = chunk_size
+        # The decoder's buffer holds at most one unconsumed piece on top of a partial field
+        self._decoder = MultipartDecoder(
+            boundary.encode("latin-1"), max_form_memory_size=chunk_size + max_field_size
+        )
+        self._input_finished = False
+        self._finished = False
+        self._current_field = None
+        self._field_data = []
+        self._in_file = False
+
+    def read_until_file(self):
+        """
+        Consume form fields up to the start of the first file part.
+
+        Returns:
+            str or None: The uploaded filename, or None if the form contains no file.
+        """
+        while self.file_field is None:
+            event = self._next_event()
+            if event is None:
+                return None
+            self._handle_event(event)
+        return self.filename
+
+    def iter_file(self):
+        """
+        Yield the contents of the current file part in pieces of at most chunk_size bytes.
+
+        Yields:
+            bytes: The next piece of the uploaded file.
+        """
+        while self._in_file:
+            event = self._next_event()
+            if event is None:
+                return
+            self._handle_event(event)
+            if isinstance(event, Data) and event.data:
+                self.file_bytes += len(event.data)
+                yield event.data
+
+    def read_remaining_fields(self):
+        """
+        Consume the rest of the body, collecting any fields that came after the file.
+
+        Any file data that has not been read yet is discarded.
+
+        Returns:
+            dict: All form fields received, keyed by name.
+        """
+        while True:
+            event = self._next_event()
+            if event is None:
+                return self.fields
+            self._handle_event(event)
+
+    def _handle_event(self, event):
+        if isinstance(event, Field):
+            self._current_field = event.name
+            self._field_data = []
+        elif isinstance(event, File):
+            self._current_field = None
+            # Only the first file is forwarded; any later ones are skipped
+            if self.file_field is None:
+                self.file_field = event.name
+                self.filename = event.filename
+                self._in_file = True
+        elif isinstance(event, Data):
+            if self._current_field is not None:
+                self._field_data.append(event.data)
+                if not event.more_data:
+                    self.fields[self._current_field] = b"".join(self._field_data).decode("utf-8")
+                    self._current_field = None
+            elif self._in_file and not event.more_data:
+                self._in_file = False
+
+    def _next_event(self):
+        """Return the next multipart event, reading more of the body as needed, or None at the end."""
+        if self._finished:
+            return None
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, Epilogue):
+                self._finished = True
+                self._in_file = False
+                return None
+            if not isinstance(event, NeedData):
+                return event
+            if self._input_finished:
+                # The decoder wants more data but the body has ended: the upload was cut short
+                raise ValueError("Unexpected end of multipart upload.")
+            data = self._stream.read(self._chunk_size)
+            if not data:
+                self._input_finished = True
+                self._decoder.receive_data(None)
+            else:
+                self._decoder.receive_data(data)
+
+
+class MultipartBody:
+    """
+    A multipart/form-data request body that reads its files from disk as it is sent.
+
+    Attachments are streamed in UPLOAD_CHUNK_SIZE pieces rather than loaded into memory,
+    and the files are opened only while the body is being sent. The body can be iterated
+    more than once, so a request that is retried sends it again in full. Its length is
+    known up front, so requests sends it with a Content-Length rather than chunked.
+    """
+
+    def __init__(self, fields, files=(), chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Args:
+            fields (list): (name, value) pairs. A name may be repeated.
+            files (list): (name, filename, path, content_type) tuples.
+            chunk_size (int): Size of the pieces files are read in.
+        """
+        self.fields = list(fields)
+        self.files = list(files)
+        self.boundary = secrets.token_hex(16)
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._chunk_size = chunk_size
+
+    def __iter__(self):
+        return self._encode(read_files=True)
+
+    def __len__(self):
+        envelope = sum(len(piece) for piece in self._encode(read_files=False))
+        return envelope + sum(os.path.getsize(path) for _, _, path, _ in self.files)
+
+    def _encode(self, read_files):
+        encoder = MultipartEncoder(self.boundary.encode("latin-1"))
+        for name, value in self.fields:
+            yield encoder.send_event(Field(name=name, headers=Headers()))
+            yield encoder.send_event(Data(data=str(value).encode("utf-8"), more_data=False))
+        for name, filename, path, content_type in self.files:
+            headers = Headers([("Content-Type", content_type)])
+            yield encoder.send_event(File(name=name, filename=filename, headers=headers))
+            if read_files:
+                with open(path, "rb") as f:
+                    for piece in iter(lambda: f.read(self._chunk_size), b""):
+                        yield encoder.send_event(Data(data=piece, more_data=True))
+        yield encoder.send_event(Epilogue(data=b""))
@@ -0,0 +1,297 @@
+import json
+import os
+import threading
+import time
+
+from db_utils import DATABASE_PATH, connect
+
+# How long a worker may hold a task before another worker is allowed to take it over
+VISIBILITY_TIMEOUT = float(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "900"))
+MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+RETRY_BACKOFF = float(os.getenv("QUEUE_RETRY_BACKOFF", "30"))
+
+
+class WorkQueue:
+    """
+    A durable work queue stored in SQLite.
+
+    Tasks survive restarts and redeploys. A worker leases a task for a visibility
+    timeout; if it doesn't acknowledge the task before the lease runs out (because it
+    crashed, say), the task becomes available to other workers again. Failed tasks are
+    retried with exponential backoff up to max_attempts, then marked as dead.
+    """
+
+    def __init__(
+        self,
+        db_path=DATABASE_PATH,
+        visibility_timeout=VISIBILITY_TIMEOUT,
+        max_attempts=MAX_ATTEMPTS,
+        retry_backoff=RETRY_BACKOFF,
+    ):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                last_error TEXT,
+                dedupe_key TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+        if "dedupe_key" not in columns:
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN dedupe_key TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS tasks_available ON tasks (state, available_at)"
+        )
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS tasks_dedupe_key ON tasks (kind, dedupe_key)"
+        )
+
+    def enqueue(self, kind, payload, dedupe_key=None):
+        """
+        Add a task to the queue.
+
+        If dedupe_key is given and a task of the same kind with that key is already
+        queued, running or done, nothing is added. A dead task with the key is reset and
+        tried again with the new payload.
+
+        Args:
+            kind (str): The name of the handler that should run the task.
+            payload: Any JSON-serialisable value, passed to the handler.
+            dedupe_key (str, optional): Identifies duplicate submissions of the same work.
+
+        Returns:
+            int or None: The task's ID, or None if it was a duplicate.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = None
+                if dedupe_key is not None:
+                    existing = self._conn.execute(
+                        "SELECT id, state FROM tasks WHERE kind = ? AND dedupe_key = ?",
+                        (kind, dedupe_key),
+                    ).fetchone()
+                if existing is None:
+                    cursor = self._conn.execute(
+                        """
+                        INSERT INTO tasks (kind, payload, state, available_at, dedupe_key,
+                            created_at, updated_at)
+                        VALUES (?, ?, 'pending', ?, ?, ?, ?)
+                        """,
+                        (kind, json.dumps(payload), now, dedupe_key, now, now),
+                    )
+                    task_id = cursor.lastrowid
+                elif existing["state"] == "dead":
+                    self._conn.execute(
+                        """
+                        UPDATE tasks SET payload = ?, state = 'pending', attempts = 0,
+                            available_at = ?, lease_owner = NULL, updated_at = ?
+                        WHERE id = ?
+                        """,
+                        (json.dumps(payload), now, now, existing["id"]),
+                    )
+                    task_id = existing["id"]
+                else:
+                    task_id = None
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return task_id
+
+    def retry(self, kind, dedupe_key):
+        """
+        Give a dead task a fresh set of attempts, keeping its payload.
+
+        Args:
+            kind (str): The task's kind.
+            dedupe_key (str): The key the task was enqueued with.
+
+        Returns:
+            bool: True if the task was reset, False if there is no such dead task.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                UPDATE tasks SET state = 'pending', attempts = 0, available_at = ?,
+                    lease_owner = NULL, updated_at = ?
+                WHERE kind = ? AND dedupe_key = ? AND state = 'dead'
+                """,
+                (now, now, kind, dedupe_key),
+            )
+        return cursor.rowcount > 0
+
+    def backlog(self):
+        """Return the number of tasks waiting to run or running."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS count FROM tasks WHERE state IN ('pending', 'leased')"
+            ).fetchone()
+        return row["count"]
+
+    def expire(self):
+        """
+        Mark tasks whose lease ran out on their last attempt as dead, since they most
+        likely killed the worker running them and would otherwise do so forever.
+
+        Returns:
+            list: The tasks marked as dead, with their payloads decoded.
+        """
+        now = time.time()
+        error = "The lease ran out on the last attempt."
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT * FROM tasks
+                    WHERE state = 'leased' AND available_at <= ? AND attempts >= ?
+                    """,
+                    (now, self.max_attempts),
+                ).fetchall()
+                self._conn.executemany(
+                    """
+                    UPDATE tasks SET state = 'dead', lease_owner = NULL, last_error = ?,
+                        updated_at = ?
+                    WHERE id = ?
+                    """,
+                    [(error, now, row["id"]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        tasks = [dict(row, state="dead", lease_owner=None, last_error=error) for row in rows]
+        for task in tasks:
+            task["payload"] = json.loads(task["payload"])
+        return tasks
+
+    def lease(self, owner):
+        """
+        Take the oldest available task, including tasks whose previous lease has expired
+        with attempts left (see expire).
+
+        Args:
+            owner (str): An identifier for the worker taking the task.
+
+        Returns:
+            dict or None: The task (with its payload decoded), or None if nothing is available.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT * FROM tasks
+                    WHERE (state = 'pending' OR (state = 'leased' AND attempts < ?))
+                        AND available_at <= ?
+                    ORDER BY available_at, id
+                    LIMIT 1
+                    """,
+                    (self.max_attempts, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                # While leased, available_at holds the time the lease runs out
+                self._conn.execute(
+                    """
+                    UPDATE tasks SET state = 'leased', lease_owner = ?, attempts = attempts + 1,
+                        available_at = ?, updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (owner, now + self.visibility_timeout, now, row["id"]),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        task = dict(row)
+        task["attempts"] += 1
+        task["payload"] = json.loads(task["payload"])
+        return task
+
+    def extend(self, task_id, owner):
+        """
+        Renew a lease for another visibility timeout, for tasks that take a long time.
+
+        Returns:
+            bool: False if the lease has been lost to another worker.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                UPDATE tasks SET available_at = ?, updated_at = ?
+                WHERE id = ? AND state = 'leased' AND lease_owner = ?
+                """,
+                (now + self.visibility_timeout, now, task_id, owner),
+            )
+        return cursor.rowcount == 1
+
+    def ack(self, task_id, owner):
+        """Mark a leased task as done."""
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE tasks SET state = 'done', updated_at = ?
+                WHERE id = ? AND state = 'leased' AND lease_owner = ?
+                """,
+                (time.time(), task_id, owner),
+            )
+
+    def fail(self, task_id, owner, error):
+        """
+        Record a failed attempt. The task is retried after a backoff, or marked as dead
+        once it has used up its attempts.
+
+        Returns:
+            str: The task's new state, "pending" or "dead".
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts FROM tasks WHERE id = ?", (task_id,)
+            ).fetchone()
+            attempts = row["attempts"] if row else self.max_attempts
+            state = "dead" if attempts >= self.max_attempts else "pending"
+            available_at = now + self.retry_backoff * 2 ** (attempts - 1)
+            self._conn.execute(
+                """
+                UPDATE tasks SET state = ?, available_at = ?, last_error = ?, lease_owner = NULL,
+                    updated_at = ?
+                WHERE id = ? AND state = 'leased' AND lease_owner = ?
+                """,
+                (state, available_at, error, now, task_id, owner),
+            )
+        return state
+
+    def depth(self):
+        """
+        Count the tasks in each state.
+
+        Returns:
+            dict: A mapping from state ("pending", "leased", "done", "dead") to task count.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) AS count FROM tasks GROUP BY state"
+            ).fetchall()
+        return {row["state"]: row["count"] for row in rows}
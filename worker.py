@@ -0,0 +1,174 @@
+# worker.py
+# Drains the work queue that the web app's webhook fills, and sends the emails waiting in
+# the outbox. Run as many of these as needed, independently of the web processes:
+# `python worker.py --threads 2`
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from http_utils import pool_stats
+from job_utils import get_job_store
+from metrics_utils import serve_metrics
+from outbox import OutboxSender, get_outbox
+from pipeline import fail_transcript, process_transcript
+from work_queue import WorkQueue
+
+# Maps each task kind to the function that handles its payload
+HANDLERS = {
+    "process_transcript": process_transcript,
+}
+# Called with a task's payload and last error once the task is dead
+DEAD_LETTER_HANDLERS = {
+    "process_transcript": fail_transcript,
+}
+# Seconds between deletions of the transcript chunks of finished jobs
+PRUNE_INTERVAL = 600
+
+
+def run_task(queue, task, owner):
+    """
+    Run a leased task, renewing its lease while it runs, then acknowledge or fail it.
+
+    Args:
+        queue (WorkQueue): The queue the task came from.
+        task (dict): The leased task.
+        owner (str): The lease owner ID of this worker thread.
+    """
+    finished = threading.Event()
+
+    def renew_lease():
+        while not finished.wait(queue.visibility_timeout / 3):
+            if not queue.extend(task["id"], owner):
+                print(f"Lost the lease on task {task['id']}.")
+                return
+
+    heartbeat = threading.Thread(target=renew_lease, daemon=True)
+    heartbeat.start()
+    start_time = time.perf_counter()
+    try:
+        HANDLERS[task["kind"]](task["payload"])
+    except Exception as e:
+        traceback.print_exc()
+        state = queue.fail(task["id"], owner, str(e))
+        print(f"Task {task['id']} failed on attempt {task['attempts']}; now {state}.")
+        if state == "dead":
+            dead_letter(task, str(e))
+    else:
+        queue.ack(task["id"], owner)
+        print(
+            f"Task {task['id']} ({task['kind']}) done in "
+            f"{time.perf_counter() - start_time:.2f} seconds."
+        )
+        print(f"HTTP pool stats: {pool_stats()}")
+    finally:
+        finished.set()
+
+
+def dead_letter(task, error):
+    """Let a task's handler know that the task is dead, so its job can be marked failed."""
+    handler = DEAD_LETTER_HANDLERS.get(task["kind"])
+    if handler is None:
+        return
+    try:
+        handler(task["payload"], error)
+    except Exception:
+        traceback.print_exc()
+
+
+def work(queue, owner, poll_interval, stopping):
+    """Lease and run tasks until stopping is set, finishing any task in progress."""
+    while not stopping.is_set():
+        expired = queue.expire()
+        if expired:
+            print(f"{len(expired)} tasks whose lease ran out on their last attempt are now dead.")
+        for task in expired:
+            dead_letter(task, task["last_error"])
+        task = queue.lease(owner)
+        if task is None:
+            stopping.wait(poll_interval)
+            continue
+        run_task(queue, task, owner)
+
+
+def prune(stopping):
+    """Delete the transcript chunks of long-finished jobs every PRUNE_INTERVAL, until stopping is set."""
+    job_store = get_job_store()
+    while not stopping.wait(PRUNE_INTERVAL):
+        try:
+            pruned = job_store.prune_chunks()
+        except Exception:
+            traceback.print_exc()
+            continue
+        if pruned:
+            print(f"Deleted {pruned} transcript chunks of finished jobs.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a transcription queue worker.")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.getenv("WORKER_THREADS", "2")),
+        help="Number of tasks to run at once.",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=float(os.getenv("WORKER_POLL_INTERVAL", "2")),
+        help="Seconds to wait before checking an empty queue again.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("WORKER_METRICS_PORT", "9101")),
+        help="Port to serve Prometheus metrics on (0 to turn off).",
+    )
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    queue = WorkQueue()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    print(f"Worker {worker_id} starting with {args.threads} thread(s).")
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        if stopping.is_set():
+            # A second signal means don't wait; unfinished tasks are retried once their leases expire
+            print(" Exiting without waiting for tasks in progress.")
+            os._exit(1)
+        print(" Shutting down worker once tasks in progress are finished.")
+        stopping.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(queue, f"{worker_id}-{index}", args.poll_interval, stopping),
+        )
+        for index in range(args.threads)
+    ]
+    # Emails are sent from their own thread, so Mailgun never holds up a transcript
+    threads.append(
+        threading.Thread(target=OutboxSender(get_outbox()).run, args=(stopping,))
+    )
+    threads.append(threading.Thread(target=prune, args=(stopping,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"Worker {worker_id} stopped.")
+
+
+if __name__ == "__main__":
+    main()